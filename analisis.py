@@ -0,0 +1,214 @@
+# analisis.py
+"""
+/analisis: spending analytics computed on NumPy arrays.
+
+A user's last ANALISIS_MONTHS months (at most ANALISIS_MAX_ROWS rows, newest
+first) are loaded once as columns: amount, day index, month index and
+category code (from the kategori dictionary ids). Monthly trends, moving averages, per-category pace, anomaly
+scores and the month-end projection are then array operations over those
+columns (bincount, cumsum, lexsort), with no per-transaction Python loop.
+The load is bounded by the row cap and the computation runs off the event
+loop under ANALISIS_BUDGET seconds, so the reply time does not grow with
+years of history.
+"""
+import asyncio
+import calendar
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytz
+
+import database as db
+import async_db as adb
+from cache import report_cache
+
+ANALISIS_MONTHS = int(os.getenv("ANALISIS_MONTHS", "12"))
+ANALISIS_MAX_ROWS = int(os.getenv("ANALISIS_MAX_ROWS", "50000"))
+ANALISIS_BUDGET = float(os.getenv("ANALISIS_BUDGET", "3"))  # seconds, load + compute
+MOVING_AVERAGE_MONTHS = 3
+TREND_MONTHS_SHOWN = 6
+TOP_KATEGORI = 5
+# An expense is flagged when its modified z-score (median/MAD) within its
+# category exceeds this, over the last ANOMALY_DAYS days
+ANOMALY_SCORE = 3.5
+ANOMALY_DAYS = 30
+ANOMALY_MIN_SAMPLES = 5
+ANOMALIES_SHOWN = 5
+PROJECTION_DAYS = 90
+
+
+def to_columns(amaun_sen, tarikh, kategori_id, jenis, start, kategori_names: dict) -> dict:
+    """
+    Turns the (amaun_sen, tarikh, kategori_id, jenis) columns from the database
+    into arrays (amounts in ringgit); kategori_names maps the ids to names.
+    """
+    if tarikh and tarikh[0].tzinfo is not None:
+        tz = pytz.timezone(db.TIMEZONE)
+        tarikh = [t.astimezone(tz).replace(tzinfo=None) for t in tarikh]
+    moments = np.array(tarikh, dtype='datetime64[us]')
+    days = moments.astype('datetime64[D]')
+    ids, code = np.unique(np.array([kategori or 0 for kategori in kategori_id], dtype=np.int64),
+                          return_inverse=True)
+    names = np.array([kategori_names.get(int(kategori), '') for kategori in ids], dtype=object)
+    return {
+        "amount": np.asarray(amaun_sen, dtype=np.int64) / 100,
+        "day": (days - np.datetime64(start, 'D')).astype(np.int64),
+        "month": (days.astype('datetime64[M]') - np.datetime64(start, 'M')).astype(np.int64),
+        "code": code.reshape(-1),
+        "names": names,
+        "keluar": np.array(jenis, dtype=object) == 'keluar',
+        "masuk": np.array(jenis, dtype=object) == 'masuk',
+    }
+
+
+def _group_median(sorted_values, starts, counts):
+    """Medians of consecutive groups in an array sorted within each group."""
+    medians = np.zeros(len(counts))
+    present = counts > 0
+    lo = starts[present] + (counts[present] - 1) // 2
+    hi = starts[present] + counts[present] // 2
+    medians[present] = (sorted_values[lo] + sorted_values[hi]) / 2
+    return medians
+
+
+def analyse(cols: dict, start, today, balance: float) -> dict:
+    """All /analisis figures for columns loaded from `start` up to `today`."""
+    amount, day, month, code = cols["amount"], cols["day"], cols["month"], cols["code"]
+    keluar, masuk, names = cols["keluar"], cols["masuk"], cols["names"]
+    n_months = (today.year - start.year) * 12 + today.month - start.month + 1
+    n_kategori = len(names)
+    today_index = (today - start).days
+
+    # Monthly totals and a trailing moving average of spending
+    spend = np.bincount(month[keluar], weights=amount[keluar], minlength=n_months)
+    income = np.bincount(month[masuk], weights=amount[masuk], minlength=n_months)
+    cumulative = np.concatenate(([0.0], np.cumsum(spend)))
+    index = np.arange(n_months)
+    first = np.maximum(index - MOVING_AVERAGE_MONTHS + 1, 0)
+    moving = (cumulative[index + 1] - cumulative[first]) / (index + 1 - first)
+
+    # Spending per category per month; this month against the pro-rated average of the previous ones
+    by_kategori = np.bincount(
+        code[keluar] * n_months + month[keluar], weights=amount[keluar], minlength=n_kategori * n_months
+    ).reshape(n_kategori, n_months)
+    current = by_kategori[:, -1]
+    previous = by_kategori[:, max(0, n_months - 1 - MOVING_AVERAGE_MONTHS):n_months - 1]
+    pace = today.day / calendar.monthrange(today.year, today.month)[1]
+    expected = (previous.mean(axis=1) if previous.shape[1] else np.zeros(n_kategori)) * pace
+    top = np.argsort(-np.maximum(current, expected), kind='stable')[:TOP_KATEGORI]
+
+    # Anomalies: modified z-score of each expense against its category's median and MAD
+    spent, spent_code, spent_day = amount[keluar], code[keluar], day[keluar]
+    counts = np.bincount(spent_code, minlength=n_kategori)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    median = _group_median(spent[np.lexsort((spent, spent_code))], starts, counts)
+    deviation = np.abs(spent - median[spent_code])
+    mad = _group_median(deviation[np.lexsort((deviation, spent_code))], starts, counts)
+    spread = np.maximum(mad[spent_code], 0.05 * median[spent_code] + 0.01)
+    score = 0.6745 * (spent - median[spent_code]) / spread
+    flagged = np.flatnonzero(
+        (score > ANOMALY_SCORE) & (counts[spent_code] >= ANOMALY_MIN_SAMPLES)
+        & (spent_day > today_index - ANOMALY_DAYS)
+    )
+    flagged = flagged[np.argsort(-score[flagged], kind='stable')][:ANOMALIES_SHOWN]
+
+    # Month-end projection from the average daily spend over the last PROJECTION_DAYS
+    history_days = min(PROJECTION_DAYS, today_index - int(day.min()) + 1) if len(day) else 0
+    recent = keluar & (day > today_index - PROJECTION_DAYS)
+    daily_spend = amount[recent].sum() / history_days if history_days else 0.0
+    days_left = calendar.monthrange(today.year, today.month)[1] - today.day
+
+    month_start = np.datetime64(start, 'M')
+    return {
+        "months": [
+            (str(month_start + i), float(spend[i]), float(income[i]), float(moving[i]))
+            for i in range(max(0, n_months - TREND_MONTHS_SHOWN), n_months)
+        ],
+        "kategori": [
+            (str(names[k]) or "lain-lain", float(current[k]), float(expected[k]))
+            for k in top if current[k] or expected[k]
+        ],
+        "anomalies": [
+            (start + timedelta(days=int(spent_day[i])), float(spent[i]), str(names[spent_code[i]]) or "lain-lain",
+             float(median[spent_code[i]]))
+            for i in flagged
+        ],
+        "daily_spend": float(daily_spend),
+        "days_left": days_left,
+        "projected_balance": balance - daily_spend * days_left,
+        "balance": balance,
+    }
+
+
+def _change(current: float, expected: float) -> str:
+    if not expected:
+        return "baru"
+    change = (current - expected) / expected * 100
+    return f"{'▲' if change >= 0 else '▼'} {abs(change):.0f}%"
+
+
+def format_analysis(result: dict, rows: int, capped: bool) -> str:
+    lines = [f"<b>📈 Analisis Perbelanjaan</b> ({ANALISIS_MONTHS} bulan, {rows} transaksi)"]
+    if capped:
+        lines.append(f"<i>Berdasarkan {ANALISIS_MAX_ROWS} transaksi terkini.</i>")
+
+    lines.append(f"\n<b>Trend Bulanan</b> (purata bergerak {MOVING_AVERAGE_MONTHS} bulan):")
+    for label, spend, income, moving in result["months"]:
+        month = datetime.strptime(label, "%Y-%m").strftime("%b %Y")
+        lines.append(f"- {month}: keluar RM{spend:.2f}, masuk RM{income:.2f} (purata RM{moving:.2f})")
+
+    if result["kategori"]:
+        lines.append("\n<b>Kategori Bulan Ini</b> (berbanding kadar biasa):")
+        for nama, current, expected in result["kategori"]:
+            lines.append(f"- {nama.capitalize()}: RM{current:.2f} ({_change(current, expected)})")
+
+    if result["anomalies"]:
+        lines.append(f"\n<b>⚠️ Perbelanjaan Luar Biasa</b> ({ANOMALY_DAYS} hari lepas):")
+        for tarikh, amaun, nama, median in result["anomalies"]:
+            lines.append(f"- {tarikh.strftime('%d %b')}: RM{amaun:.2f} {nama.capitalize()} (biasanya ~RM{median:.2f})")
+
+    lines.append(
+        f"\n<b>🔮 Unjuran Baki Akhir Bulan:</b> RM{result['projected_balance']:.2f}\n"
+        f"<i>Baki semasa RM{result['balance']:.2f}, purata belanja RM{result['daily_spend']:.2f}/hari "
+        f"untuk {result['days_left']} hari lagi, tanpa pendapatan baharu.</i>"
+    )
+    return "\n".join(lines)
+
+
+async def generate_analysis_text(user_id: int) -> str:
+    deadline = time.monotonic() + ANALISIS_BUDGET
+    tz = pytz.timezone(db.TIMEZONE)
+    today = datetime.now(tz).date()
+    cached = await report_cache.get(user_id, 'analisis', today.isoformat())
+    if cached is not None:
+        return cached
+
+    first_month = today.year * 12 + today.month - ANALISIS_MONTHS  # months since year 0, zero-based
+    start = date(first_month // 12, first_month % 12 + 1, 1)
+    since = tz.localize(datetime.combine(start, datetime.min.time()))
+    async with adb.AsyncSessionLocal() as conn:
+        amaun_sen, tarikh, kategori_id, jenis = await adb.get_transaction_columns(conn, user_id, since, ANALISIS_MAX_ROWS)
+        balance = await adb.get_balance(conn, user_id)
+        kategori_names = {kategori: nama for kategori, nama, _ in await adb.get_kategori(conn, user_id)}
+    if not amaun_sen:
+        return f"Tiada transaksi dalam {ANALISIS_MONTHS} bulan lepas untuk dianalisis."
+
+    capped = len(amaun_sen) >= ANALISIS_MAX_ROWS
+    if capped:
+        # Months before the oldest loaded row are not empty, just not loaded
+        oldest = min(tarikh)
+        oldest = oldest.astimezone(tz) if oldest.tzinfo else oldest
+        start = oldest.date().replace(day=1)
+
+    def compute():
+        columns = to_columns(amaun_sen, tarikh, kategori_id, jenis, start, kategori_names)
+        return format_analysis(analyse(columns, start, today, float(balance)), len(amaun_sen), capped)
+
+    try:
+        text = await asyncio.wait_for(asyncio.to_thread(compute), max(deadline - time.monotonic(), 0.1))
+    except asyncio.TimeoutError:
+        return "⏳ Analisis mengambil masa terlalu lama. Sila cuba sebentar lagi."
+    await report_cache.set(user_id, 'analisis', today.isoformat(), value=text)
+    return text
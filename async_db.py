@@ -0,0 +1,152 @@
+import os
+from decimal import Decimal
+from sqlalchemy import select
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import database as db
+from cache import user_cache, snapshot_user
+from group_commit import GroupCommitWriter, WRITE_BATCHING
+
+# Sync drivers mapped onto their asyncio counterparts
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def to_async_url(url: str) -> str:
+    """Rewrites a sync DATABASE_URL so it uses an asyncio driver."""
+    scheme, sep, rest = url.partition("://")
+    backend = scheme.split("+")[0]
+    return f"{ASYNC_DRIVERS.get(backend, scheme)}{sep}{rest}"
+
+ASYNC_DATABASE_URL, _sqlite_pragmas = db.split_sqlite_pragmas(
+    os.getenv("ASYNC_DATABASE_URL") or to_async_url(db.DATABASE_URL)
+)
+
+# Pooled SQLite connections in WAL mode: readers run side by side, and writers
+# wait their turn on the write lock for up to busy_timeout
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
+
+def _engine_options(url: str, pragmas: dict) -> dict:
+    if url.startswith("sqlite"):
+        # Outside WAL a reader blocks writers, and each connection to :memory: is
+        # its own database; there, one shared connection queues sessions on the loop
+        wal = pragmas.get("journal_mode", "").upper() == "WAL"
+        return {"poolclass": AsyncAdaptedQueuePool, "pool_size": SQLITE_POOL_SIZE if wal else 1, "max_overflow": 0}
+    return {}
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL, _sqlite_pragmas))
+db.apply_sqlite_pragmas(async_engine.sync_engine, _sqlite_pragmas)
+# Objects are handed back to handlers after the session closes, so keep them loaded
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+# Coalesces add_transaction calls into shared commits when WRITE_BATCHING=1 (default on SQLite)
+transaction_writer = GroupCommitWriter(AsyncSessionLocal) if WRITE_BATCHING else None
+
+# The query logic lives in database.py; each coroutine runs it on an AsyncSession
+# through run_sync, so the I/O goes through the async driver and yields to the loop.
+
+# --- User Management ---
+async def get_or_create_user(conn, telegram_id, nama):
+    """Returns a cached UserSnapshot; only a cache miss touches the users table."""
+    user = await user_cache.get(telegram_id)
+    if user is None:
+        # Read the version first: an invalidation racing the query then outdates this entry
+        version = await user_cache.version(telegram_id)
+        user = snapshot_user(await conn.run_sync(db.get_or_create_user, telegram_id, nama))
+        user_cache.set(user, version)
+    return user
+
+async def get_user_by_telegram_id(conn, telegram_id):
+    result = await conn.execute(select(db.User).filter(db.User.telegram_id == telegram_id))
+    return result.scalars().first()
+
+async def downgrade_expired_users(conn, mesej: str, now=None) -> list:
+    return await conn.run_sync(db.downgrade_expired_users, mesej, now)
+
+# --- Notification Outbox ---
+async def get_pending_notifications(conn, after_id: int = 0, limit: int = 1000) -> list:
+    return await conn.run_sync(db.get_pending_notifications, after_id, limit)
+
+async def complete_notifications(conn, sent_ids, failed_ids, max_attempts: int) -> int:
+    return await conn.run_sync(db.complete_notifications, sent_ids, failed_ids, max_attempts)
+
+# --- Webhook Deduplication ---
+async def claim_update(conn, update_id: int, now=None) -> bool:
+    return await conn.run_sync(db.claim_update, update_id, now)
+
+async def prune_processed_updates(conn, before) -> int:
+    return await conn.run_sync(db.prune_processed_updates, before)
+
+# --- Transaction Management ---
+async def add_transaction(conn, user_id: int, jenis: str, amaun: Decimal, kategori: str, nota: str):
+    if transaction_writer is not None:
+        return await transaction_writer.add(user_id, jenis, amaun, kategori, nota)
+    return await conn.run_sync(db.add_transaction, user_id, jenis, amaun, kategori, nota)
+
+async def add_transactions(conn, user_id: int, jenis: str, entries) -> list:
+    return await conn.run_sync(db.add_transactions, user_id, jenis, entries)
+
+async def import_transactions(conn, user_id: int, rows, limit: int = None) -> int:
+    return await conn.run_sync(db.import_transactions, user_id, rows, limit)
+
+async def get_transactions(conn, user_id: int, period: str):
+    return await conn.run_sync(db.get_transactions, user_id, period)
+
+async def get_report_totals(conn, user_id: int, period: str) -> dict:
+    return await conn.run_sync(db.get_report_totals, user_id, period)
+
+async def get_range_totals(conn, user_id: int, start_date, end_date) -> dict:
+    return await conn.run_sync(db.get_range_totals, user_id, start_date, end_date)
+
+async def get_report_schedule(conn, user_id: int):
+    return await conn.run_sync(db.get_report_schedule, user_id)
+
+async def set_report_schedule(conn, user_id: int, enable: bool = True, **changes):
+    return await conn.run_sync(db.set_report_schedule, user_id, enable, **changes)
+
+async def disable_report_schedule(conn, user_id: int) -> bool:
+    return await conn.run_sync(db.disable_report_schedule, user_id)
+
+async def get_due_schedules(conn, now, after=None, limit: int = 1000) -> list:
+    return await conn.run_sync(db.get_due_schedules, now, after, limit)
+
+async def get_period_totals(conn, user_ids, zon_waktu: str, start_date, end_date) -> dict:
+    return await conn.run_sync(db.get_period_totals, user_ids, zon_waktu, start_date, end_date)
+
+async def advance_report_schedules(conn, advances):
+    return await conn.run_sync(db.advance_report_schedules, advances)
+
+async def get_data_version(conn, user_id: int) -> int:
+    return await conn.run_sync(db.get_data_version, user_id)
+
+async def get_daily_totals(conn, user_id: int, start_date, end_date, jenis: str = 'keluar') -> dict:
+    return await conn.run_sync(db.get_daily_totals, user_id, start_date, end_date, jenis)
+
+async def get_balance(conn, user_id: int):
+    return await conn.run_sync(db.get_balance, user_id)
+
+async def delete_transaction(conn, user_id: int, transaction_id: int):
+    return await conn.run_sync(db.delete_transaction, user_id, transaction_id)
+
+async def delete_transactions(conn, user_id: int, first_id: int, last_id: int, tarikh=None) -> int:
+    return await conn.run_sync(db.delete_transactions, user_id, first_id, last_id, tarikh)
+
+async def get_kategori(conn, user_id: int, limit: int = None):
+    return await conn.run_sync(db.get_kategori, user_id, limit)
+
+async def get_transaction_page(conn, user_id: int, cursor=None, older: bool = True, limit: int = 10):
+    return await conn.run_sync(db.get_transaction_page, user_id, cursor, older, limit)
+
+async def get_transaction_columns(conn, user_id: int, since, limit: int):
+    return await conn.run_sync(db.get_transaction_columns, user_id, since, limit)
+
+async def archive_transactions(conn, before, user_id: int = None, batch_size: int = 5000) -> int:
+    return await conn.run_sync(db.archive_transactions, before, user_id, batch_size)
+
+async def get_all_transactions_by_user(conn, user_id: int):
+    return await conn.run_sync(db.get_all_transactions_by_user, user_id)
+
+async def count_transactions(conn, user_id: int) -> int:
+    return await conn.run_sync(db.count_transactions, user_id)
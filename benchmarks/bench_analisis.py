@@ -0,0 +1,122 @@
+"""
+/analisis latency for users with 1, 3 and 10 years of history.
+
+Seeds one user per history length at --per-day transactions a day, then times
+generate_analysis_text uncached, split into the column load and the NumPy
+computation, and checks the total against ANALISIS_BUDGET.
+
+    python benchmarks/bench_analisis.py --years 1,3,10 --per-day 20
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import use_temp_database
+
+KATEGORI = ["makan", "minyak", "sewa", "bil", "kopi", "barang", "tol", "parking", None]
+
+
+def seed(db, user_id, days, per_day):
+    import pytz
+    tz = pytz.timezone(db.TIMEZONE)
+    now = datetime.now(tz).replace(tzinfo=None)
+    rng = random.Random(user_id)
+    conn = db.engine.raw_connection()
+    try:
+        batch = []
+        for _ in range(days * per_day):
+            kategori = rng.choice(KATEGORI)
+            jenis = 'masuk' if rng.random() < 0.05 else 'keluar'
+            # Mostly small spends with the odd large one, so anomalies have something to find
+            amaun_sen = round(rng.lognormvariate(3, 0.6) * (8 if rng.random() < 0.002 else 1) * 100)
+            tarikh = now - timedelta(seconds=rng.randrange(days * 86400))
+            batch.append((user_id, jenis, amaun_sen, kategori, "nota", tarikh))
+            if len(batch) == 50000:
+                conn.cursor().executemany(
+                    "INSERT INTO transactions (user_id, jenis, amaun_sen, kategori, nota, tarikh) VALUES (?, ?, ?, ?, ?, ?)", batch)
+                batch = []
+        if batch:
+            conn.cursor().executemany(
+                "INSERT INTO transactions (user_id, jenis, amaun_sen, kategori, nota, tarikh) VALUES (?, ?, ?, ?, ?, ?)", batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+async def run(db, adb, analisis, user_id, repeat):
+    from cache import report_cache
+    import pytz
+    tz = pytz.timezone(db.TIMEZONE)
+    today = datetime.now(tz).date()
+    first_month = today.year * 12 + today.month - analisis.ANALISIS_MONTHS
+    start = today.replace(year=first_month // 12, month=first_month % 12 + 1, day=1)
+    since = tz.localize(datetime.combine(start, datetime.min.time()))
+
+    with next(db.get_db()) as conn:
+        names = {kategori: nama for kategori, nama, _ in db.get_kategori(conn, user_id)}
+    load = compute = total = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        async with adb.AsyncSessionLocal() as conn:
+            columns = await adb.get_transaction_columns(conn, user_id, since, analisis.ANALISIS_MAX_ROWS)
+        elapsed = time.perf_counter() - started
+        load = elapsed if load is None else min(load, elapsed)
+
+        elapsed, _ = best_of(lambda: analisis.analyse(analisis.to_columns(*columns, start, names), start, today, 0.0), 1)
+        compute = elapsed if compute is None else min(compute, elapsed)
+
+        report_cache.invalidate_user(user_id)
+        started = time.perf_counter()
+        await analisis.generate_analysis_text(user_id)
+        elapsed = time.perf_counter() - started
+        total = elapsed if total is None else min(total, elapsed)
+    # Each asyncio.run needs fresh pooled connections
+    await adb.async_engine.dispose()
+    return len(columns[0]), load, compute, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url")
+    parser.add_argument("--years", default="1,3,10")
+    parser.add_argument("--per-day", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    use_temp_database(args.database_url)
+    import database as db
+    import async_db as adb
+    import analisis
+    db.init_db()
+
+    years = [int(y) for y in args.years.split(",")]
+    for user_id, y in enumerate(years, start=1):
+        seed(db, user_id, y * 365, args.per_day)
+    with next(db.get_db()) as conn:
+        db.backfill_kategori_ids(conn)
+        db.rebuild_user_stats(conn)
+
+    print(f"budget {analisis.ANALISIS_BUDGET:.1f}s, window {analisis.ANALISIS_MONTHS} months, "
+          f"cap {analisis.ANALISIS_MAX_ROWS} rows")
+    print(f"{'years':>5} {'stored':>9} {'analysed':>9} {'load (ms)':>10} {'numpy (ms)':>11} {'total (ms)':>11}  in budget")
+    for user_id, y in enumerate(years, start=1):
+        rows, load, compute, total = asyncio.run(run(db, adb, analisis, user_id, args.repeat))
+        stored = y * 365 * args.per_day
+        print(f"{y:>5} {stored:>9} {rows:>9} {load * 1000:>10.1f} {compute * 1000:>11.1f} {total * 1000:>11.1f}  "
+              f"{total <= analisis.ANALISIS_BUDGET}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Hot-path query cost as history grows, before and after archiving.
+
+Seeds one user per history length (--years) at --per-day transactions a day,
+times the per-user queries handlers run (balance, count, kategori, the first
+/senarai page, the monthly report, the full history load) and then archives
+everything older than ARCHIVE_AFTER_DAYS and times them again. Balances are
+checked to be unchanged by the move.
+
+    python benchmarks/bench_archive.py --years 1,3,10 --per-day 20
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import use_temp_database
+
+KATEGORI = ["makan", "minyak", "sewa", "bil", "kopi", "barang", "tol", "parking", None]
+
+
+def seed(db, user_id, days, per_day):
+    import pytz
+    now = datetime.now(pytz.timezone(db.TIMEZONE)).replace(tzinfo=None)
+    rng = random.Random(user_id)
+    conn = db.engine.raw_connection()
+    try:
+        batch = []
+        for _ in range(days * per_day):
+            # Old years used a wider set of categories than the current one
+            kategori = rng.choice(KATEGORI) if rng.random() < 0.9 else f"lama{rng.randrange(200)}"
+            jenis = 'masuk' if rng.random() < 0.05 else 'keluar'
+            tarikh = now - timedelta(seconds=rng.randrange(days * 86400))
+            batch.append((user_id, jenis, rng.randrange(100, 20000), kategori, "nota", tarikh))
+            if len(batch) == 50000:
+                conn.cursor().executemany(
+                    "INSERT INTO transactions (user_id, jenis, amaun_sen, kategori, nota, tarikh) VALUES (?, ?, ?, ?, ?, ?)", batch)
+                batch = []
+        if batch:
+            conn.cursor().executemany(
+                "INSERT INTO transactions (user_id, jenis, amaun_sen, kategori, nota, tarikh) VALUES (?, ?, ?, ?, ?, ?)", batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def hot_queries(db, conn, user_id):
+    return {
+        "balance": lambda: db.get_balance(conn, user_id),
+        "count": lambda: db.count_transactions(conn, user_id),
+        "kategori": lambda: db.get_kategori(conn, user_id),
+        "senarai": lambda: db.get_transaction_page(conn, user_id),
+        "bulanan": lambda: db.get_report_totals(conn, user_id, 'bulanan'),
+        "all rows": lambda: conn.expunge_all() or db.get_all_transactions_by_user(conn, user_id),
+    }
+
+
+def measure(db, years, repeat):
+    timings = {}
+    with next(db.get_db()) as conn:
+        for user_id, _ in enumerate(years, start=1):
+            timings[user_id] = {name: best_of(fn, repeat) for name, fn in hot_queries(db, conn, user_id).items()}
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url")
+    parser.add_argument("--years", default="1,3,10")
+    parser.add_argument("--per-day", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    use_temp_database(args.database_url)
+    import database as db
+    db.init_db()
+
+    years = [int(y) for y in args.years.split(",")]
+    for user_id, y in enumerate(years, start=1):
+        seed(db, user_id, y * 365, args.per_day)
+    with next(db.get_db()) as conn:
+        db.backfill_kategori_ids(conn)
+        db.rebuild_user_stats(conn)
+        balances = [db.get_balance(conn, user_id) for user_id, _ in enumerate(years, start=1)]
+
+    before = measure(db, years, args.repeat)
+    with next(db.get_db()) as conn:
+        started = time.perf_counter()
+        moved = db.archive_transactions(conn, db.archive_cutoff())
+        archive_time = time.perf_counter() - started
+        conn.expire_all()
+        unchanged = all(
+            db.get_balance(conn, user_id) == balance
+            for (user_id, _), balance in zip(enumerate(years, start=1), balances)
+        )
+        hot = conn.query(db.Transaction).count()
+    after = measure(db, years, args.repeat)
+
+    print(f"archived {moved} rows older than {db.ARCHIVE_AFTER_DAYS} days in {archive_time:.1f}s; "
+          f"{hot} rows stay hot; balances unchanged: {unchanged}")
+    names = list(next(iter(before.values())))
+    print(f"{'years':>5} {'query':<9} {'before (ms)':>12} {'after (ms)':>11}")
+    for user_id, y in enumerate(years, start=1):
+        for name in names:
+            print(f"{y:>5} {name:<9} {before[user_id][name] * 1000:>12.2f} {after[user_id][name] * 1000:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
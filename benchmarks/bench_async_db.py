@@ -0,0 +1,102 @@
+"""
+Concurrent webhook latency: sync SessionLocal vs the async_db layer.
+
+Each simulated update does what /belanja does (user lookup, free-tier count,
+insert) followed by a simulated Telegram reply. Every fourth update is a
+DB-free command (/help); its latency shows how long the loop was stalled by
+other users' queries. With the sync layer every DB round trip blocks the loop.
+
+On SQLite the async layer only beats the sync one with group commit, which
+is the default there: with WRITE_BATCHING=0 each insert waits for the write
+lock on its own and /belanja gets slower, while /help still improves.
+Measured with the defaults (1000 updates, concurrency 100, WAL,
+SQLITE_POOL_SIZE=4):
+
+    WRITE_BATCHING=1   sync  /belanja p50 298 ms  p99 776 ms   174 updates/s
+                       async /belanja p50 275 ms  p99 361 ms   444 updates/s
+    WRITE_BATCHING=0   sync  /belanja p50 278 ms  p99 686 ms   189 updates/s
+                       async /belanja p50 854 ms  p99 1189 ms  147 updates/s
+
+    python benchmarks/bench_async_db.py --updates 2000 --concurrency 200
+    WRITE_BATCHING=0 python benchmarks/bench_async_db.py
+    python benchmarks/bench_async_db.py --database-url postgresql://...
+"""
+import argparse
+import asyncio
+import time
+
+from common import use_temp_database, summarise, print_row
+
+
+async def sync_update(db, telegram_id, reply_latency):
+    with next(db.get_db()) as conn:
+        user = db.get_or_create_user(conn, telegram_id, f"user {telegram_id}")
+        db.count_transactions(conn, user.id)
+        db.add_transaction(conn, user.id, 'keluar', 12.5, 'makan', 'makan tengahari')
+        db.get_balance(conn, user.id)
+    await asyncio.sleep(reply_latency)
+
+
+async def async_update(adb, telegram_id, reply_latency):
+    # As handle_transaction: reads and the insert in separate sessions, so no
+    # connection is held while the insert waits for a group commit
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, telegram_id, f"user {telegram_id}")
+        await adb.count_transactions(conn, user.id)
+        await adb.get_balance(conn, user.id)
+    async with adb.AsyncSessionLocal() as conn:
+        await adb.add_transaction(conn, user.id, 'keluar', 12.5, 'makan', 'makan tengahari')
+    await asyncio.sleep(reply_latency)
+
+
+async def help_update(reply_latency):
+    await asyncio.sleep(reply_latency)
+
+
+async def run(label, make_update, updates, concurrency, users, reply_latency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = {"belanja": [], "help": []}
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            if i % 4 == 3:
+                await help_update(reply_latency)
+                latencies["help"].append(time.perf_counter() - started)
+            else:
+                await make_update(1000 + i % users)
+                latencies["belanja"].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(updates)))
+    elapsed = time.perf_counter() - started
+    print(f"{label} — throughput {updates / elapsed:.1f} updates/s")
+    for command, samples in latencies.items():
+        print_row(f"  /{command}", summarise(samples))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--reply-latency", type=float, default=0.05, help="simulated Telegram round trip (s)")
+    args = parser.parse_args()
+
+    use_temp_database(args.database_url)
+    import database as db
+    import async_db as adb
+    db.init_db()
+    print(f"{db.engine.dialect.name}: WRITE_BATCHING={int(adb.transaction_writer is not None)}, "
+          f"async pool size {adb.async_engine.pool.size()}")
+
+    await run("before (sync SessionLocal)", lambda tid: sync_update(db, tid, args.reply_latency),
+              args.updates, args.concurrency, args.users, args.reply_latency)
+    await run("after (async_db)", lambda tid: async_update(adb, tid, args.reply_latency),
+              args.updates, args.concurrency, args.users, args.reply_latency)
+    await adb.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""
+Chart render throughput, and what rendering does to the event loop.
+
+Renders --charts bulanan-sized charts (a 31-day bar chart beside a kategori
+pie) at once in each mode, while a ticker on the event loop measures how
+late its 5 ms sleeps wake up:
+
+  inline   render_report_chart called in the handler, on the event loop
+  thread   ChartRenderer(workers=0): a thread, sharing the GIL with the loop
+  pool N   ChartRenderer(workers=N): N spawned worker processes
+
+    python benchmarks/bench_charts.py --charts 40 --workers 1,2,4
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+from common import ROOT
+
+sys.path.insert(0, ROOT)
+import charts  # noqa: E402
+
+KATEGORI = ["makan", "minyak", "sewa", "bil", "kopi", "barang", "tol", "parking", "hiburan", "kesihatan", "hadiah"]
+TICK = 0.005
+
+
+def sample(seed):
+    rng = random.Random(seed)
+    kategori = sorted(((nama, round(rng.uniform(10, 900), 2)) for nama in KATEGORI), key=lambda item: -item[1])
+    days = [(str(day), round(rng.uniform(0, 150), 2)) for day in range(1, 32)]
+    return f"Laporan Bulanan #{seed}", kategori, days
+
+
+async def ticker(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def run(mode, workers, count):
+    renderer = charts.ChartRenderer(workers=workers) if mode != "inline" else None
+    if renderer is not None and workers:
+        # Start the workers (and import matplotlib in them) outside the measurement
+        await asyncio.gather(*(renderer.render(*sample(-i)) for i in range(workers)))
+
+    async def render(seed):
+        if renderer is None:
+            return charts.render_report_chart(*sample(seed))
+        return await renderer.render(*sample(seed))
+
+    stop, lags = asyncio.Event(), []
+    tick = asyncio.create_task(ticker(stop, lags))
+    await asyncio.sleep(TICK * 2)
+    started = time.perf_counter()
+    pngs = await asyncio.gather(*(render(seed) for seed in range(count)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    if renderer is not None:
+        renderer.shutdown()
+    lags.sort()
+    return elapsed, sum(map(len, pngs)) / len(pngs), lags[len(lags) // 2], lags[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--charts", type=int, default=40)
+    parser.add_argument("--workers", default="1,2,4")
+    args = parser.parse_args()
+
+    charts.render_report_chart(*sample(0))  # import matplotlib and warm its font cache in this process
+    modes = [("inline", 0), ("thread", 0)] + [(f"pool {n}", int(n)) for n in args.workers.split(",")]
+    print(f"{args.charts} charts per mode, {os.cpu_count()} CPUs")
+    print(f"{'mode':<8} {'charts/s':>9} {'ms/chart':>9} {'PNG KB':>7} {'loop lag p50 (ms)':>18} {'max (ms)':>9}")
+    for name, workers in modes:
+        mode = name.split()[0]
+        elapsed, size, lag_p50, lag_max = asyncio.run(run(mode, workers, args.charts))
+        print(f"{name:<8} {args.charts / elapsed:>9.1f} {elapsed / args.charts * 1000:>9.1f} {size / 1024:>7.0f} "
+              f"{lag_p50 * 1000:>18.1f} {lag_max * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Cold-start time of main.py, measured in fresh interpreters.
+
+Each run starts a new Python process that imports main and runs startup()
+(with the Telegram API stubbed out), then prints the startup_timing report.
+Results are averaged per phase and can be written as JSON to compare commits.
+
+    python benchmarks/bench_cold_start.py --runs 10 --output cold_start.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import ROOT, use_temp_database
+
+CHILD = r"""
+import asyncio, json, time
+t0 = time.perf_counter()
+import telegram
+
+async def _post(self, endpoint, data=None, *args, **kwargs):
+    if endpoint == "getMe":
+        return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+    return True
+telegram.Bot._post = _post
+
+import main
+asyncio.run(main.startup())
+report = main.startup_timing.report()
+report["wall_ms"] = (time.perf_counter() - t0) * 1000
+print("REPORT " + json.dumps(report))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="write the averaged results to this JSON file")
+    args = parser.parse_args()
+
+    env = dict(os.environ, BOT_TOKEN="123:bench", DATABASE_URL=use_temp_database())
+    env["PYTHONPATH"] = ROOT
+    import database as db
+    db.init_db()
+
+    runs = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True)
+        elapsed = (time.perf_counter() - started) * 1000
+        line = next((l for l in out.stdout.splitlines() if l.startswith("REPORT ")), None)
+        if line is None:
+            sys.exit(out.stderr)
+        report = json.loads(line[len("REPORT "):])
+        report["process_ms"] = elapsed
+        runs.append(report)
+
+    phases = {}
+    for report in runs:
+        for entry in report["phases"]:
+            phases.setdefault(entry["phase"], []).append(entry["ms"])
+    summary = {
+        "runs": args.runs,
+        "process_ms": sum(r["process_ms"] for r in runs) / len(runs),
+        "in_process_ms": sum(r["wall_ms"] for r in runs) / len(runs),
+        "phases": {name: sum(values) / len(values) for name, values in phases.items()},
+    }
+    print(f"process (interpreter + import + startup): {summary['process_ms']:.1f}ms")
+    print(f"import main + startup():                  {summary['in_process_ms']:.1f}ms")
+    for name, ms in summary["phases"].items():
+        print(f"  {name:<36} {ms:8.1f}ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
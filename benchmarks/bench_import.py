@@ -0,0 +1,73 @@
+"""
+/import throughput: parse + batched insert of a backup CSV.
+
+Generates a CSV in the /backup layout (with a sprinkling of malformed rows),
+then times importer.parse_backup_csv and database.import_transactions, and
+compares against inserting a sample of the same rows one add_transaction
+call at a time, as /belanja does.
+
+    python benchmarks/bench_import.py --rows 100000
+"""
+import argparse
+import csv
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import use_temp_database
+
+
+def make_csv(rows: int, bad_every: int) -> bytes:
+    rng = random.Random(1)
+    start = datetime(2023, 1, 1)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['ID', 'Jenis', 'Amaun', 'Kategori', 'Nota', 'Tarikh'])
+    for i in range(rows):
+        kategori = rng.choice(["makan", "minyak", "sewa", "bil", "kopi"])
+        amaun = "x" if bad_every and i % bad_every == 0 else f"{rng.uniform(1, 300):.2f}"
+        tarikh = (start + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S")
+        writer.writerow([i + 1, rng.choice(["keluar"] * 9 + ["masuk"]), amaun, kategori, f"{kategori} nota", tarikh])
+    return out.getvalue().encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--bad-every", type=int, default=1000, help="make every Nth row malformed (0: none)")
+    parser.add_argument("--baseline-rows", type=int, default=2000, help="rows inserted one by one for comparison")
+    args = parser.parse_args()
+
+    use_temp_database(args.database_url)
+    import database as db
+    import importer
+    db.init_db()
+
+    data = make_csv(args.rows, args.bad_every)
+    started = time.perf_counter()
+    rows, errors = importer.parse_backup_csv(data)
+    parse_time = time.perf_counter() - started
+
+    with next(db.get_db()) as conn:
+        started = time.perf_counter()
+        inserted = db.import_transactions(conn, 1, rows)
+        insert_time = time.perf_counter() - started
+
+        sample = rows[:args.baseline_rows]
+        started = time.perf_counter()
+        for row in sample:
+            db.add_transaction(conn, 2, row['jenis'], row['amaun'], row['kategori'], row['nota'])
+        baseline_time = time.perf_counter() - started
+
+    total = parse_time + insert_time
+    print(f"file: {len(data) / 1e6:.1f} MB, {args.rows} rows, {len(errors)} malformed")
+    print(f"parse:           {parse_time:7.2f}s  {len(rows) / parse_time:10.0f} rows/s")
+    print(f"batched insert:  {insert_time:7.2f}s  {inserted / insert_time:10.0f} rows/s")
+    print(f"end to end:      {total:7.2f}s  {inserted / total:10.0f} rows/s")
+    print(f"add_transaction: {baseline_time:7.2f}s  {len(sample) / baseline_time:10.0f} rows/s ({len(sample)} rows, one commit each)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+End-to-end load test: realistic update mixes posted to the /telegram route.
+
+Fills a database with datagen, starts telegram_stub as the Bot API, and posts
+Telegram updates for /belanja, /masuk, /laporan, /baki, /backup and /help from
+many users concurrently, then calls the cron endpoints. Reports throughput and
+p50/p95/p99 latency per command and writes everything to a JSON file, so runs
+on different commits can be compared. /backup is premium-only, so it goes to
+premium users with transactions, and the run checks that every /backup got
+at least one sendDocument back.
+
+By default the app runs in-process with PIPELINE_WORKERS=0, so each POST
+returns only once its update has been handled and its latency is the
+command's. With --target, updates go to an already running server instead;
+start it with TELEGRAM_API_BASE_URL pointing at a telegram_stub (and
+PIPELINE_WORKERS=0 for the same meaning of latency).
+
+    python benchmarks/bench_load.py --users 1000 --per-user 200 --updates 5000 --concurrency 50
+    python benchmarks/bench_load.py --baseline benchmarks/results/load-abc1234-....json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from common import ROOT, use_temp_database, summarise, print_row
+
+DEFAULT_MIX = "belanja=45,masuk=5,laporan=20,baki=20,backup=2,help=8"
+LAPORAN_OPTIONS = ["harian", "mingguan", "bulanan", "tahunan", "yoy"]
+CRON_ENDPOINTS = ["/api/cron/downgrade_users", "/api/cron/auto_reports"]
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        command, weight = part.split("=")
+        mix[command.strip()] = float(weight)
+    return mix
+
+
+def command_text(command: str, rng: random.Random) -> str:
+    if command in ("belanja", "masuk"):
+        kategori = "gaji" if command == "masuk" else rng.choice(["makan", "kopi", "minyak", "tol"])
+        return f"/{command} {rng.uniform(1, 200):.2f} {kategori} bench"
+    if command == "laporan":
+        return f"/laporan {rng.choice(LAPORAN_OPTIONS)}"
+    return f"/{command}"
+
+
+def make_update(update_id: int, telegram_id: int, text: str) -> dict:
+    command = text.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": {"id": telegram_id, "is_bot": False, "first_name": f"Pengguna {telegram_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(latency: float) -> str:
+    """Runs telegram_stub in a background thread; returns its base URL."""
+    import uvicorn
+    from telegram_stub import build_app
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(build_app(latency), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def drive(client, args, telegram_ids, backup_ids) -> dict:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    commands, weights = list(mix), list(mix.values())
+    update_ids = itertools.count(1)
+    latencies = {command: [] for command in commands}
+    errors = {command: 0 for command in commands}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(command, telegram_id):
+        update = make_update(next(update_ids), telegram_id, command_text(command, rng))
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post("/telegram", json=update)
+            latencies[command].append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors[command] += 1
+
+    plan = []
+    for _ in range(args.updates):
+        command = rng.choices(commands, weights)[0]
+        plan.append((command, rng.choice(backup_ids if command == "backup" and backup_ids else telegram_ids)))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(command, telegram_id) for command, telegram_id in plan))
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for command in commands:
+        stats = summarise(latencies[command])
+        stats["errors"] = errors[command]
+        results[f"/{command}"] = stats
+    return {"seconds": elapsed, "throughput_per_s": args.updates / elapsed, "commands": results}
+
+
+async def run_crons(client, runs: int) -> dict:
+    results = {}
+    for endpoint in CRON_ENDPOINTS:
+        samples, replies = [], []
+        for _ in range(runs):
+            started = time.perf_counter()
+            response = await client.get(endpoint, timeout=None)
+            samples.append(time.perf_counter() - started)
+            replies.append(response.json())
+        stats = summarise(samples)
+        stats["first_reply"] = replies[0]
+        results[endpoint] = stats
+    return results
+
+
+def compare(baseline: dict, current: dict):
+    print(f"\nvs baseline {baseline.get('commit')} ({baseline.get('created_at')}):")
+    rows = {**baseline.get("commands", {}), **baseline.get("cron", {})}
+    for name, stats in {**current["commands"], **current["cron"]}.items():
+        before = rows.get(name)
+        if not before:
+            continue
+        deltas = []
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            change = (stats[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            deltas.append(f"{key[:3]} {before[key]:8.2f} -> {stats[key]:8.2f}ms ({change:+5.1f}%)")
+        print(f"  {name:<28} " + "  ".join(deltas))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--per-user", type=int, default=100)
+    parser.add_argument("--skip-generate", action="store_true", help="use the data already in --database-url")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"command=weight,... (default: {DEFAULT_MIX})")
+    parser.add_argument("--cron-runs", type=int, default=3)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="simulated Bot API round trip (s)")
+    parser.add_argument("--target", help="base URL of a running bot (default: run it in-process)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/load-<commit>-<time>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    import httpx
+
+    url = use_temp_database(args.database_url)
+    from datagen import TELEGRAM_ID_BASE, generate
+    import database as db
+    db.init_db()
+    data = None
+    if not args.skip_generate:
+        data = generate(db, args.users, args.per_user)
+        print(f"Generated {data['users']} users, {data['transactions']} transactions in {data['seconds']:.1f}s")
+    with next(db.get_db()) as conn:
+        users = conn.query(db.User.telegram_id).filter(db.User.telegram_id >= TELEGRAM_ID_BASE).count()
+        # Users whose /backup sends a file: an active subscription and something to export
+        backup_ids = [telegram_id for (telegram_id,) in conn.query(db.User.telegram_id).filter(
+            db.User.telegram_id >= TELEGRAM_ID_BASE, db.User.status == 'premium',
+            db.User.subscription_end > datetime.now(),
+            db.User.id.in_(conn.query(db.Transaction.user_id).distinct()),
+        )]
+    telegram_ids = [TELEGRAM_ID_BASE + n for n in range(users)]
+    if not backup_ids:
+        print("Warning: no premium users with transactions; /backup will only get the premium-only reply")
+
+    app = None
+    if args.target:
+        client = httpx.AsyncClient(base_url=args.target, timeout=60)
+        stub_url = None
+    else:
+        stub_url = start_stub(args.telegram_latency)
+        os.environ.update(TELEGRAM_API_BASE_URL=stub_url, PIPELINE_WORKERS="0", BOT_TOKEN="123456:bench")
+        import main as app
+        await app.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://bot", timeout=60)
+
+    try:
+        load = await drive(client, args, telegram_ids, backup_ids)
+        cron = await run_crons(client, args.cron_runs)
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.shutdown()
+
+    telegram = None
+    if stub_url:
+        async with httpx.AsyncClient() as stub:
+            telegram = (await stub.get(f"{stub_url}/_stats")).json()
+
+    print(f"\n{args.updates} updates, concurrency {args.concurrency}: {load['throughput_per_s']:.1f} updates/s")
+    for name, stats in {**load["commands"], **cron}.items():
+        print_row(name, stats)
+    if telegram:
+        print(f"Bot API calls: {telegram['calls']}")
+        backups = load["commands"].get("/backup", {}).get("count", 0)
+        documents = telegram["calls"].get("sendDocument", 0)
+        # A large export is sent in several parts, so one /backup can be several documents
+        if documents < backups:
+            print(f"Warning: {backups} /backup updates but only {documents} sendDocument calls")
+        else:
+            print(f"/backup: {backups} updates, {documents} sendDocument calls")
+
+    results = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {**vars(args), "database_url": url.split("@")[-1]},
+        "data": data,
+        "throughput_per_s": load["throughput_per_s"],
+        "seconds": load["seconds"],
+        "commands": load["commands"],
+        "cron": cron,
+        "telegram": telegram,
+    }
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"load-{results['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
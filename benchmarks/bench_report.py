@@ -0,0 +1,101 @@
+"""
+Monthly report cost: loading every Transaction vs SQL aggregation.
+
+Fills one user's current month with N rows and times the old path
+(get_transactions + Python loop) against get_report_totals, checking that
+both produce the same report.
+
+    python benchmarks/bench_report.py --sizes 1000,100000,1000000
+"""
+import argparse
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from common import use_temp_database
+
+KATEGORI = ["makan", "minyak", "sewa", "bil", "Makan", "kopi", "parking", "barang", "tol", "hadiah"]
+
+
+def seed(db, user_id, rows):
+    import pytz
+    tz = pytz.timezone(db.TIMEZONE)
+    now = datetime.now(tz)
+    month_start = tz.localize(datetime.combine(now.date().replace(day=1), datetime.min.time()))
+    span = max(1, int((now - month_start).total_seconds()))
+    rng = random.Random(user_id)
+    conn = db.engine.raw_connection()
+    try:
+        batch = []
+        for _ in range(rows):
+            kategori = rng.choice(KATEGORI)
+            tarikh = (month_start + timedelta(seconds=rng.randrange(span))).replace(tzinfo=None)
+            jenis = 'masuk' if rng.random() < 0.1 else 'keluar'
+            batch.append((user_id, jenis, rng.randrange(100, 20000), kategori, f"{kategori} nota", tarikh))
+            if len(batch) == 50000:
+                conn.cursor().executemany(
+                    "INSERT INTO transactions (user_id, jenis, amaun_sen, kategori, nota, tarikh) VALUES (?, ?, ?, ?, ?, ?)", batch)
+                batch = []
+        if batch:
+            conn.cursor().executemany(
+                "INSERT INTO transactions (user_id, jenis, amaun_sen, kategori, nota, tarikh) VALUES (?, ?, ?, ?, ?, ?)", batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def old_totals(db, conn, user_id):
+    transactions = db.get_transactions(conn, user_id, 'bulanan')
+    total_masuk = 0
+    total_keluar = 0
+    kategori_totals = defaultdict(int)
+    for t in transactions:
+        if t.jenis == 'masuk':
+            total_masuk += t.amaun
+        elif t.jenis == 'keluar':
+            total_keluar += t.amaun
+            if t.kategori:
+                kategori_totals[db.normalise_kategori(t.kategori)] += t.amaun
+    ordered = sorted(kategori_totals.items(), key=lambda item: item[1], reverse=True)
+    return len(transactions), total_masuk, total_keluar, ordered
+
+
+def lines(count, masuk, keluar, kategori):
+    return [count, f"{masuk:.2f}", f"{keluar:.2f}"] + [f"{k.capitalize()}: {v:.2f}" for k, v in kategori]
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    use_temp_database()
+    import database as db
+    db.init_db()
+
+    print(f"{'rows':>10} {'old (ms)':>12} {'new (ms)':>12} {'speedup':>9}  same output")
+    for user_id, size in enumerate(int(s) for s in args.sizes.split(",")):
+        seed(db, user_id + 1, size)
+        with next(db.get_db()) as conn:
+            db.backfill_kategori_ids(conn)
+            old_time, old = timed(lambda: old_totals(db, conn, user_id + 1), args.repeat)
+            conn.expunge_all()
+            new_time, new = timed(lambda: db.get_report_totals(conn, user_id + 1, 'bulanan'), args.repeat)
+        same = lines(*old) == lines(new['count'], new['total_masuk'], new['total_keluar'], new['kategori_totals'])
+        print(f"{size:>10} {old_time * 1000:>12.1f} {new_time * 1000:>12.1f} {old_time / new_time:>8.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
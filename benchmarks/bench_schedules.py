@@ -0,0 +1,128 @@
+"""
+Scheduled report dispatch over a simulated day of cron ticks.
+
+Seeds --users users with report schedules (half at the spread default time,
+the rest at times of their own choosing; mostly harian, some mingguan and
+bulanan, a tenth outside TIMEZONE), then runs send_auto_reports every
+--tick minutes across one day against a stub bot, and reports how many
+reports each tick sent and how long it took. The old single daily run sent
+to every opted-in user in one go. On a second day the ticks stop at
+--down-at for --downtime hours, and the tick that catches up is timed.
+
+    python benchmarks/bench_schedules.py --users 5000 --tick 15 --down-at 15 --downtime 6
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from common import use_temp_database
+
+KATEGORI = ["makan", "minyak", "sewa", "bil", "kopi", "barang", "tol", "parking"]
+
+
+class StubBot:
+    async def send_message(self, chat_id, text, **kwargs):
+        return None
+
+
+def seed(db, users, start, per_user=20):
+    import pytz
+    from sqlalchemy import insert
+    rng = random.Random(1)
+    with next(db.get_db()) as conn:
+        conn.execute(insert(db.User), [
+            dict(telegram_id=1_000_000 + n, nama=f"Pengguna {n}", auto_laporan='on') for n in range(users)
+        ])
+        conn.commit()
+        user_ids = [user_id for (user_id,) in conn.query(db.User.id)]
+        now = datetime.now(pytz.timezone(db.TIMEZONE))
+        conn.execute(insert(db.Transaction), [
+            dict(user_id=user_id, jenis='keluar', amaun_sen=rng.randrange(100, 20000), kategori=rng.choice(KATEGORI),
+                 nota="nota", tarikh=now - timedelta(seconds=rng.randrange(30 * 86400)))
+            for user_id in user_ids for _ in range(per_user)
+        ])
+        conn.commit()
+        db.backfill_kategori_ids(conn)
+        db.rebuild_user_stats(conn)
+        db.rebuild_daily_rollups(conn)
+
+        schedules = []
+        for user_id in user_ids:
+            kekerapan = rng.choices(db.KEKERAPAN, weights=[7, 2, 1])[0]
+            masa_minit = db.default_report_minute(user_id) if rng.random() < 0.5 else rng.randrange(6 * 60, 23 * 60)
+            zon_waktu = db.TIMEZONE if rng.random() < 0.9 else "Asia/Jakarta"
+            hari = {'harian': None, 'mingguan': rng.randrange(7), 'bulanan': rng.randint(1, 31)}[kekerapan]
+            schedules.append(dict(
+                user_id=user_id, kekerapan=kekerapan, masa_minit=masa_minit, hari=hari, zon_waktu=zon_waktu,
+                next_due_at=db.next_report_due(kekerapan, masa_minit, hari, zon_waktu, start)
+            ))
+        conn.execute(insert(db.ReportSchedule), schedules)
+        conn.commit()
+
+
+async def run(scheduler, adb, moments):
+    app = SimpleNamespace(bot=StubBot())
+    timings = []
+    for now in moments:
+        started = time.perf_counter()
+        result = await scheduler.send_auto_reports(app, now=now)
+        timings.append((result, time.perf_counter() - started))
+    await adb.async_engine.dispose()
+    return timings
+
+
+def summarise(label, timings):
+    sent = [result["sent"] for result, _ in timings]
+    seconds = sorted(elapsed for _, elapsed in timings)
+    print(f"{label:<22} {len(timings):>5} {sum(sent):>7} {max(sent):>9} {sum(sent) / len(sent):>9.1f} "
+          f"{seconds[len(seconds) // 2] * 1000:>9.1f} {seconds[-1] * 1000:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--tick", type=int, default=15, help="minutes between cron ticks")
+    parser.add_argument("--down-at", type=int, default=15, help="local hour of day 2 the ticks stop")
+    parser.add_argument("--downtime", type=int, default=6, help="hours without ticks before the catch-up tick")
+    args = parser.parse_args()
+
+    use_temp_database(args.database_url)
+    # Measure dispatch, not Telegram's rate limits
+    os.environ.setdefault("NOTIFY_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("NOTIFY_CONCURRENCY", "200")
+    import pytz
+    import database as db
+    import async_db as adb
+    import scheduler
+    db.init_db()
+
+    tz = pytz.timezone(db.TIMEZONE)
+    start = tz.localize(datetime.combine(datetime.now(tz).date() + timedelta(days=1), datetime.min.time()))
+    start = start.astimezone(pytz.utc)
+    seed(db, args.users, start)
+    tick = timedelta(minutes=args.tick)
+
+    print(f"{args.users} users with schedules; old daily run: {args.users} reports in one burst")
+    print(f"{'':<22} {'ticks':>5} {'sent':>7} {'max/tick':>9} {'mean/tick':>9} {'p50 (ms)':>9} {'max (ms)':>9}")
+    ticks = [start + n * tick for n in range(1, 24 * 60 // args.tick + 1)]
+    summarise("day 1", asyncio.run(run(scheduler, adb, ticks)))
+
+    # Day 2: no ticks from --down-at for --downtime hours, then one tick catches up
+    down = start + timedelta(days=1, hours=args.down_at)
+    resume = down + timedelta(hours=args.downtime)
+    day2 = [moment + timedelta(days=1) for moment in ticks]
+    summarise("day 2 before downtime", asyncio.run(run(scheduler, adb, [m for m in day2 if m <= down])))
+    summarise("catch-up tick", asyncio.run(run(scheduler, adb, [resume])))
+    with next(db.get_db()) as conn:
+        overdue = conn.query(db.ReportSchedule).filter(db.ReportSchedule.next_due_at <= resume).count()
+    print(f"schedules still overdue after the catch-up tick: {overdue}")
+    summarise("day 2 after downtime", asyncio.run(run(scheduler, adb, [m for m in day2 if m > resume])))
+
+
+if __name__ == "__main__":
+    main()
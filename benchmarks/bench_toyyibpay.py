@@ -0,0 +1,99 @@
+"""
+Upgrade-flow load test against the local Toyyibpay stub.
+
+Starts the stub and the bot's Starlette app on local ports, creates bills
+concurrently through toyyibpay.ToyyibpayClient, "pays" each one through the
+stub (which POSTs /webhook/toyyibpay to the bot) and reports latency for both
+steps, plus how the client's retries and circuit breaker behaved.
+
+    python benchmarks/bench_toyyibpay.py --bills 500 --concurrency 50 --failure-rate 0.05
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from common import use_temp_database, summarise, print_row
+
+STUB_PORT = 8091
+APP_PORT = 8092
+
+
+async def serve(app, port):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bills", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    use_temp_database()
+    os.environ.update({
+        "BOT_TOKEN": "123:stub",
+        "TOYYIBPAY_BASE_URL": f"http://127.0.0.1:{STUB_PORT}",
+        "TOYYIBPAY_CALLBACK_URL": f"http://127.0.0.1:{APP_PORT}/webhook/toyyibpay",
+        "TOYYIBPAY_SECRET_KEY": "stub-secret",
+        "TOYYIBPAY_CATEGORY_CODE": "stub-category",
+    })
+    import httpx
+    import database as db
+    import toyyibpay
+    import main as bot
+    from toyyibpay_stub import build_app
+
+    db.init_db()
+    with next(db.get_db()) as conn:
+        for telegram_id in range(1, args.bills + 1):
+            db.get_or_create_user(conn, telegram_id, f"user {telegram_id}")
+
+    async def no_send(*a, **k):
+        return None
+    type(bot.application.bot).send_message = no_send  # keep the callback offline
+
+    stub, stub_task = await serve(build_app(args.latency, args.failure_rate), STUB_PORT)
+    app, app_task = await serve(bot.app, APP_PORT)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    create_latency, pay_latency, errors = [], [], []
+    async with httpx.AsyncClient(timeout=30) as browser:
+        async def upgrade(telegram_id):
+            async with semaphore:
+                started = time.perf_counter()
+                result = await toyyibpay.create_bill(telegram_id, f"user {telegram_id}", "a@b.co", 5.0)
+                create_latency.append(time.perf_counter() - started)
+                if not result.get("success"):
+                    errors.append(result["error"])
+                    return
+                started = time.perf_counter()
+                await browser.get(result["payment_url"])
+                pay_latency.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(upgrade(i) for i in range(1, args.bills + 1)))
+        elapsed = time.perf_counter() - started
+
+    with next(db.get_db()) as conn:
+        premium = conn.query(db.User).filter(db.User.status == 'premium').count()
+    print(f"{args.bills} upgrades in {elapsed:.2f}s ({args.bills / elapsed:.1f}/s), "
+          f"{len(errors)} errors, {premium} users premium, breaker {toyyibpay.client.breaker.state}")
+    print_row("createBill", summarise(create_latency))
+    print_row("pay + callback", summarise(pay_latency))
+
+    await toyyibpay.client.close()
+    for server, task in ((app, app_task), (stub, stub_task)):
+        server.should_exit = True
+        await task
+    await bot.adb.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
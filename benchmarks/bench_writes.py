@@ -0,0 +1,124 @@
+"""
+Insert throughput with many concurrent users: per-row commits vs group commit,
+under the old SQLite settings (rollback journal, synchronous=FULL, no busy
+timeout) and the tuned ones (WAL, synchronous=NORMAL, busy_timeout=5000).
+
+Modes:
+  threads  sync database.add_transaction from a thread per user (the old path;
+           shows "database is locked" errors)
+  async    async_db.add_transaction, one commit per row
+  group    async_db.add_transaction with WRITE_BATCHING=1
+
+Each combination runs in its own process on a fresh database, because the
+settings are read at import time.
+
+    python benchmarks/bench_writes.py --users 200 --inserts 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common import summarise
+
+PRAGMA_PROFILES = {
+    "old": "journal_mode=DELETE&synchronous=FULL&busy_timeout=0",
+    "tuned": "journal_mode=WAL&synchronous=NORMAL&busy_timeout=5000",
+}
+MODES = ("threads", "async", "group")
+
+
+def worker(mode: str, users: int, inserts: int) -> dict:
+    import database as db
+    db.init_db()
+    latencies, errors = [], []
+
+    if mode == "threads":
+        def one_user(user_id):
+            with next(db.get_db()) as conn:
+                for _ in range(inserts):
+                    started = time.perf_counter()
+                    try:
+                        db.add_transaction(conn, user_id, 'keluar', 12.5, 'makan', 'makan tengahari')
+                        latencies.append(time.perf_counter() - started)
+                    except Exception as e:
+                        conn.rollback()
+                        errors.append(type(e).__name__)
+
+        threads = [threading.Thread(target=one_user, args=(user_id,)) for user_id in range(1, users + 1)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    else:
+        import async_db as adb
+
+        async def one_user(user_id):
+            for _ in range(inserts):
+                started = time.perf_counter()
+                try:
+                    async with adb.AsyncSessionLocal() as conn:
+                        await adb.add_transaction(conn, user_id, 'keluar', 12.5, 'makan', 'makan tengahari')
+                    latencies.append(time.perf_counter() - started)
+                except Exception as e:
+                    errors.append(type(e).__name__)
+
+        async def run():
+            started = time.perf_counter()
+            await asyncio.gather(*(one_user(user_id) for user_id in range(1, users + 1)))
+            elapsed = time.perf_counter() - started
+            writer = adb.transaction_writer.stats() if adb.transaction_writer else None
+            await adb.async_engine.dispose()
+            return elapsed, writer
+
+        elapsed, writer = asyncio.run(run())
+
+    with next(db.get_db()) as conn:
+        stored = conn.query(db.Transaction).count()
+    result = {"inserts_per_s": stored / elapsed, "stored": stored, "errors": len(errors), **summarise(latencies)}
+    if mode == "group":
+        result["avg_batch"] = writer["avg_batch"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--inserts", type=int, default=20, help="inserts per user")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--profiles", default=",".join(PRAGMA_PROFILES))
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args.users, args.inserts)))
+        return
+
+    print(f"{args.users} users x {args.inserts} inserts")
+    for profile in args.profiles.split(","):
+        for mode in args.modes.split(","):
+            path = os.path.join(tempfile.mkdtemp(prefix="mykewangan-bench-"), "bench.db")
+            env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}?{PRAGMA_PROFILES[profile]}",
+                       WRITE_BATCHING="1" if mode == "group" else "0", TIMEZONE="Asia/Kuala_Lumpur",
+                       PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                   os.environ.get("PYTHONPATH", "")]))
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", mode,
+                 "--users", str(args.users), "--inserts", str(args.inserts)],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            r = json.loads(output)
+            extra = f" avg_batch={r['avg_batch']:.1f}" if "avg_batch" in r else ""
+            print(f"{profile:<6} {mode:<8} {r['inserts_per_s']:8.0f} inserts/s  stored={r['stored']:<6} "
+                  f"errors={r['errors']:<5} p50={r['p50_ms']:7.2f}ms p99={r['p99_ms']:8.2f}ms{extra}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Shared helpers for the benchmark scripts in this folder."""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_temp_database(url: str = None) -> str:
+    """
+    Points DATABASE_URL at a throwaway SQLite file (unless a URL is given).
+    Must run before `database` is imported, because it reads the env at import time.
+    """
+    if not url:
+        path = os.path.join(tempfile.mkdtemp(prefix="mykewangan-bench-"), "bench.db")
+        url = f"sqlite:///{path}"
+    os.environ["DATABASE_URL"] = url
+    os.environ.setdefault("TIMEZONE", "Asia/Kuala_Lumpur")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return url
+
+
+def percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarise(samples) -> dict:
+    """p50/p95/p99/max of latencies given in seconds, reported in milliseconds."""
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": (max(samples) if samples else 0.0) * 1000,
+    }
+
+
+def print_row(label: str, stats: dict) -> None:
+    print(
+        f"{label:<28} n={stats['count']:<6} p50={stats['p50_ms']:8.2f}ms "
+        f"p95={stats['p95_ms']:8.2f}ms p99={stats['p99_ms']:8.2f}ms max={stats['max_ms']:8.2f}ms"
+    )
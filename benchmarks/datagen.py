@@ -0,0 +1,109 @@
+"""
+Synthetic data for load tests: fills the users and transactions tables of
+database.py with a configurable number of users and transactions per user,
+then rebuilds user_stats and daily_rollups from them.
+
+Users get telegram_id TELEGRAM_ID_BASE + n, so a driver can address them.
+
+    python benchmarks/datagen.py --database-url sqlite:////tmp/load.db --users 1000 --per-user 500
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import use_temp_database
+
+TELEGRAM_ID_BASE = 1_000_000
+KATEGORI = ["makan", "minyak", "sewa", "bil", "kopi", "barang", "tol", "parking", "hiburan", "kesihatan"]
+
+
+def generate(db, users: int, per_user: int, premium_fraction: float = 0.2, auto_report_fraction: float = 0.3,
+             expired_fraction: float = 0.01, days: int = 365, seed: int = 1, chunk_size: int = 10000) -> dict:
+    """
+    Inserts `users` users and `per_user` transactions each, spread over the last
+    `days` days. A fraction of users are premium (some of them already expired,
+    for the downgrade cron) and a fraction have auto_laporan on.
+    """
+    import pytz
+    from sqlalchemy import insert
+
+    rng = random.Random(seed)
+    tz = pytz.timezone(db.TIMEZONE)
+    now = datetime.now(tz)
+    started = time.perf_counter()
+
+    user_rows = []
+    for n in range(users):
+        row = dict(telegram_id=TELEGRAM_ID_BASE + n, nama=f"Pengguna {n}", status='free',
+                   auto_laporan='on' if rng.random() < auto_report_fraction else 'off')
+        if rng.random() < premium_fraction:
+            expired = rng.random() < expired_fraction / max(premium_fraction, 1e-9)
+            row.update(status='premium', subscription_start=now - timedelta(days=30),
+                       subscription_end=now + timedelta(days=-1 if expired else 30))
+        user_rows.append(row)
+
+    with next(db.get_db()) as conn:
+        conn.execute(insert(db.User), user_rows)
+        conn.commit()
+        user_ids = [user_id for (user_id,) in conn.query(db.User.id).filter(
+            db.User.telegram_id >= TELEGRAM_ID_BASE, db.User.telegram_id < TELEGRAM_ID_BASE + users
+        )]
+
+        pending = []
+        def flush():
+            if pending:
+                conn.execute(insert(db.Transaction), pending)
+                conn.commit()
+                pending.clear()
+
+        for user_id in user_ids:
+            for _ in range(per_user):
+                kategori = rng.choice(KATEGORI)
+                masuk = rng.random() < 0.1
+                pending.append(dict(
+                    user_id=user_id,
+                    jenis='masuk' if masuk else 'keluar',
+                    amaun_sen=rng.randrange(100000, 500000) if masuk else rng.randrange(100, 30000),
+                    kategori='gaji' if masuk else kategori,
+                    nota='gaji' if masuk else f"{kategori} {rng.randint(1, 99)}",
+                    tarikh=now - timedelta(seconds=rng.randint(0, days * 86400)),
+                ))
+                if len(pending) >= chunk_size:
+                    flush()
+        flush()
+
+        db.backfill_kategori_ids(conn)
+        db.rebuild_user_stats(conn)
+        db.rebuild_daily_rollups(conn)
+        # Schedules as of a day ago, so the reports cron has a day's sends due
+        db.backfill_report_schedules(conn, now - timedelta(days=1))
+
+    return {
+        "users": len(user_ids),
+        "transactions": len(user_ids) * per_user,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--per-user", type=int, default=200)
+    parser.add_argument("--premium-fraction", type=float, default=0.2)
+    parser.add_argument("--auto-report-fraction", type=float, default=0.3)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    url = use_temp_database(args.database_url)
+    import database as db
+    db.init_db()
+    summary = generate(db, args.users, args.per_user, args.premium_fraction, args.auto_report_fraction,
+                       days=args.days, seed=args.seed)
+    print(f"{summary['users']} users, {summary['transactions']} transactions in {summary['seconds']:.1f}s -> {url}")
+
+
+if __name__ == "__main__":
+    main()
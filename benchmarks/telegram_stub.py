@@ -0,0 +1,88 @@
+"""
+Local stand-in for the Telegram Bot API, for offline load tests.
+
+Answers `POST /bot<token>/<method>` with replies shaped like the real API's
+(getMe, sendMessage, sendDocument, sendPhoto, editMessageText, ...) after an
+optional simulated latency, and counts every call per method. GET /_stats
+returns the counts.
+
+    python benchmarks/telegram_stub.py --port 8082 --latency 0.05
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8082 uvicorn main:app
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+BOT_USER = {
+    "id": 1, "is_bot": True, "first_name": "MyKewanganBot", "username": "mykewangan_bench_bot",
+    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False,
+}
+
+
+def build_app(latency: float = 0.0) -> Starlette:
+    message_ids = itertools.count(1)
+    calls = {}
+    stats = {"calls": calls, "bytes_received": 0, "started_at": time.time()}
+
+    def message(chat_id, text=None) -> dict:
+        reply = {"message_id": next(message_ids), "date": int(time.time()),
+                 "chat": {"id": int(chat_id or 0), "type": "private"}}
+        if text is not None:
+            reply["text"] = str(text)
+        return reply
+
+    async def call(request: Request):
+        method = request.path_params["method"]
+        body = await request.body()
+        stats["bytes_received"] += len(body)
+        if request.headers.get("content-type", "").startswith("application/json"):
+            params = await request.json()
+        else:
+            params = dict(await request.form())
+        calls[method] = calls.get(method, 0) + 1
+        if latency:
+            await asyncio.sleep(latency)
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "editMessageText"):
+            result = message(params.get("chat_id"), params.get("text"))
+        elif method == "sendDocument":
+            result = message(params.get("chat_id"))
+            result["document"] = {"file_id": f"doc{result['message_id']}", "file_unique_id": f"d{result['message_id']}"}
+        elif method == "sendPhoto":
+            result = message(params.get("chat_id"))
+            result["photo"] = [{"file_id": f"photo{result['message_id']}", "file_unique_id": f"p{result['message_id']}",
+                                "width": 800, "height": 600}]
+        else:
+            result = True
+        return JSONResponse({"ok": True, "result": result})
+
+    async def get_stats(request: Request):
+        return JSONResponse(stats)
+
+    return Starlette(routes=[
+        Route("/_stats", endpoint=get_stats, methods=["GET"]),
+        Route("/bot{token}/{method}", endpoint=call, methods=["POST"]),
+    ])
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    args = parser.parse_args()
+    uvicorn.run(build_app(args.latency), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Local stand-in for the Toyyibpay gateway, for offline load tests.
+
+Serves `POST /index.php/api/createBill` with the same reply shape as the real
+API, and `GET /<BillCode>` as the payment page: opening it "pays" the bill and
+POSTs the status callback to the bill's billCallbackUrl, like Toyyibpay does.
+Latency and failure rate are configurable to exercise timeouts, retries and
+the circuit breaker.
+
+    python benchmarks/toyyibpay_stub.py --port 8081 --latency 0.2 --failure-rate 0.1
+    TOYYIBPAY_BASE_URL=http://127.0.0.1:8081 \\
+    TOYYIBPAY_CALLBACK_URL=http://127.0.0.1:8000/webhook/toyyibpay uvicorn main:app
+"""
+import argparse
+import asyncio
+import itertools
+import random
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+
+def build_app(latency: float = 0.0, failure_rate: float = 0.0, callback_url: str = None) -> Starlette:
+    bills = {}
+    codes = itertools.count(1)
+    stats = {"created": 0, "failed": 0, "paid": 0, "callbacks_failed": 0}
+
+    async def create_bill(request: Request):
+        form = await request.form()
+        if latency:
+            await asyncio.sleep(latency)
+        if random.random() < failure_rate:
+            stats["failed"] += 1
+            return PlainTextResponse("Service Unavailable", status_code=503)
+        if not form.get("userSecretKey") or not form.get("categoryCode"):
+            return JSONResponse([{"status": "error", "msg": "[KEY-DID-NOT-EXIST-OR-USER-IS-NOT-ACTIVE]"}])
+        code = f"stub{next(codes):06d}"
+        bills[code] = dict(form)
+        stats["created"] += 1
+        return JSONResponse([{"BillCode": code}])
+
+    async def pay(request: Request):
+        code = request.path_params["code"]
+        bill = bills.get(code)
+        if bill is None:
+            return PlainTextResponse("Bill not found", status_code=404)
+        status = request.query_params.get("status", "1")  # 1 success, 2 pending, 3 failed
+        payload = {
+            "refno": bill["billExternalReferenceNo"],
+            "status": status,
+            "reason": "Approved" if status == "1" else "Failed",
+            "billcode": code,
+            "order_id": bill["billExternalReferenceNo"],
+            "amount": bill["billAmount"],
+        }
+        async with httpx.AsyncClient(timeout=10) as client:
+            try:
+                response = await client.post(callback_url or bill["billCallbackUrl"], data=payload)
+                response.raise_for_status()
+                stats["paid"] += 1
+            except httpx.HTTPError:
+                stats["callbacks_failed"] += 1
+                return PlainTextResponse("Callback failed", status_code=502)
+        return PlainTextResponse("Paid")
+
+    async def get_stats(request: Request):
+        return JSONResponse(stats)
+
+    return Starlette(routes=[
+        Route("/index.php/api/createBill", endpoint=create_bill, methods=["POST"]),
+        Route("/_stats", endpoint=get_stats, methods=["GET"]),
+        Route("/{code}", endpoint=pay, methods=["GET"]),
+    ])
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every createBill")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of createBill calls answered 503")
+    parser.add_argument("--callback-url", help="override every bill's billCallbackUrl")
+    args = parser.parse_args()
+    uvicorn.run(build_app(args.latency, args.failure_rate, args.callback_url), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+# cache.py
+"""
+Report result cache and user/entitlement cache.
+
+Reports are keyed by (user_id, period, period start) and invalidated by
+database.add_transaction / delete_transaction whenever a user's data changes.
+The in-process backend is an LRU bounded by entry count and approximate
+bytes; set REPORT_CACHE_URL=redis://... (and install redis) to share one
+cache between workers. Redis is called from worker threads, never on the
+event loop.
+
+Users are cached by telegram_id for USER_CACHE_TTL seconds, never past their
+subscription_end, and dropped explicitly on upgrade and downgrade. With
+REPORT_CACHE_URL set, the drop is a version bump in Redis that every worker
+checks on lookup, so a payment seen by one worker reaches all of them.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+REPORT_CACHE_URL = os.getenv("REPORT_CACHE_URL")
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "10000"))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", "86400"))  # shared backend only
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "50000"))
+
+
+def _entry_size(key, value) -> int:
+    return sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key) + sys.getsizeof(value)
+
+
+class MemoryBackend:
+    """In-process LRU with an entry cap and an approximate memory cap."""
+
+    blocking = False
+
+    def __init__(self, max_entries: int = REPORT_CACHE_MAX_ENTRIES, max_bytes: int = REPORT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._by_user = {}             # user_id -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        size = _entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (value, size)
+            self._by_user.setdefault(key[0], set()).add(key)
+            self.size_bytes += size
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self.size_bytes = 0
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size_bytes -= entry[1]
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def info(self) -> dict:
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "bytes": self.size_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+class RedisBackend:
+    """
+    Shared backend for multi-worker deployments. Each user has a version
+    counter that is part of every key, so invalidation is a single INCR and
+    the superseded entries simply age out via their TTL. Calls block on the
+    network, so async code runs them in a thread.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str, ttl: int = REPORT_CACHE_TTL, prefix: str = "mykewangan:laporan"):
+        import redis  # optional dependency, only needed for a shared cache
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def version(self, user_id) -> int:
+        return int(self.client.get(f"{self.prefix}:v:{user_id}") or 0)
+
+    def _key(self, key) -> str:
+        user_id = key[0]
+        parts = ":".join(str(part) for part in key[1:])
+        return f"{self.prefix}:{user_id}:{self.version(user_id)}:{parts}"
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(self._key(key), value.encode("utf-8"), ex=self.ttl)
+
+    def invalidate_user(self, user_id):
+        self.client.incr(f"{self.prefix}:v:{user_id}")
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}:*"):
+            self.client.delete(key)
+
+    def info(self) -> dict:
+        return {"backend": "redis", "ttl": self.ttl}
+
+
+class ReportCache:
+    """
+    Counts hits and misses around a backend; backend errors count as misses.
+
+    get and set are coroutines that call a blocking backend in a worker
+    thread. invalidate_user stays synchronous for the database layer: on the
+    event loop it schedules the backend call, and the user's next get waits
+    for it, so a report from before the change is never served afterwards.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+        self._pending = {}  # user_id -> scheduled invalidation task
+
+    async def _call(self, fn, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def get(self, user_id, *key):
+        pending = self._pending.get(user_id)
+        if pending is not None and pending.get_loop() is asyncio.get_running_loop():
+            await asyncio.wait([pending])
+        try:
+            value = await self._call(self.backend.get, (user_id, *key))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Report cache get failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, user_id, *key, value):
+        try:
+            await self._call(self.backend.set, (user_id, *key), value)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Report cache set failed: {e}")
+
+    def invalidate_user(self, user_id):
+        self.invalidations += 1
+        try:
+            loop = asyncio.get_running_loop() if self.backend.blocking else None
+        except RuntimeError:
+            loop = None  # called outside the event loop (manage.py, benchmarks): block
+        if loop is None:
+            self._invalidate(user_id)
+            return
+        task = loop.create_task(asyncio.to_thread(self._invalidate, user_id))
+        self._pending[user_id] = task
+        task.add_done_callback(lambda done: self._pending.pop(user_id, None) if self._pending.get(user_id) is done else None)
+
+    def _invalidate(self, user_id):
+        try:
+            self.backend.invalidate_user(user_id)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Report cache invalidation failed for user {user_id}: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+            **self.backend.info(),
+        }
+
+
+def _make_backend():
+    if REPORT_CACHE_URL:
+        try:
+            return RedisBackend(REPORT_CACHE_URL)
+        except ImportError:
+            logger.warning("REPORT_CACHE_URL is set but redis is not installed; using in-process cache.")
+    return MemoryBackend()
+
+
+report_cache = ReportCache(_make_backend())
+
+
+# Detached, read-only copy of the User columns handlers need
+UserSnapshot = namedtuple(
+    "UserSnapshot",
+    ["id", "telegram_id", "nama", "status", "subscription_start", "subscription_end", "auto_laporan"],
+)
+
+
+def snapshot_user(user) -> UserSnapshot:
+    return UserSnapshot(*(getattr(user, field) for field in UserSnapshot._fields))
+
+
+def as_utc(moment):
+    """Stored datetimes come back naive from SQLite; they were written in UTC."""
+    if moment is None or moment.tzinfo is not None:
+        return moment
+    return pytz.utc.localize(moment)
+
+
+class UserCache:
+    """
+    TTL'd LRU of UserSnapshot by telegram_id. An entry for a premium user
+    expires no later than its subscription_end, so the next lookup after
+    expiry goes back to the database.
+
+    With a `shared` RedisBackend, each entry remembers the user's version
+    counter from before the row was read; a lookup whose counter has since
+    moved (another worker invalidated the user) is a miss. If Redis cannot
+    be reached, nothing is served from or added to the cache. get, version
+    and invalidate are coroutines; Redis is called in a worker thread, and
+    only for entries that are otherwise still fresh.
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_entries: int = USER_CACHE_MAX_ENTRIES, shared=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._entries = OrderedDict()  # telegram_id -> (snapshot, expires_at, version)
+        self._lock = threading.Lock()
+
+    async def version(self, telegram_id):
+        """The user's shared version counter (0 without a shared backend); None if it cannot be read."""
+        if self.shared is None:
+            return 0
+        try:
+            return await asyncio.to_thread(self.shared.version, telegram_id)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"User cache version lookup failed for {telegram_id}: {e}")
+            return None
+
+    async def get(self, telegram_id):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+        if entry is not None and entry[1] > now and entry[2] == await self.version(telegram_id):
+            with self._lock:
+                if telegram_id in self._entries:
+                    self._entries.move_to_end(telegram_id)
+                self.hits += 1
+            return entry[0]
+        with self._lock:
+            if entry is not None and self._entries.get(telegram_id) is entry:
+                del self._entries[telegram_id]
+            self.misses += 1
+        return None
+
+    def set(self, user: UserSnapshot, version=0):
+        """Caches `user`, read from the database after version() returned `version`."""
+        if self.ttl <= 0 or version is None:
+            return
+        expires_at = time.time() + self.ttl
+        end = as_utc(user.subscription_end)
+        if user.status == 'premium' and end is not None:
+            expires_at = min(expires_at, end.timestamp())
+        with self._lock:
+            self._entries[user.telegram_id] = (user, expires_at, version)
+            self._entries.move_to_end(user.telegram_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def invalidate(self, telegram_id):
+        with self._lock:
+            self._entries.pop(telegram_id, None)
+        if self.shared is not None:
+            try:
+                await asyncio.to_thread(self.shared.invalidate_user, telegram_id)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"User cache invalidation failed for {telegram_id}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "ttl": self.ttl,
+            "errors": self.errors,
+            "shared": self.shared is not None,
+        }
+
+
+def _make_user_versions():
+    if REPORT_CACHE_URL:
+        try:
+            return RedisBackend(REPORT_CACHE_URL, prefix="mykewangan:user")
+        except ImportError:
+            pass  # _make_backend has already warned
+    return None
+
+
+user_cache = UserCache(shared=_make_user_versions())
+
+
+def is_premium(user, now: datetime = None) -> bool:
+    """True while the user's paid subscription is still running."""
+    end = as_utc(user.subscription_end)
+    return user.status == 'premium' and end is not None and end > (now or datetime.now(pytz.utc))
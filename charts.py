@@ -0,0 +1,123 @@
+# charts.py
+"""
+PNG chart rendering for `/laporan mingguan|bulanan carta`.
+
+render_report_chart turns plain data (lists of labels and floats, which
+pickle cheaply) into PNG bytes, so it can run in a worker process: the
+CPU-bound matplotlib drawing never holds the event loop, or the GIL of the
+process answering webhooks. CHART_WORKERS processes are started on first use
+with the spawn method (forking a process that runs an event loop and DB pool
+threads is unsafe) and import only this module and matplotlib. With
+CHART_WORKERS=0 charts are rendered in a thread instead, for platforms
+without subprocesses.
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+CHART_TIMEOUT = float(os.getenv("CHART_TIMEOUT", "20"))  # seconds per render
+CHART_DPI = 100
+PIE_SLICES = 6  # the rest are folded into "Lain-lain"
+COLOURS = ["#4e79a7", "#f28e2b", "#e15759", "#76b7b2", "#59a14f", "#edc948", "#b07aa1", "#9c755f"]
+
+
+def _pie_slices(kategori):
+    """Largest PIE_SLICES - 1 categories, the rest summed into one slice."""
+    if len(kategori) <= PIE_SLICES:
+        return kategori
+    head = kategori[:PIE_SLICES - 1]
+    return head + [("Lain-lain", sum(amaun for _, amaun in kategori[PIE_SLICES - 1:]))]
+
+
+def render_report_chart(title: str, kategori, days) -> bytes:
+    """
+    One PNG with a pie of keluar per kategori ([(nama, ringgit)], largest first)
+    beside a bar chart of keluar per day ([(label, ringgit)], in order).
+    """
+    # Figure without pyplot: no global figure registry, no GUI backend
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(11, 4.8), dpi=CHART_DPI, layout="constrained")
+    pie_axes, bar_axes = figure.subplots(1, 2, gridspec_kw={"width_ratios": [1, 1.5]})
+    figure.suptitle(title, fontsize=13, fontweight="bold")
+
+    slices = _pie_slices([(nama, amaun) for nama, amaun in kategori if amaun > 0])
+    if slices:
+        pie_axes.pie(
+            [amaun for _, amaun in slices],
+            labels=[nama.capitalize() for nama, _ in slices],
+            colors=COLOURS[:len(slices)],
+            autopct="%1.0f%%", startangle=90, counterclock=False,
+            wedgeprops={"linewidth": 1, "edgecolor": "white"}, textprops={"fontsize": 9},
+        )
+    else:
+        pie_axes.text(0.5, 0.5, "Tiada perbelanjaan", ha="center", va="center")
+        pie_axes.set_axis_off()
+    pie_axes.set_title("Keluar mengikut kategori", fontsize=10)
+
+    labels = [label for label, _ in days]
+    values = [amaun for _, amaun in days]
+    bar_axes.bar(range(len(values)), values, color=COLOURS[0])
+    bar_axes.set_xticks(range(len(labels)), labels, fontsize=8 if len(labels) <= 7 else 6)
+    bar_axes.set_ylabel("RM")
+    bar_axes.set_title("Keluar harian", fontsize=10)
+    bar_axes.spines[["top", "right"]].set_visible(False)
+    bar_axes.grid(axis="y", alpha=0.3)
+    bar_axes.set_axisbelow(True)
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    """Runs render_report_chart in a lazily started process pool (or a thread with workers=0)."""
+
+    def __init__(self, workers: int = CHART_WORKERS, timeout: float = CHART_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self.rendered = 0
+        self.failures = 0
+        self._pool = None
+
+    def _executor(self):
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def render(self, title: str, kategori, days) -> bytes:
+        pool = self._executor()
+        if pool is None:
+            job = asyncio.to_thread(render_report_chart, title, kategori, days)
+        else:
+            job = asyncio.get_running_loop().run_in_executor(pool, render_report_chart, title, kategori, days)
+        try:
+            png = await asyncio.wait_for(job, self.timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool on the next render
+            self.failures += 1
+            self._pool = None
+            raise
+        except Exception:
+            self.failures += 1
+            raise
+        self.rendered += 1
+        return png
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "rendered": self.rendered, "failures": self.failures,
+                "started": self._pool is not None}
+
+
+renderer = ChartRenderer()
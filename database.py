@@ -1,30 +1,168 @@
 
+import calendar
 import os
+import re
 from datetime import datetime, timedelta
+from decimal import Decimal
 import pytz
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, func
+from collections import Counter
+from sqlalchemy import create_engine, event, make_url, inspect, text, Column, Integer, BigInteger, String, Date, DateTime, Index, UniqueConstraint, func, update, insert, delete, case, bindparam, tuple_, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
+from cache import report_cache
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 TIMEZONE = os.getenv("TIMEZONE", "UTC")
 
-engine = create_engine(DATABASE_URL)
+# PRAGMAs set on every new SQLite connection to a file. Override them in the URL,
+# e.g. sqlite:///mykewangan.db?journal_mode=DELETE&synchronous=FULL&busy_timeout=10000
+SQLITE_PRAGMA_DEFAULTS = {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": "5000"}
+
+def split_sqlite_pragmas(url: str):
+    """Returns (url without PRAGMA parameters, {pragma: value}); other databases pass through."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite":
+        return url, {}
+    in_memory = parsed.database in (None, "", ":memory:")
+    pragmas = {} if in_memory else dict(SQLITE_PRAGMA_DEFAULTS)
+    for name in SQLITE_PRAGMA_DEFAULTS:
+        if name in parsed.query:
+            pragmas[name] = parsed.query[name]
+    for name, value in pragmas.items():
+        if not re.fullmatch(r"\w+", value):
+            raise ValueError(f"Invalid SQLite {name}: {value!r}")
+    return parsed.difference_update_query(SQLITE_PRAGMA_DEFAULTS).render_as_string(hide_password=False), pragmas
+
+def apply_sqlite_pragmas(engine, pragmas: dict):
+    """Runs the PRAGMAs on each connection the (sync) engine opens."""
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+_engine_url, SQLITE_PRAGMAS = split_sqlite_pragmas(DATABASE_URL)
+engine = create_engine(_engine_url)
+apply_sqlite_pragmas(engine, SQLITE_PRAGMAS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# --- Money ---
+# Amounts are stored as integer sen (ringgit x 100) in BIGINT columns and summed
+# as integers in SQL, so totals are exact; Python code sees Decimal ringgit.
+AMAUN_PATTERN = re.compile(r"(\d{1,13})(?:\.\d{1,2})?")
+
+def parse_amaun(text: str) -> Decimal:
+    """Strictly parses typed input such as '12', '12.5' or '12.50' into Decimal ringgit; ValueError otherwise."""
+    match = AMAUN_PATTERN.fullmatch((text or '').strip())
+    if not match:
+        raise ValueError(f"Invalid amaun: {text!r}")
+    return Decimal(match.group(0))
+
+def to_sen(amaun) -> int:
+    """Ringgit (Decimal, int, or str/float from code) to integer sen; a fraction of a sen is a ValueError."""
+    sen = (amaun if isinstance(amaun, Decimal) else Decimal(str(amaun))).scaleb(2)
+    if not sen.is_finite() or sen != sen.to_integral_value():
+        raise ValueError(f"Amaun {amaun!r} is not a whole number of sen")
+    return int(sen)
+
+def from_sen(sen) -> Decimal:
+    """Integer sen to Decimal ringgit with two places; None counts as 0."""
+    return Decimal(int(sen or 0)).scaleb(-2)
+
+class _Amaun:
+    @property
+    def amaun(self) -> Decimal:
+        return from_sen(self.amaun_sen)
+
+class NaiveDateTime(TypeDecorator):
+    """
+    DateTime without an offset, as every column here is. Aware values keep their
+    wall-clock time and drop the tzinfo, which is what SQLite always stored;
+    asyncpg would reject them for TIMESTAMP WITHOUT TIME ZONE, and psycopg2
+    would shift them into the session's timezone.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            return value.replace(tzinfo=None)
+        return value
+
 # Define table models
-class Transaction(Base):
+class Transaction(_Amaun, Base):
     __tablename__ = "transactions"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, index=True)
     jenis = Column(String, index=True)  # 'masuk' or 'keluar'
-    amaun = Column(Float)
+    amaun_sen = Column(BigInteger, nullable=False)
+    kategori = Column(String, nullable=True)  # as typed; kategori_id is the normalised reference
+    kategori_id = Column(Integer, nullable=True)
+    nota = Column(String, nullable=True)
+    tarikh = Column(NaiveDateTime, default=lambda: datetime.now(pytz.timezone(TIMEZONE)))
+
+    # Every per-user period query filters on user_id and ranges over tarikh;
+    # id breaks ties for keyset pagination. AUTOINCREMENT stops SQLite from
+    # reusing the id of a row that was archived or deleted (it would otherwise
+    # number new rows max(id) + 1), so archived ids stay unique.
+    __table_args__ = (
+        Index('ix_transactions_user_tarikh_id', 'user_id', 'tarikh', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+class ArchivedTransaction(_Amaun, Base):
+    """
+    Transactions older than the archive horizon, moved out of `transactions` by
+    archive_transactions with their ids kept. Their sums live on in
+    archive_totals and their days in daily_rollups.
+    """
+    __tablename__ = "transactions_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False)
+    jenis = Column(String)
+    amaun_sen = Column(BigInteger, nullable=False)
     kategori = Column(String, nullable=True)
+    kategori_id = Column(Integer, nullable=True)
     nota = Column(String, nullable=True)
-    tarikh = Column(DateTime, default=lambda: datetime.now(pytz.timezone(TIMEZONE)))
+    tarikh = Column(NaiveDateTime)
+
+    __table_args__ = (Index('ix_transactions_archive_user_tarikh_id', 'user_id', 'tarikh', 'id'),)
+
+class Kategori(Base):
+    """
+    A user's category dictionary: one row per case-folded name, referenced by
+    transactions.kategori_id. usage_count is the number of transactions (hot
+    and archived) that use it, kept in step by add/delete/import.
+    """
+    __tablename__ = "kategori"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    nama = Column(String, nullable=False)
+    usage_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'nama', name='uq_kategori_user_nama'),
+        Index('ix_kategori_user_usage', 'user_id', 'usage_count'),
+    )
+
+class ArchiveTotals(Base):
+    """Carried-forward totals of a user's archived transactions, per jenis."""
+    __tablename__ = "archive_totals"
+    user_id = Column(Integer, primary_key=True)
+    jenis = Column(String, primary_key=True)
+    total_sen = Column(BigInteger, nullable=False, default=0)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    last_transaction_at = Column(NaiveDateTime, nullable=True)
 
 class User(Base):
     __tablename__ = "users"
@@ -32,12 +170,93 @@ class User(Base):
     telegram_id = Column(Integer, unique=True, index=True)
     nama = Column(String)
     status = Column(String(10), default='free') # free or premium
-    subscription_start = Column(DateTime, nullable=True)
-    subscription_end = Column(DateTime, nullable=True)
+    subscription_start = Column(NaiveDateTime, nullable=True)
+    subscription_end = Column(NaiveDateTime, nullable=True)
     auto_laporan = Column(String(3), default='off') # on or off
 
+class UserStats(Base):
+    """
+    Running per-user totals, kept in step with `transactions` by add/delete.
+    data_version goes up with every change to the user's transactions, for
+    caches of derived output (e.g. chart file_ids) shared between processes.
+    """
+    __tablename__ = "user_stats"
+    user_id = Column(Integer, primary_key=True)
+    masuk_sen = Column(BigInteger, nullable=False, default=0)
+    keluar_sen = Column(BigInteger, nullable=False, default=0)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    last_transaction_at = Column(NaiveDateTime, nullable=True)
+    data_version = Column(BigInteger, nullable=False, default=0)
+
+class DailyRollup(Base):
+    """
+    Per-user totals for each local day, jenis and kategori, kept in step with
+    `transactions` by add/delete/import. Long-range reports read these instead
+    of the raw rows. kategori_id is 0 for transactions without one.
+    """
+    __tablename__ = "daily_rollups"
+    user_id = Column(Integer, primary_key=True)
+    tarikh = Column(Date, primary_key=True)
+    jenis = Column(String, primary_key=True)
+    kategori_id = Column(Integer, primary_key=True)
+    total_sen = Column(BigInteger, nullable=False, default=0)
+    transaction_count = Column(Integer, nullable=False, default=0)
+
+class ReportSchedule(Base):
+    """
+    When a user's automatic report goes out: kekerapan (harian, mingguan or
+    bulanan) at masa_minit past local midnight in zon_waktu. hari is the weekday
+    (0 = Isnin) for mingguan and the day of the month for bulanan, clamped to
+    the month's last day. next_due_at (UTC) is the next send, None while auto
+    laporan is off; each cron tick reads only the rows due by then through its
+    index, so sends spread over the day with the users' chosen times.
+    """
+    __tablename__ = "report_schedules"
+    user_id = Column(Integer, primary_key=True)
+    kekerapan = Column(String(8), nullable=False, default='harian')
+    masa_minit = Column(Integer, nullable=False)
+    hari = Column(Integer, nullable=True)
+    zon_waktu = Column(String(64), nullable=False)
+    next_due_at = Column(NaiveDateTime, nullable=True)
+    last_sent_at = Column(NaiveDateTime, nullable=True)
+    __table_args__ = (Index('ix_report_schedules_due', 'next_due_at', 'user_id'),)
+
+class ProcessedUpdate(Base):
+    """Telegram update_ids already accepted by the webhook, for dropping redeliveries."""
+    __tablename__ = "processed_updates"
+    update_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    received_at = Column(NaiveDateTime, nullable=False, index=True)
+
+class PendingNotification(Base):
+    """Outbox of user notifications written alongside the change that caused them."""
+    __tablename__ = "pending_notifications"
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(Integer, nullable=False)
+    mesej = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(NaiveDateTime, default=lambda: datetime.now(pytz.utc))
+
+# Transactions older than this many days are moved to transactions_archive by
+# archive_transactions. Period reports read only the hot table and bulanan
+# reaches back up to 31 days, so the horizon is never shorter than ARCHIVE_MIN_DAYS.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_MIN_DAYS = 40
+# Local time of automatic reports for users who do not pick one; each user is
+# offset by up to AUTO_REPORT_SPREAD minutes so their sends do not all land in one tick
+AUTO_REPORT_TIME = os.getenv("AUTO_REPORT_TIME", "21:00")
+AUTO_REPORT_SPREAD = int(os.getenv("AUTO_REPORT_SPREAD", "60"))
+
 def init_db():
+    new_rollups = not inspect(engine).has_table(DailyRollup.__tablename__)
     Base.metadata.create_all(bind=engine)
+    if new_rollups:
+        # First run after upgrading: build the rollups from existing history
+        with SessionLocal() as db:
+            rebuild_daily_rollups(db)
+    # create_all skips indexes on tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 def get_db():
     db = SessionLocal()
@@ -56,26 +275,215 @@ def get_or_create_user(db, telegram_id, nama):
         db.refresh(user)
     return user
 
+def downgrade_expired_users(db, mesej: str, now=None) -> list:
+    """
+    Flips every premium user whose subscription has ended back to 'free' in one
+    UPDATE and queues `mesej` for each of them in the same commit. Returns the
+    downgraded telegram_ids; a second run finds nobody left to downgrade.
+    """
+    now = now or datetime.now(pytz.utc)
+    expired = (User.status == 'premium', User.subscription_end < now)
+    if db.get_bind().dialect.update_returning:
+        telegram_ids = db.execute(
+            update(User).where(*expired).values(status='free').returning(User.telegram_id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+    else:
+        ids = db.query(User.id, User.telegram_id).filter(*expired).with_for_update().all()
+        telegram_ids = [u.telegram_id for u in ids]
+        if ids:
+            db.execute(
+                update(User).where(User.id.in_([u.id for u in ids])).values(status='free')
+                .execution_options(synchronize_session=False)
+            )
+    if telegram_ids:
+        db.execute(insert(PendingNotification), [
+            dict(telegram_id=telegram_id, mesej=mesej, attempts=0, created_at=now) for telegram_id in telegram_ids
+        ])
+    db.commit()
+    return telegram_ids
+
+# --- Notification Outbox ---
+def get_pending_notifications(db, after_id: int = 0, limit: int = 1000) -> list:
+    return db.query(PendingNotification).filter(
+        PendingNotification.id > after_id
+    ).order_by(PendingNotification.id).limit(limit).all()
+
+def complete_notifications(db, sent_ids, failed_ids, max_attempts: int) -> int:
+    """
+    Removes delivered notifications and counts an attempt against the rest.
+    Notifications that have used up max_attempts are dropped; returns how many.
+    """
+    if sent_ids:
+        db.execute(delete(PendingNotification).where(PendingNotification.id.in_(sent_ids)))
+    dropped = 0
+    if failed_ids:
+        db.execute(
+            update(PendingNotification).where(PendingNotification.id.in_(failed_ids))
+            .values(attempts=PendingNotification.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        dropped = db.execute(
+            delete(PendingNotification).where(
+                PendingNotification.id.in_(failed_ids),
+                PendingNotification.attempts >= max_attempts
+            )
+        ).rowcount
+    db.commit()
+    return dropped
+
+# --- Webhook Deduplication ---
+def claim_update(db, update_id: int, now=None) -> bool:
+    """
+    Records a Telegram update_id. Returns False if it was already recorded, i.e.
+    this delivery is a retry; the primary key makes this safe across workers.
+    """
+    db.add(ProcessedUpdate(update_id=update_id, received_at=now or datetime.now(pytz.utc)))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    return True
+
+def prune_processed_updates(db, before) -> int:
+    """Forgets update_ids received before `before`; returns how many."""
+    removed = db.execute(delete(ProcessedUpdate).where(ProcessedUpdate.received_at < before)).rowcount
+    db.commit()
+    return removed
+
 # --- Transaction Management ---
-def add_transaction(db, user_id: int, jenis: str, amaun: float, kategori: str, nota: str):
+def add_transaction(db, user_id: int, jenis: str, amaun: Decimal, kategori: str, nota: str):
     tz = pytz.timezone(TIMEZONE)
+    amaun_sen = to_sen(amaun)
+    kategori_id, = _assign_kategori(db, [(user_id, kategori)])
     new_trans = Transaction(
         user_id=user_id,
         jenis=jenis,
-        amaun=amaun,
+        amaun_sen=amaun_sen,
         kategori=kategori,
+        kategori_id=kategori_id,
         nota=nota,
         tarikh=datetime.now(tz)
     )
     db.add(new_trans)
+    db.flush()
+    _apply_to_stats(db, new_trans, 1)
+    _apply_to_rollups(db, user_id, [(new_trans.tarikh, jenis, kategori_id, amaun_sen)])
     db.commit()
+    report_cache.invalidate_user(user_id)
     db.refresh(new_trans)
     return new_trans
 
-def get_transactions(db, user_id: int, period: str):
+def add_transactions(db, user_id: int, jenis: str, entries) -> list:
+    """
+    Records several (amaun, kategori, nota) entries of one jenis, as a multi-line
+    /belanja or /masuk does: one INSERT, one aggregates update and one commit for
+    the whole batch. The rows share a timestamp; undo deletes them by id range
+    and that timestamp.
+    """
+    tz = pytz.timezone(TIMEZONE)
+    now = datetime.now(tz)
+    kategori_ids = _assign_kategori(db, [(user_id, kategori) for _, kategori, _ in entries])
+    new_rows = [
+        Transaction(user_id=user_id, jenis=jenis, amaun_sen=to_sen(amaun), kategori=kategori,
+                    kategori_id=kategori_id, nota=nota, tarikh=now)
+        for (amaun, kategori, nota), kategori_id in zip(entries, kategori_ids)
+    ]
+    db.add_all(new_rows)
+    db.flush()
+    total = sum(trans.amaun_sen for trans in new_rows)
+    _apply_stats_delta(
+        db, user_id,
+        masuk=total if jenis == 'masuk' else 0,
+        keluar=total if jenis == 'keluar' else 0,
+        count=len(new_rows), latest=now
+    )
+    _apply_to_rollups(db, user_id, [(now, jenis, trans.kategori_id, trans.amaun_sen) for trans in new_rows])
+    db.commit()
+    report_cache.invalidate_user(user_id)
+    return new_rows
+
+def add_transaction_batch(db, items) -> list:
+    """
+    Inserts (user_id, jenis, amaun, kategori, nota, tarikh) items, possibly for
+    many users, with one flush and one commit: the unit of work of the
+    group-commit writer. Aggregates are updated once per user. Returns the new
+    rows in item order, ids assigned.
+    """
+    kategori_ids = _assign_kategori(db, [(item[0], item[3]) for item in items])
+    new_rows = [
+        Transaction(user_id=user_id, jenis=jenis, amaun_sen=to_sen(amaun), kategori=kategori,
+                    kategori_id=kategori_id, nota=nota, tarikh=tarikh)
+        for (user_id, jenis, amaun, kategori, nota, tarikh), kategori_id in zip(items, kategori_ids)
+    ]
+    db.add_all(new_rows)
+    db.flush()
+    by_user = {}
+    for trans in new_rows:
+        by_user.setdefault(trans.user_id, []).append(trans)
+    _apply_stats_additions(db, {
+        user_id: (
+            sum(t.amaun_sen for t in rows if t.jenis == 'masuk'),
+            sum(t.amaun_sen for t in rows if t.jenis == 'keluar'),
+            len(rows), max(t.tarikh for t in rows)
+        )
+        for user_id, rows in by_user.items()
+    })
+    _apply_rollup_groups(db, {
+        (user_id, *key): group
+        for user_id, rows in by_user.items()
+        for key, group in _rollup_groups((t.tarikh, t.jenis, t.kategori_id, t.amaun_sen) for t in rows).items()
+    })
+    db.commit()
+    for user_id in by_user:
+        report_cache.invalidate_user(user_id)
+    return new_rows
+
+def import_transactions(db, user_id: int, rows, limit: int = None, chunk_size: int = 5000) -> int:
+    """
+    Bulk-inserts rows (dicts with jenis, amaun (ringgit), kategori, nota, tarikh) for a user
+    in chunks, one executemany INSERT and one commit per chunk. The user's
+    aggregates are updated once per chunk. With `limit` set (free tier), rows
+    beyond the user's remaining allowance are not inserted. Returns the count
+    inserted.
+    """
+    inserted = 0
+    for offset in range(0, len(rows), chunk_size):
+        chunk = rows[offset:offset + chunk_size]
+        if limit is not None:
+            remaining = limit - get_user_stats(db, user_id).transaction_count
+            if remaining <= 0:
+                break
+            chunk = chunk[:remaining]
+
+        kategori_ids = _assign_kategori(db, [(user_id, row['kategori']) for row in chunk])
+        chunk = [
+            dict(user_id=user_id, jenis=row['jenis'], amaun_sen=to_sen(row['amaun']), kategori=row['kategori'],
+                 kategori_id=kategori_id, nota=row['nota'], tarikh=row['tarikh'])
+            for row, kategori_id in zip(chunk, kategori_ids)
+        ]
+        db.execute(insert(Transaction), chunk)
+        _apply_stats_delta(
+            db, user_id,
+            masuk=sum(row['amaun_sen'] for row in chunk if row['jenis'] == 'masuk'),
+            keluar=sum(row['amaun_sen'] for row in chunk if row['jenis'] == 'keluar'),
+            count=len(chunk), latest=max(row['tarikh'] for row in chunk)
+        )
+        _apply_to_rollups(db, user_id, [
+            (row['tarikh'], row['jenis'], row['kategori_id'], row['amaun_sen']) for row in chunk
+        ])
+        db.commit()
+        inserted += len(chunk)
+    if inserted:
+        report_cache.invalidate_user(user_id)
+    return inserted
+
+def _period_start(period: str):
+    """Start of the current harian/mingguan/bulanan period, or None if unknown."""
     tz = pytz.timezone(TIMEZONE)
     today = datetime.now(tz).date()
-    
+
     if period == 'harian':
         start_date = today
     elif period == 'mingguan':
@@ -83,27 +491,98 @@ def get_transactions(db, user_id: int, period: str):
     elif period == 'bulanan':
         start_date = today.replace(day=1)
     else:
+        return None
+
+    return tz.localize(datetime.combine(start_date, datetime.min.time()))
+
+def get_transactions(db, user_id: int, period: str):
+    start_datetime = _period_start(period)
+    if start_datetime is None:
         return []
 
-    start_datetime = tz.localize(datetime.combine(start_date, datetime.min.time()))
-    
     return db.query(Transaction).filter(
         Transaction.user_id == user_id,
         Transaction.tarikh >= start_datetime
     ).order_by(Transaction.tarikh.desc()).all()
 
-def get_balance(db, user_id: int):
-    total_masuk = db.query(func.sum(Transaction.amaun)).filter(
-        Transaction.user_id == user_id,
-        Transaction.jenis == 'masuk'
-    ).scalar() or 0.0
+def get_report_totals(db, user_id: int, period: str) -> dict:
+    """Aggregates for a period report, computed in SQL rather than by loading rows."""
+    start_datetime = _period_start(period)
+    if start_datetime is None:
+        return _fold_report_rows([], {})
 
-    total_keluar = db.query(func.sum(Transaction.amaun)).filter(
+    rows = db.query(
+        Transaction.jenis, Transaction.kategori_id, func.sum(Transaction.amaun_sen),
+        func.count(Transaction.id), func.max(Transaction.tarikh)
+    ).filter(
         Transaction.user_id == user_id,
-        Transaction.jenis == 'keluar'
-    ).scalar() or 0.0
+        Transaction.tarikh >= start_datetime
+    ).group_by(Transaction.jenis, Transaction.kategori_id).all()
+    return _report_totals(db, rows)
+
+def _report_totals(db, rows) -> dict:
+    """_fold_report_rows with the kategori names the rows refer to looked up."""
+    return _fold_report_rows(rows, _kategori_names(db, {row[1] for row in rows}))
+
+def _fold_report_rows(rows, names: dict) -> dict:
+    """
+    Turns (jenis, kategori_id, sum of sen, count, max tarikh) groups into report
+    totals in Decimal ringgit, naming categories from {kategori_id: nama}.
+    kategori_totals lists keluar totals per kategori, largest first; ties keep the
+    order of each kategori's latest transaction, as the old row-by-row loop did.
+    """
+    count, masuk, keluar = 0, 0, 0
+    by_id = {}
+    for jenis, kategori_id, total, rows_in_group, last in rows:
+        count += int(rows_in_group)
+        if jenis == 'masuk':
+            masuk += int(total or 0)
+        elif jenis == 'keluar':
+            keluar += int(total or 0)
+            if kategori_id:
+                by_id[kategori_id] = (int(total or 0), last)
+    kategori = {names[kategori_id]: group for kategori_id, group in by_id.items() if kategori_id in names}
+
+    by_latest = sorted(kategori.items(), key=lambda item: item[1][1] or datetime.min, reverse=True)
+    by_amount = sorted(by_latest, key=lambda item: item[1][0], reverse=True)
+    return dict(
+        count=count, total_masuk=from_sen(masuk), total_keluar=from_sen(keluar),
+        kategori_totals=[(nama, from_sen(total)) for nama, (total, _) in by_amount]
+    )
+
+def get_range_totals(db, user_id: int, start_date, end_date) -> dict:
+    """
+    Report totals for the local days start_date..end_date (inclusive), read from
+    daily_rollups: at most one row per day, jenis and kategori, however many
+    transactions the range holds. Same shape as get_report_totals.
+    """
+    rows = db.query(
+        DailyRollup.jenis, DailyRollup.kategori_id, func.sum(DailyRollup.total_sen),
+        func.sum(DailyRollup.transaction_count), func.max(DailyRollup.tarikh)
+    ).filter(
+        DailyRollup.user_id == user_id,
+        DailyRollup.tarikh >= start_date,
+        DailyRollup.tarikh <= end_date
+    ).group_by(DailyRollup.jenis, DailyRollup.kategori_id).all()
+    return _report_totals(db, rows)
 
-    return total_masuk - total_keluar
+def get_data_version(db, user_id: int) -> int:
+    """A number that changes whenever the user's transactions do; see UserStats."""
+    return get_user_stats(db, user_id).data_version
+
+def get_daily_totals(db, user_id: int, start_date, end_date, jenis: str = 'keluar') -> dict:
+    """{local day: Decimal ringgit} of `jenis` for the days in start_date..end_date that have any, from daily_rollups."""
+    rows = db.query(DailyRollup.tarikh, func.sum(DailyRollup.total_sen)).filter(
+        DailyRollup.user_id == user_id,
+        DailyRollup.jenis == jenis,
+        DailyRollup.tarikh >= start_date,
+        DailyRollup.tarikh <= end_date
+    ).group_by(DailyRollup.tarikh).all()
+    return {day: from_sen(total) for day, total in rows}
+
+def get_balance(db, user_id: int) -> Decimal:
+    stats = get_user_stats(db, user_id)
+    return from_sen(stats.masuk_sen - stats.keluar_sen)
 
 def delete_transaction(db, user_id: int, transaction_id: int):
     trans_to_delete = db.query(Transaction).filter(
@@ -113,15 +592,129 @@ def delete_transaction(db, user_id: int, transaction_id: int):
 
     if trans_to_delete:
         db.delete(trans_to_delete)
+        db.flush()
+        _apply_to_stats(db, trans_to_delete, -1)
+        _apply_kategori_usage(db, Counter([trans_to_delete.kategori_id]), sign=-1)
+        _apply_to_rollups(db, user_id, [(
+            trans_to_delete.tarikh, trans_to_delete.jenis, trans_to_delete.kategori_id, trans_to_delete.amaun_sen
+        )], sign=-1)
         db.commit()
+        report_cache.invalidate_user(user_id)
         return trans_to_delete
-    return None
+    return _delete_archived_transaction(db, user_id, transaction_id)
+
+def _delete_archived_transaction(db, user_id: int, transaction_id: int):
+    """/padam of an archived id: removes it and takes it out of the carried-forward totals too."""
+    A = ArchivedTransaction
+    trans = db.query(A).filter(A.id == transaction_id, A.user_id == user_id).first()
+    if trans is None:
+        return None
+    db.delete(trans)
+    db.flush()
+    db.execute(
+        update(ArchiveTotals).where(ArchiveTotals.user_id == user_id, ArchiveTotals.jenis == trans.jenis).values(
+            total_sen=ArchiveTotals.total_sen - trans.amaun_sen,
+            transaction_count=ArchiveTotals.transaction_count - 1,
+            last_transaction_at=select(func.max(A.tarikh)).where(A.user_id == user_id, A.jenis == trans.jenis)
+            .scalar_subquery()
+        ).execution_options(synchronize_session=False)
+    )
+    _apply_to_stats(db, trans, -1)
+    _apply_kategori_usage(db, Counter([trans.kategori_id]), sign=-1)
+    _apply_to_rollups(db, user_id, [(trans.tarikh, trans.jenis, trans.kategori_id, trans.amaun_sen)], sign=-1)
+    db.commit()
+    report_cache.invalidate_user(user_id)
+    return trans
 
-def get_kategori(db, user_id: int):
-    return db.query(Transaction.kategori).filter(
-        Transaction.user_id == user_id, 
-        Transaction.kategori.isnot(None)
-    ).distinct().all()
+def delete_transactions(db, user_id: int, first_id: int, last_id: int, tarikh=None) -> int:
+    """
+    Deletes a user's transactions with ids from first_id to last_id, inclusive,
+    in one DB transaction (undoing a multi-line entry). With `tarikh`, only rows
+    stamped with it: the batch's own, not a concurrent message's rows whose ids
+    fell inside the range. Returns the count deleted.
+    """
+    in_range = (
+        Transaction.user_id == user_id,
+        Transaction.id.between(first_id, last_id),
+    )
+    if tarikh is not None:
+        in_range += (Transaction.tarikh == tarikh,)
+    rows = db.query(
+        Transaction.tarikh, Transaction.jenis, Transaction.kategori_id, Transaction.amaun_sen
+    ).filter(*in_range).all()
+    if not rows:
+        return 0
+
+    db.execute(delete(Transaction).where(*in_range).execution_options(synchronize_session=False))
+    _apply_stats_delta(
+        db, user_id,
+        masuk=-sum(row.amaun_sen for row in rows if row.jenis == 'masuk'),
+        keluar=-sum(row.amaun_sen for row in rows if row.jenis == 'keluar'),
+        count=-len(rows), latest=max(row.tarikh for row in rows)
+    )
+    _apply_kategori_usage(db, Counter(row.kategori_id for row in rows), sign=-1)
+    _apply_to_rollups(db, user_id, rows, sign=-1)
+    db.commit()
+    report_cache.invalidate_user(user_id)
+    return len(rows)
+
+def get_kategori(db, user_id: int, limit: int = None):
+    """
+    A user's categories in use as (id, nama, usage_count), most used first: read
+    from the kategori dictionary, so the cost does not grow with history. With
+    `limit`, the top categories (e.g. for quick-entry buttons).
+    """
+    query = db.query(Kategori.id, Kategori.nama, Kategori.usage_count).filter(
+        Kategori.user_id == user_id,
+        Kategori.usage_count > 0
+    ).order_by(Kategori.usage_count.desc(), Kategori.nama)
+    return query.limit(limit).all() if limit else query.all()
+
+def get_transaction_page(db, user_id: int, cursor=None, older: bool = True, limit: int = 10):
+    """
+    One page of a user's history, newest first, by keyset on (tarikh, id): the
+    `limit` rows just older than cursor, or just newer with older=False; no
+    cursor is the newest page. Costs the same at any depth. Returns (rows, more),
+    more telling whether rows remain beyond the page in that direction.
+    """
+    T = Transaction
+    query = db.query(T.id, T.jenis, T.amaun_sen, T.kategori, T.nota, T.tarikh).filter(T.user_id == user_id)
+    if cursor is not None:
+        key, bound = tuple_(T.tarikh, T.id), tuple_(*cursor)
+        query = query.filter(key < bound if older else key > bound)
+    order = (T.tarikh.desc(), T.id.desc()) if older else (T.tarikh.asc(), T.id.asc())
+    rows = query.order_by(*order).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not older:
+        rows.reverse()
+    return rows, more
+
+def transaction_history(user_id: int, columns, start=None, end=None):
+    """
+    Subquery over a user's hot and archived transactions together (UNION ALL),
+    with tarikh in [start, end) when given, for readers of long history.
+    """
+    def branch(model):
+        query = select(*(getattr(model, column) for column in columns)).where(model.user_id == user_id)
+        if start is not None:
+            query = query.where(model.tarikh >= start)
+        if end is not None:
+            query = query.where(model.tarikh < end)
+        return query
+    return union_all(branch(Transaction), branch(ArchivedTransaction)).subquery()
+
+def get_transaction_columns(db, user_id: int, since, limit: int):
+    """
+    A user's transactions since `since` (newest first, at most `limit`) as
+    columns: (amaun_sen, tarikh, kategori_id, jenis) tuples, for analysis code
+    that works on whole arrays. Includes archived transactions.
+    """
+    history = transaction_history(user_id, ('amaun_sen', 'tarikh', 'kategori_id', 'jenis'), start=since)
+    rows = db.execute(select(history).order_by(history.c.tarikh.desc()).limit(limit)).all()
+    if not rows:
+        return (), (), (), ()
+    return tuple(zip(*rows))
 
 def get_all_transactions_by_user(db, user_id: int):
     """Gets all transactions for a specific user, ordered by date."""
@@ -129,4 +722,665 @@ def get_all_transactions_by_user(db, user_id: int):
 
 def count_transactions(db, user_id: int) -> int:
     """Counts the total number of transactions for a specific user."""
-    return db.query(Transaction).filter(Transaction.user_id == user_id).count()
+    return get_user_stats(db, user_id).transaction_count
+
+# --- Category Dictionary ---
+def normalise_kategori(nama):
+    """The canonical (case-folded) form of a kategori, or None for none."""
+    return (nama or '').strip().casefold() or None
+
+def _insert_ignoring_conflicts(db, model):
+    """INSERT that skips rows hitting a unique constraint (SQLite and PostgreSQL)."""
+    dialect = db.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+    return insert(model)
+
+def _kategori_ids(db, keys, chunk_size: int = 500) -> dict:
+    """
+    Maps {(user_id, canonical nama)} to kategori ids, creating the missing ones.
+    Concurrent writers creating the same name both end up with the same row.
+    """
+    found = {}
+    keys = list(keys)
+    for offset in range(0, len(keys), chunk_size):
+        chunk = keys[offset:offset + chunk_size]
+        def lookup():
+            rows = db.query(Kategori.user_id, Kategori.nama, Kategori.id).filter(
+                Kategori.user_id.in_({user_id for user_id, _ in chunk}),
+                Kategori.nama.in_({nama for _, nama in chunk})
+            )
+            found.update(((user_id, nama), kategori_id) for user_id, nama, kategori_id in rows)
+        lookup()
+        missing = [key for key in chunk if key not in found]
+        if missing:
+            db.execute(_insert_ignoring_conflicts(db, Kategori), [
+                dict(user_id=user_id, nama=nama, usage_count=0) for user_id, nama in missing
+            ])
+            lookup()
+    return found
+
+def _assign_kategori(db, pairs) -> list:
+    """
+    Resolves the (user_id, kategori) of rows about to be inserted to kategori
+    ids (None for none), creating categories on first use and counting the rows
+    in their usage. Runs inside the caller's DB transaction.
+    """
+    keys = [(user_id, normalise_kategori(kategori)) for user_id, kategori in pairs]
+    ids = _kategori_ids(db, {key for key in keys if key[1]})
+    kategori_ids = [ids.get(key) for key in keys]
+    _apply_kategori_usage(db, Counter(kategori_ids))
+    return kategori_ids
+
+def _apply_kategori_usage(db, usage: Counter, sign: int = 1):
+    """Adds (sign=1) or removes (sign=-1) {kategori_id: rows} usage with one executemany UPDATE."""
+    params = [dict(b_id=kategori_id, b_count=sign * count) for kategori_id, count in usage.items() if kategori_id]
+    if params:
+        table = Kategori.__table__
+        db.execute(
+            table.update().where(table.c.id == bindparam('b_id'))
+            .values(usage_count=table.c.usage_count + bindparam('b_count')),
+            params
+        )
+
+def _kategori_names(db, kategori_ids) -> dict:
+    kategori_ids = [kategori_id for kategori_id in kategori_ids if kategori_id]
+    if not kategori_ids:
+        return {}
+    return dict(db.query(Kategori.id, Kategori.nama).filter(Kategori.id.in_(kategori_ids)).all())
+
+def _existing_models(db, models) -> list:
+    """The models whose tables exist; migrations run before init_db creates the new ones."""
+    inspector = inspect(db.get_bind())
+    return [model for model in models if inspector.has_table(model.__tablename__)]
+
+def backfill_kategori_ids(db) -> int:
+    """
+    Migration: gives every transaction (hot and archived) that has a kategori
+    but no kategori_id its dictionary id, creating categories and usage counts
+    from history. Safe to re-run; missing tables are skipped. Returns the
+    number of rows updated.
+    """
+    updated = 0
+    for model in _existing_models(db, (Transaction, ArchivedTransaction)):
+        groups = db.query(model.user_id, model.kategori, func.count(model.id)).filter(
+            model.kategori.isnot(None),
+            model.kategori_id.is_(None)
+        ).group_by(model.user_id, model.kategori).all()
+        groups = [(user_id, kategori, normalise_kategori(kategori), count) for user_id, kategori, count in groups]
+        ids = _kategori_ids(db, {(user_id, nama) for user_id, _, nama, _ in groups if nama})
+        usage = Counter()
+        params = []
+        for user_id, kategori, nama, count in groups:
+            if nama:
+                usage[ids[(user_id, nama)]] += count
+                params.append(dict(b_user_id=user_id, b_kategori=kategori, b_id=ids[(user_id, nama)]))
+        if params:
+            table = model.__table__
+            db.execute(
+                table.update().where(
+                    table.c.user_id == bindparam('b_user_id'),
+                    table.c.kategori == bindparam('b_kategori'),
+                    table.c.kategori_id.is_(None)
+                ).values(kategori_id=bindparam('b_id')),
+                params
+            )
+        _apply_kategori_usage(db, usage)
+        db.commit()
+        updated += sum(usage.values())
+    return updated
+
+def backfill_amaun_sen(db) -> tuple:
+    """
+    Migration: fills amaun_sen from the legacy Float amaun column of
+    transactions and transactions_archive, rounded to the nearest sen. Returns
+    (rows converted, rows whose amaun was not a whole number of sen), so any
+    rounding is reported rather than silent. Safe to re-run; missing tables and
+    tables without the legacy column are skipped.
+    """
+    inspector = inspect(db.get_bind())
+    converted = inexact = 0
+    for model in _existing_models(db, (Transaction, ArchivedTransaction)):
+        table = model.__tablename__
+        if 'amaun' not in {column['name'] for column in inspector.get_columns(table)}:
+            continue
+        inexact += db.execute(text(
+            f"SELECT COUNT(*) FROM {table} WHERE amaun_sen IS NULL AND ABS(amaun * 100 - ROUND(amaun * 100)) > 1e-6"
+        )).scalar()
+        converted += db.execute(text(
+            f"UPDATE {table} SET amaun_sen = CAST(ROUND(COALESCE(amaun, 0) * 100) AS BIGINT) WHERE amaun_sen IS NULL"
+        )).rowcount
+        db.commit()
+    return converted, inexact
+
+# --- Per-user Aggregates ---
+def _compute_stats(db, user_id: int) -> dict:
+    """Recomputes a user's aggregates from the raw transactions plus the archived totals."""
+    rows = db.query(
+        Transaction.jenis, func.sum(Transaction.amaun_sen), func.count(Transaction.id), func.max(Transaction.tarikh)
+    ).filter(Transaction.user_id == user_id).group_by(Transaction.jenis).all()
+    archived = db.query(
+        ArchiveTotals.jenis, ArchiveTotals.total_sen, ArchiveTotals.transaction_count, ArchiveTotals.last_transaction_at
+    ).filter(ArchiveTotals.user_id == user_id).all()
+    return _stats_from_rows(rows + archived)
+
+def _stats_from_rows(rows) -> dict:
+    """Folds (jenis, sen, count, last) rows, several per jenis allowed, into UserStats values."""
+    stats = dict(masuk_sen=0, keluar_sen=0, transaction_count=0, last_transaction_at=None)
+    for jenis, total, count, last in rows:
+        if jenis == 'masuk':
+            stats['masuk_sen'] += int(total or 0)
+        elif jenis == 'keluar':
+            stats['keluar_sen'] += int(total or 0)
+        stats['transaction_count'] += count
+        if last and (stats['last_transaction_at'] is None or last > stats['last_transaction_at']):
+            stats['last_transaction_at'] = last
+    return stats
+
+def get_user_stats(db, user_id: int) -> UserStats:
+    """
+    Returns the user's aggregate row, seeding it from history the first time.
+    If another writer seeds it first, its row is kept and returned.
+    """
+    stats = db.get(UserStats, user_id)
+    if stats is None:
+        db.execute(_insert_ignoring_conflicts(db, UserStats).values(user_id=user_id, **_compute_stats(db, user_id)))
+        db.commit()
+        stats = db.get(UserStats, user_id)
+    return stats
+
+def _apply_to_stats(db, trans: Transaction, sign: int):
+    """
+    Folds one inserted (sign=1) or deleted (sign=-1) transaction into the user's
+    aggregates. Runs inside the caller's DB transaction, before its commit.
+    """
+    amaun_sen = sign * trans.amaun_sen
+    _apply_stats_delta(
+        db, trans.user_id,
+        masuk=amaun_sen if trans.jenis == 'masuk' else 0,
+        keluar=amaun_sen if trans.jenis == 'keluar' else 0,
+        count=sign, latest=trans.tarikh
+    )
+
+def _apply_stats_delta(db, user_id: int, masuk: int, keluar: int, count: int, latest=None):
+    """
+    Adds already-flushed changes (masuk and keluar in sen) to a user's aggregates
+    with one atomic UPDATE.
+    A positive count adds rows, latest being the newest added tarikh; a negative
+    count removes rows, latest being the newest removed tarikh.
+    """
+    values = {
+        UserStats.transaction_count: UserStats.transaction_count + count,
+        UserStats.masuk_sen: UserStats.masuk_sen + masuk,
+        UserStats.keluar_sen: UserStats.keluar_sen + keluar,
+        UserStats.data_version: UserStats.data_version + 1,
+    }
+    if count > 0 and latest is not None:
+        values[UserStats.last_transaction_at] = case(
+            (UserStats.last_transaction_at.is_(None), latest),
+            (UserStats.last_transaction_at < latest, latest),
+            else_=UserStats.last_transaction_at
+        )
+
+    apply = update(UserStats).where(UserStats.user_id == user_id).values(values) \
+        .execution_options(synchronize_session=False)
+    updated = db.execute(apply).rowcount
+    if not updated:
+        # First write for this user: seed from history, which already includes this change
+        seeded = db.execute(
+            _insert_ignoring_conflicts(db, UserStats).values(user_id=user_id, **_compute_stats(db, user_id))
+        ).rowcount
+        if not seeded:
+            # A concurrent writer seeded the row first, from history without this change
+            db.execute(apply)
+    elif count < 0:
+        last = db.query(UserStats.last_transaction_at).filter(UserStats.user_id == user_id).scalar()
+        if last is None or latest is None or latest >= last:
+            candidates = (
+                db.query(func.max(Transaction.tarikh)).filter(Transaction.user_id == user_id).scalar(),
+                db.query(func.max(ArchiveTotals.last_transaction_at)).filter(ArchiveTotals.user_id == user_id).scalar(),
+            )
+            last = max((c for c in candidates if c is not None), default=None)
+            db.execute(
+                update(UserStats).where(UserStats.user_id == user_id).values(last_transaction_at=last)
+                .execution_options(synchronize_session=False)
+            )
+
+def _apply_stats_additions(db, additions: dict):
+    """
+    Adds {user_id: (masuk sen, keluar sen, count, latest)} insertions to many users'
+    aggregates with one executemany UPDATE; users without a row yet are seeded
+    from history, as in _apply_stats_delta.
+    """
+    if not additions:
+        return
+    existing = {user_id for (user_id,) in db.query(UserStats.user_id).filter(UserStats.user_id.in_(additions))}
+    table = UserStats.__table__
+    latest = bindparam('b_latest')
+    updates = [
+        dict(b_user_id=user_id, b_masuk=masuk, b_keluar=keluar, b_count=count, b_latest=last)
+        for user_id, (masuk, keluar, count, last) in additions.items() if user_id in existing
+    ]
+    if updates:
+        db.execute(
+            table.update().where(table.c.user_id == bindparam('b_user_id')).values(
+                transaction_count=table.c.transaction_count + bindparam('b_count'),
+                masuk_sen=table.c.masuk_sen + bindparam('b_masuk'),
+                keluar_sen=table.c.keluar_sen + bindparam('b_keluar'),
+                data_version=table.c.data_version + 1,
+                last_transaction_at=case(
+                    (table.c.last_transaction_at.is_(None), latest),
+                    (table.c.last_transaction_at < latest, latest),
+                    else_=table.c.last_transaction_at
+                )
+            ),
+            updates
+        )
+    for user_id in set(additions) - existing:
+        db.add(UserStats(user_id=user_id, **_compute_stats(db, user_id)))
+
+def _local_day(tarikh):
+    """The TIMEZONE calendar day of a tarikh; SQLite hands them back naive, in local time."""
+    if tarikh.tzinfo is not None:
+        tarikh = tarikh.astimezone(pytz.timezone(TIMEZONE))
+    return tarikh.date()
+
+def _rollup_groups(rows) -> dict:
+    """Sums (tarikh, jenis, kategori_id, amaun_sen) rows into {(day, jenis, kategori_id): [sen, count]}."""
+    groups = {}
+    for tarikh, jenis, kategori_id, amaun_sen in rows:
+        group = groups.setdefault((_local_day(tarikh), jenis, kategori_id or 0), [0, 0])
+        group[0] += amaun_sen
+        group[1] += 1
+    return groups
+
+def _apply_to_rollups(db, user_id: int, rows, sign: int = 1):
+    """
+    Folds inserted (sign=1) or deleted (sign=-1) (tarikh, jenis, kategori_id, amaun_sen)
+    rows into the user's daily rollups, inside the caller's DB transaction.
+    """
+    _apply_rollup_groups(db, {(user_id, *key): group for key, group in _rollup_groups(rows).items()}, sign)
+
+def _apply_rollup_groups(db, groups: dict, sign: int = 1):
+    """
+    Applies {(user_id, day, jenis, kategori_id): [sen, count]} to daily_rollups:
+    one executemany UPDATE for the groups that exist, one INSERT for new ones.
+    """
+    if not groups:
+        return
+    users = {user_id for user_id, _, _, _ in groups}
+    days = [day for _, day, _, _ in groups]
+    existing = set(db.query(DailyRollup.user_id, DailyRollup.tarikh, DailyRollup.jenis, DailyRollup.kategori_id).filter(
+        DailyRollup.user_id.in_(users),
+        DailyRollup.tarikh >= min(days),
+        DailyRollup.tarikh <= max(days)
+    ).all())
+
+    table = DailyRollup.__table__
+    updates = [
+        dict(b_user_id=user_id, b_tarikh=day, b_jenis=jenis, b_kategori_id=kategori_id,
+             b_total=sign * total, b_count=sign * count)
+        for (user_id, day, jenis, kategori_id), (total, count) in groups.items()
+        if (user_id, day, jenis, kategori_id) in existing
+    ]
+    if updates:
+        db.execute(
+            table.update().where(
+                table.c.user_id == bindparam('b_user_id'),
+                table.c.tarikh == bindparam('b_tarikh'),
+                table.c.jenis == bindparam('b_jenis'),
+                table.c.kategori_id == bindparam('b_kategori_id')
+            ).values(
+                total_sen=table.c.total_sen + bindparam('b_total'),
+                transaction_count=table.c.transaction_count + bindparam('b_count')
+            ),
+            updates
+        )
+    if sign > 0:
+        inserts = [
+            dict(user_id=user_id, tarikh=day, jenis=jenis, kategori_id=kategori_id, total_sen=total,
+                 transaction_count=count)
+            for (user_id, day, jenis, kategori_id), (total, count) in groups.items()
+            if (user_id, day, jenis, kategori_id) not in existing
+        ]
+        if inserts:
+            db.execute(insert(DailyRollup), inserts)
+    else:
+        db.execute(delete(DailyRollup).where(
+            DailyRollup.user_id.in_(users),
+            DailyRollup.tarikh.in_(set(days)),
+            DailyRollup.transaction_count <= 0
+        ))
+
+def rebuild_daily_rollups(db, user_id: int = None, batch_size: int = 5000) -> int:
+    """
+    Rebuilds daily_rollups from `transactions` and the archive, for one user or
+    everyone, streaming the history one user at a time. Returns the rollup rows
+    written.
+    """
+    def branch(model):
+        query = select(model.user_id, model.tarikh, model.jenis, model.kategori_id, model.amaun_sen)
+        return query.where(model.user_id == user_id) if user_id is not None else query
+    history = union_all(branch(Transaction), branch(ArchivedTransaction)).subquery()
+    wipe = delete(DailyRollup)
+    if user_id is not None:
+        wipe = wipe.where(DailyRollup.user_id == user_id)
+    db.execute(wipe)
+
+    written = 0
+    def flush(owner, rows):
+        groups = _rollup_groups(rows)
+        if groups:
+            db.execute(insert(DailyRollup), [
+                dict(user_id=owner, tarikh=day, jenis=jenis, kategori_id=kategori_id, total_sen=total,
+                     transaction_count=count)
+                for (day, jenis, kategori_id), (total, count) in groups.items()
+            ])
+        return len(groups)
+
+    stream = db.execute(select(history).order_by(history.c.user_id).execution_options(yield_per=batch_size))
+    current, rows = None, []
+    for user, tarikh, jenis, kategori_id, amaun_sen in stream:
+        if user != current:
+            written += flush(current, rows)
+            current, rows = user, []
+        rows.append((tarikh, jenis, kategori_id, amaun_sen))
+    written += flush(current, rows)
+    db.commit()
+    return written
+
+def rebuild_user_stats(db, verify_only: bool = False) -> list:
+    """
+    Recomputes every user's aggregates from `transactions` and archive_totals and
+    compares them with the stored rows. Returns (drift, missing): a list of
+    (user_id, field, stored, actual) for each stored value that is wrong, and
+    the ids of users with history but no row yet. A missing row is not drift,
+    since get_user_stats seeds it on first use. Unless verify_only is set,
+    drift is corrected and missing rows are seeded.
+    """
+    rows = db.query(
+        Transaction.user_id, Transaction.jenis, func.sum(Transaction.amaun_sen),
+        func.count(Transaction.id), func.max(Transaction.tarikh)
+    ).group_by(Transaction.user_id, Transaction.jenis).all()
+    rows += db.query(
+        ArchiveTotals.user_id, ArchiveTotals.jenis, ArchiveTotals.total_sen,
+        ArchiveTotals.transaction_count, ArchiveTotals.last_transaction_at
+    ).all()
+    per_user = {}
+    for user_id, *rest in rows:
+        per_user.setdefault(user_id, []).append(rest)
+
+    stored = {s.user_id: s for s in db.query(UserStats).all()}
+    drift, missing = [], []
+    for user_id in set(per_user) | set(stored):
+        actual = _stats_from_rows(per_user.get(user_id, []))
+        stats = stored.get(user_id)
+        if stats is None:
+            missing.append(user_id)
+            if not verify_only:
+                db.add(UserStats(user_id=user_id, **actual))
+            continue
+        for field, value in actual.items():
+            current = getattr(stats, field)
+            if current != value:
+                drift.append((user_id, field, current, value))
+                if not verify_only:
+                    setattr(stats, field, value)
+                    stats.data_version = (stats.data_version or 0) + 1
+    if not verify_only:
+        db.commit()
+    return drift, sorted(missing)
+
+# --- Report Schedules ---
+KEKERAPAN = ('harian', 'mingguan', 'bulanan')
+DEFAULT_HARI = {'harian': None, 'mingguan': 6, 'bulanan': 31}  # Ahad; the month's last day
+
+def default_report_minute(user_id: int) -> int:
+    """AUTO_REPORT_TIME plus this user's offset within AUTO_REPORT_SPREAD, in minutes past midnight."""
+    hour, minute = (int(part) for part in AUTO_REPORT_TIME.split(":"))
+    return (hour * 60 + minute + user_id % max(AUTO_REPORT_SPREAD, 1)) % (24 * 60)
+
+def next_report_due(kekerapan: str, masa_minit: int, hari, zon_waktu: str, after):
+    """The first send of a schedule strictly after `after` (aware), in UTC."""
+    tz = pytz.timezone(zon_waktu)
+    day = after.astimezone(tz).date()
+    for _ in range(63):
+        if kekerapan == 'mingguan':
+            due_today = day.weekday() == hari
+        elif kekerapan == 'bulanan':
+            due_today = day.day == min(hari, calendar.monthrange(day.year, day.month)[1])
+        else:
+            due_today = True
+        if due_today:
+            moment = tz.localize(datetime.combine(day, datetime.min.time()) + timedelta(minutes=masa_minit))
+            if moment > after:
+                return moment.astimezone(pytz.utc)
+        day += timedelta(days=1)
+    raise ValueError(f"Invalid report schedule: {kekerapan} hari={hari}")
+
+def get_report_schedule(db, user_id: int):
+    return db.get(ReportSchedule, user_id)
+
+def set_report_schedule(db, user_id: int, enable: bool = True, now=None, **changes) -> ReportSchedule:
+    """
+    Creates or updates the user's schedule with `changes` (kekerapan, masa_minit,
+    hari, zon_waktu); fields not given keep their value, or the default for a
+    new schedule. A new kekerapan without a hari gets its default day. If
+    `enable`, or the schedule is already on, next_due_at moves to the next send
+    after now. Keeps User.auto_laporan in step.
+    """
+    schedule = db.get(ReportSchedule, user_id)
+    if schedule is None:
+        schedule = ReportSchedule(
+            user_id=user_id, kekerapan='harian', masa_minit=default_report_minute(user_id), hari=None, zon_waktu=TIMEZONE
+        )
+        db.add(schedule)
+    if 'kekerapan' in changes and 'hari' not in changes:
+        changes['hari'] = DEFAULT_HARI[changes['kekerapan']]
+    for field, value in changes.items():
+        setattr(schedule, field, value)
+    if enable or schedule.next_due_at is not None:
+        schedule.next_due_at = next_report_due(
+            schedule.kekerapan, schedule.masa_minit, schedule.hari, schedule.zon_waktu, now or datetime.now(pytz.utc)
+        )
+    db.query(User).filter(User.id == user_id).update(
+        {User.auto_laporan: 'off' if schedule.next_due_at is None else 'on'}, synchronize_session=False
+    )
+    db.commit()
+    return schedule
+
+def disable_report_schedule(db, user_id: int) -> bool:
+    """Switches the user's automatic reports off, keeping their settings. False if they were not on."""
+    schedule = db.get(ReportSchedule, user_id)
+    if schedule is None or schedule.next_due_at is None:
+        return False
+    schedule.next_due_at = None
+    db.query(User).filter(User.id == user_id).update({User.auto_laporan: 'off'}, synchronize_session=False)
+    db.commit()
+    return True
+
+def get_due_schedules(db, now, after=None, limit: int = 1000) -> list:
+    """
+    The next `limit` schedules due by `now`, oldest due first, after the
+    (next_due_at, user_id) keyset cursor `after`. One indexed range scan, joined
+    to the users and their balances. Returns dicts with the schedule fields,
+    telegram_id and balance; next_due_at is as stored, for advance_report_schedules.
+    """
+    query = db.query(
+        ReportSchedule.user_id, ReportSchedule.kekerapan, ReportSchedule.masa_minit, ReportSchedule.hari,
+        ReportSchedule.zon_waktu, ReportSchedule.next_due_at, User.telegram_id, UserStats.masuk_sen, UserStats.keluar_sen
+    ).join(User, User.id == ReportSchedule.user_id).outerjoin(
+        UserStats, UserStats.user_id == ReportSchedule.user_id
+    ).filter(ReportSchedule.next_due_at <= now)
+    if after is not None:
+        query = query.filter(tuple_(ReportSchedule.next_due_at, ReportSchedule.user_id) > tuple_(*after))
+    rows = query.order_by(ReportSchedule.next_due_at, ReportSchedule.user_id).limit(limit).all()
+
+    batch = []
+    for row in rows:
+        entry = row._asdict()
+        masuk_sen, keluar_sen = entry.pop('masuk_sen'), entry.pop('keluar_sen')
+        # No aggregate row yet; get_balance seeds it once
+        entry['balance'] = get_balance(db, row.user_id) if masuk_sen is None else from_sen(masuk_sen - keluar_sen)
+        batch.append(entry)
+    return batch
+
+def get_period_totals(db, user_ids, zon_waktu: str, start_date, end_date) -> dict:
+    """
+    {user_id: report totals} for the days start_date..end_date (inclusive) in
+    zon_waktu, for several users with one grouped query. In the bot's own
+    TIMEZONE the days come from daily_rollups; other zones' days do not line up
+    with the rollups', so those read the transactions in the range.
+    """
+    if zon_waktu == TIMEZONE:
+        rows = db.query(
+            DailyRollup.user_id, DailyRollup.jenis, DailyRollup.kategori_id, func.sum(DailyRollup.total_sen),
+            func.sum(DailyRollup.transaction_count), func.max(DailyRollup.tarikh)
+        ).filter(
+            DailyRollup.user_id.in_(user_ids),
+            DailyRollup.tarikh >= start_date,
+            DailyRollup.tarikh <= end_date
+        ).group_by(DailyRollup.user_id, DailyRollup.jenis, DailyRollup.kategori_id).all()
+    else:
+        zone, local = pytz.timezone(zon_waktu), pytz.timezone(TIMEZONE)
+        # Stored tarikh are TIMEZONE wall-clock times (SQLite keeps no offset)
+        start_datetime = zone.localize(datetime.combine(start_date, datetime.min.time())).astimezone(local)
+        end_datetime = zone.localize(datetime.combine(end_date + timedelta(days=1), datetime.min.time())).astimezone(local)
+        rows = db.query(
+            Transaction.user_id, Transaction.jenis, Transaction.kategori_id, func.sum(Transaction.amaun_sen),
+            func.count(Transaction.id), func.max(Transaction.tarikh)
+        ).filter(
+            Transaction.user_id.in_(user_ids),
+            Transaction.tarikh >= start_datetime,
+            Transaction.tarikh < end_datetime
+        ).group_by(Transaction.user_id, Transaction.jenis, Transaction.kategori_id).all()
+
+    names = _kategori_names(db, {row.kategori_id for row in rows})
+    per_user = {}
+    for user_id, *rest in rows:
+        per_user.setdefault(user_id, []).append(rest)
+    return {user_id: _fold_report_rows(per_user.get(user_id, []), names) for user_id in user_ids}
+
+def advance_report_schedules(db, advances):
+    """
+    Moves schedules past a send: dicts of user_id, due (next_due_at as read),
+    next_due and sent_at (None when nothing was delivered). A schedule changed
+    since it was read (a new due time) is left alone.
+    """
+    if not advances:
+        return
+    table = ReportSchedule.__table__
+    db.execute(
+        table.update().where(table.c.user_id == bindparam('b_user'), table.c.next_due_at == bindparam('b_due'))
+        .values(next_due_at=bindparam('b_next'), last_sent_at=func.coalesce(bindparam('b_sent'), table.c.last_sent_at)),
+        [dict(b_user=a['user_id'], b_due=a['due'], b_next=a['next_due'], b_sent=a['sent_at']) for a in advances]
+    )
+    db.commit()
+
+def backfill_report_schedules(db, now=None) -> int:
+    """
+    Migration: gives every user with auto_laporan on but no schedule the old
+    behaviour, a daily report in TIMEZONE, at AUTO_REPORT_TIME plus their
+    spread offset. Safe to re-run. Returns the number of schedules created.
+    """
+    now = now or datetime.now(pytz.utc)
+    scheduled = {user_id for (user_id,) in db.query(ReportSchedule.user_id)}
+    rows = []
+    for (user_id,) in db.query(User.id).filter(User.auto_laporan == 'on'):
+        if user_id in scheduled:
+            continue
+        masa_minit = default_report_minute(user_id)
+        rows.append(dict(
+            user_id=user_id, kekerapan='harian', masa_minit=masa_minit, hari=None, zon_waktu=TIMEZONE,
+            next_due_at=next_report_due('harian', masa_minit, None, TIMEZONE, now)
+        ))
+    if rows:
+        db.execute(insert(ReportSchedule), rows)
+        db.commit()
+    return len(rows)
+
+# --- Archival ---
+def archive_cutoff(days: int = None, now=None):
+    """The tarikh before which transactions are archived: `days` (ARCHIVE_AFTER_DAYS) ago, at local midnight."""
+    tz = pytz.timezone(TIMEZONE)
+    days = max(days if days is not None else ARCHIVE_AFTER_DAYS, ARCHIVE_MIN_DAYS)
+    today = (now or datetime.now(tz)).astimezone(tz).date()
+    return tz.localize(datetime.combine(today - timedelta(days=days), datetime.min.time()))
+
+def archive_transactions(db, before, user_id: int = None, batch_size: int = 5000) -> int:
+    """
+    Moves transactions dated before `before` into transactions_archive, one
+    batch per commit, adding their sums to archive_totals in the same commit.
+    user_stats and daily_rollups already cover them and are left alone, so
+    balances and reports do not change. Returns the number of rows moved.
+    """
+    T = Transaction
+    columns = (T.id, T.user_id, T.jenis, T.amaun_sen, T.kategori, T.kategori_id, T.nota, T.tarikh)
+    moved = 0
+    while True:
+        query = db.query(*columns).filter(T.tarikh < before)
+        if user_id is not None:
+            query = query.filter(T.user_id == user_id)
+        rows = query.order_by(T.id).limit(batch_size).all()
+        if not rows:
+            break
+        db.execute(insert(ArchivedTransaction), [row._asdict() for row in rows])
+        db.execute(delete(T).where(T.id.in_([row.id for row in rows])).execution_options(synchronize_session=False))
+        carried = {}
+        for row in rows:
+            group = carried.setdefault((row.user_id, row.jenis), [0, 0, row.tarikh])
+            group[0] += row.amaun_sen
+            group[1] += 1
+            group[2] = max(group[2], row.tarikh)
+        _apply_archive_totals(db, carried)
+        db.commit()
+        moved += len(rows)
+    return moved
+
+def rebuild_archive_totals(db) -> int:
+    """Recomputes archive_totals from transactions_archive. Returns the rows written."""
+    A = ArchivedTransaction
+    rows = db.query(
+        A.user_id, A.jenis, func.sum(A.amaun_sen), func.count(A.id), func.max(A.tarikh)
+    ).group_by(A.user_id, A.jenis).all()
+    db.execute(delete(ArchiveTotals))
+    if rows:
+        db.execute(insert(ArchiveTotals), [
+            dict(user_id=user_id, jenis=jenis, total_sen=int(total or 0), transaction_count=count,
+                 last_transaction_at=last)
+            for user_id, jenis, total, count, last in rows
+        ])
+    db.commit()
+    return len(rows)
+
+def _apply_archive_totals(db, carried: dict):
+    """Adds {(user_id, jenis): [sen, count, latest]} to archive_totals: one executemany UPDATE, one INSERT."""
+    users = {user_id for user_id, _ in carried}
+    existing = set(db.query(ArchiveTotals.user_id, ArchiveTotals.jenis).filter(ArchiveTotals.user_id.in_(users)).all())
+    table = ArchiveTotals.__table__
+    latest = bindparam('b_latest')
+    updates = [
+        dict(b_user_id=user_id, b_jenis=jenis, b_total=total, b_count=count, b_latest=last)
+        for (user_id, jenis), (total, count, last) in carried.items() if (user_id, jenis) in existing
+    ]
+    if updates:
+        db.execute(
+            table.update().where(table.c.user_id == bindparam('b_user_id'), table.c.jenis == bindparam('b_jenis')).values(
+                total_sen=table.c.total_sen + bindparam('b_total'),
+                transaction_count=table.c.transaction_count + bindparam('b_count'),
+                last_transaction_at=case(
+                    (table.c.last_transaction_at.is_(None), latest),
+                    (table.c.last_transaction_at < latest, latest),
+                    else_=table.c.last_transaction_at
+                )
+            ),
+            updates
+        )
+    inserts = [
+        dict(user_id=user_id, jenis=jenis, total_sen=total, transaction_count=count, last_transaction_at=last)
+        for (user_id, jenis), (total, count, last) in carried.items() if (user_id, jenis) not in existing
+    ]
+    if inserts:
+        db.execute(insert(ArchiveTotals), inserts)
@@ -0,0 +1,123 @@
+# dedup.py
+"""
+Drops Telegram webhook redeliveries by update_id.
+
+Telegram retries a delivery it did not see acknowledged in time, with the same
+update_id, so a slow /belanja can arrive twice. telegram_webhook claims each
+update_id before parsing the update; a claim that fails means the update has
+already been accepted and the retry is answered 200 without being processed.
+
+- memory: an LRU of update_ids seen in the last UPDATE_DEDUP_WINDOW seconds,
+  capped at UPDATE_DEDUP_MAX_ENTRIES. Per process.
+- database: the processed_updates table, whose primary key makes the claim
+  atomic across workers and survives serverless cold starts. A memory layer in
+  front answers retries that land on the same instance without a query.
+
+UPDATE_DEDUP picks the backend (memory, database or off); on Vercel it
+defaults to database.
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pytz
+
+import async_db as adb
+
+logger = logging.getLogger(__name__)
+
+UPDATE_DEDUP = os.getenv("UPDATE_DEDUP", "database" if os.getenv("VERCEL") else "memory")
+UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", "86400"))  # seconds
+UPDATE_DEDUP_MAX_ENTRIES = int(os.getenv("UPDATE_DEDUP_MAX_ENTRIES", "100000"))
+PRUNE_INTERVAL = 600  # seconds between deletes of expired processed_updates rows
+
+
+class MemoryBackend:
+    def __init__(self, window: int = UPDATE_DEDUP_WINDOW, max_entries: int = UPDATE_DEDUP_MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max_entries
+        self._seen = OrderedDict()  # update_id -> first seen (monotonic), oldest first
+
+    async def claim(self, update_id: int) -> bool:
+        now = time.monotonic()
+        while self._seen:
+            oldest, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.window:
+                break
+            del self._seen[oldest]
+        if update_id in self._seen:
+            return False
+        self._seen[update_id] = now
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+        return True
+
+    def info(self) -> dict:
+        return {"backend": "memory", "entries": len(self._seen), "window": self.window}
+
+
+class DatabaseBackend:
+    def __init__(self, window: int = UPDATE_DEDUP_WINDOW, local: MemoryBackend = None):
+        self.window = window
+        self.local = local or MemoryBackend(window)
+        self.errors = 0
+        self._last_prune = None
+
+    async def claim(self, update_id: int) -> bool:
+        if not await self.local.claim(update_id):
+            return False
+        now = datetime.now(pytz.utc)
+        try:
+            async with adb.AsyncSessionLocal() as conn:
+                claimed = await adb.claim_update(conn, update_id, now)
+                if self._last_prune is None or time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+                    self._last_prune = time.monotonic()
+                    await adb.prune_processed_updates(conn, now - timedelta(seconds=self.window))
+        except Exception as e:
+            # Processing a possible duplicate beats dropping an update while the DB is unreachable
+            self.errors += 1
+            logger.warning(f"Update dedup check failed for {update_id}, processing anyway: {e}")
+            return True
+        return claimed
+
+    def info(self) -> dict:
+        return {"backend": "database", "errors": self.errors, "window": self.window,
+                "local_entries": self.local.info()["entries"]}
+
+
+class UpdateDeduper:
+    """Counts accepted and duplicate deliveries around a backend; None disables it."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.accepted = 0
+        self.duplicates = 0
+
+    async def claim(self, update_id) -> bool:
+        """True if this update_id has not been seen (and is now recorded)."""
+        if self.backend is None or update_id is None:
+            return True
+        if await self.backend.claim(update_id):
+            self.accepted += 1
+            return True
+        self.duplicates += 1
+        return False
+
+    def stats(self) -> dict:
+        info = self.backend.info() if self.backend is not None else {"backend": "off"}
+        return {"accepted": self.accepted, "duplicates": self.duplicates, **info}
+
+
+def _make_backend():
+    if UPDATE_DEDUP == "database":
+        return DatabaseBackend()
+    if UPDATE_DEDUP == "memory":
+        return MemoryBackend()
+    if UPDATE_DEDUP != "off":
+        logger.warning(f"Unknown UPDATE_DEDUP={UPDATE_DEDUP!r}; update deduplication is off.")
+    return None
+
+
+update_deduper = UpdateDeduper(_make_backend())
@@ -0,0 +1,188 @@
+# export.py
+"""
+Streaming /backup export.
+
+Rows are read from the database in chunks through a server-side cursor,
+encoded a chunk at a time (CSV or JSON lines), optionally gzip-compressed on
+the fly, and written to spooled temporary files that move to disk once they
+grow. Output larger than Telegram's document limit is split into parts, each
+a complete file on its own.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import select
+
+import database as db
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+# Telegram bots may upload documents up to 50 MB; leave headroom for gzip's buffer
+EXPORT_PART_BYTES = int(os.getenv("EXPORT_PART_BYTES", str(45 * 1024 * 1024)))
+SPOOL_BYTES = 1024 * 1024
+
+FORMATS = ('csv', 'jsonl')
+CSV_HEADER = ['ID', 'Jenis', 'Amaun', 'Kategori', 'Nota', 'Tarikh']
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class _SpooledFile(tempfile.SpooledTemporaryFile):
+    """A spooled temp file named after its part; PTB reads the name off file objects it uploads."""
+
+    def __init__(self, name: str, max_size: int):
+        super().__init__(max_size=max_size)
+        self._part_name = name
+
+    @property
+    def name(self):
+        return self._part_name
+
+
+class _Part:
+    """One output file: a spooled temp file, optionally behind a gzip stream."""
+
+    def __init__(self, name: str, compress: bool):
+        self.name = name
+        self.file = _SpooledFile(name, SPOOL_BYTES)
+        self.stream = gzip.GzipFile(fileobj=self.file, mode='wb') if compress else self.file
+
+    @property
+    def size(self) -> int:
+        return self.file.tell()
+
+    def write(self, data: bytes):
+        self.stream.write(data)
+
+    def finish(self):
+        if self.stream is not self.file:
+            self.stream.close()
+        self.file.seek(0)
+        return self.name, self.file
+
+
+class BackupWriter:
+    """Encodes rows incrementally and rolls over to a new part at part_bytes."""
+
+    def __init__(self, fmt: str = 'csv', compress: bool = False, part_bytes: int = EXPORT_PART_BYTES,
+                 stamp: str = None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        self.fmt = fmt
+        self.compress = compress
+        self.part_bytes = part_bytes
+        self.stamp = stamp or datetime.now().strftime('%Y%m%d')
+        self.parts = []
+        self.rows = 0
+        self._part = None
+
+    def _filename(self, number: int) -> str:
+        suffix = f"_part{number}" if number > 1 else ""
+        return f"mykewangan_backup_{self.stamp}{suffix}.{self.fmt}" + (".gz" if self.compress else "")
+
+    def _open_part(self):
+        self._part = _Part(self._filename(len(self.parts) + 1), self.compress)
+        if self.fmt == 'csv':
+            self._part.write(self._encode_csv([CSV_HEADER]))
+
+    def _close_part(self):
+        if self._part is not None:
+            self.parts.append(self._part.finish())
+            self._part = None
+
+    @staticmethod
+    def _encode_csv(rows) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+
+    @staticmethod
+    def _encode_jsonl(rows) -> bytes:
+        lines = (
+            json.dumps(dict(zip(('id', 'jenis', 'amaun', 'kategori', 'nota', 'tarikh'), row)), ensure_ascii=False)
+            for row in rows
+        )
+        return ("\n".join(lines) + "\n").encode('utf-8')
+
+    def write_chunk(self, rows):
+        """rows: (id, jenis, amaun_sen, kategori, nota, tarikh) tuples."""
+        # JSON has no decimal type; a two-place float prints (and parses back) exactly
+        amaun = db.from_sen if self.fmt == 'csv' else (lambda sen: float(db.from_sen(sen)))
+        rows = [
+            (t_id, jenis, amaun(amaun_sen), kategori, nota, tarikh.strftime(DATE_FORMAT) if tarikh else None)
+            for t_id, jenis, amaun_sen, kategori, nota, tarikh in rows
+        ]
+        if not rows:
+            return
+        data = self._encode_csv(rows) if self.fmt == 'csv' else self._encode_jsonl(rows)
+        if self._part is not None and self._part.size + len(data) > self.part_bytes and self.rows:
+            self._close_part()
+        if self._part is None:
+            self._open_part()
+        self._part.write(data)
+        self.rows += len(rows)
+
+    def finish(self) -> list:
+        """Returns [(filename, fileobj)], each rewound and ready to upload."""
+        self._close_part()
+        return self.parts
+
+
+def parse_backup_args(args) -> dict:
+    """
+    Parses `/backup [csv|jsonl] [gz] [dari YYYY-MM-DD] [hingga YYYY-MM-DD]`; the
+    words dari/hingga are optional, the first date is the start, the second the
+    (inclusive) end. Raises ValueError on anything else.
+    """
+    options = dict(fmt='csv', compress=False, start=None, end=None)
+    dates = []
+    for arg in args or []:
+        word = arg.lower()
+        if word in FORMATS:
+            options['fmt'] = word
+        elif word in ('gz', 'gzip', 'zip'):
+            options['compress'] = True
+        elif word in ('dari', 'hingga'):
+            continue
+        else:
+            dates.append(datetime.strptime(arg, "%Y-%m-%d").date())
+    if len(dates) > 2:
+        raise ValueError("Too many dates")
+    if dates:
+        options['start'] = dates[0]
+    if len(dates) == 2:
+        options['end'] = dates[1]
+        if options['end'] < options['start']:
+            raise ValueError("End date is before start date")
+    return options
+
+
+def _date_bounds(start, end):
+    tz = pytz.timezone(db.TIMEZONE)
+    start_datetime = tz.localize(datetime.combine(start, datetime.min.time())) if start else None
+    end_datetime = tz.localize(datetime.combine(end + timedelta(days=1), datetime.min.time())) if end else None
+    return start_datetime, end_datetime
+
+
+async def export_transactions(conn, user_id: int, fmt: str = 'csv', compress: bool = False,
+                              start=None, end=None, part_bytes: int = EXPORT_PART_BYTES) -> BackupWriter:
+    """
+    Streams a user's transactions (newest first), archived ones included, into a
+    BackupWriter. `conn` is an AsyncSession; only one chunk of rows is held in
+    memory at a time.
+    """
+    start_datetime, end_datetime = _date_bounds(start, end)
+    history = db.transaction_history(
+        user_id, ('id', 'jenis', 'amaun_sen', 'kategori', 'nota', 'tarikh'), start=start_datetime, end=end_datetime
+    )
+    query = select(history).order_by(history.c.tarikh.desc()).execution_options(yield_per=EXPORT_CHUNK_ROWS)
+
+    writer = BackupWriter(fmt, compress, part_bytes)
+    result = await conn.stream(query)
+    async for chunk in result.partitions(EXPORT_CHUNK_ROWS):
+        writer.write_chunk(chunk)
+    return writer
@@ -0,0 +1,117 @@
+# group_commit.py
+"""
+Group-commit write path for transaction inserts.
+
+With WRITE_BATCHING=1 (the default on SQLite), async_db.add_transaction hands its row to a
+GroupCommitWriter instead of committing it alone. Rows arriving within
+WRITE_BATCH_WINDOW_MS of each other (or until WRITE_BATCH_MAX_ROWS are
+waiting) are written by database.add_transaction_batch in one commit, so a
+burst of inserts pays for one fsync instead of one each. Every caller still
+gets its own new row back, id included.
+
+If a batch fails, its rows are retried one at a time, so a bad row only
+fails its own caller.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytz
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+# On by default for SQLite: there every commit queues for the one write lock, and
+# without batching the async path is slower than the sync one under load
+# (benchmarks/bench_async_db.py). Set WRITE_BATCHING=0 or 1 to choose.
+WRITE_BATCHING = os.getenv("WRITE_BATCHING", "1" if db.DATABASE_URL.startswith("sqlite") else "0") == "1"
+WRITE_BATCH_WINDOW_MS = float(os.getenv("WRITE_BATCH_WINDOW_MS", "5"))
+WRITE_BATCH_MAX_ROWS = int(os.getenv("WRITE_BATCH_MAX_ROWS", "100"))
+
+
+class GroupCommitWriter:
+    def __init__(self, session_factory, window_ms: float = WRITE_BATCH_WINDOW_MS,
+                 max_rows: int = WRITE_BATCH_MAX_ROWS):
+        self.session_factory = session_factory
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self._pending = []  # (item, future)
+        self._full = None
+        self._task = None
+        self.batches = 0
+        self.rows = 0
+        self.largest_batch = 0
+        self.fallbacks = 0
+
+    async def add(self, user_id: int, jenis: str, amaun: Decimal, kategori: str, nota: str):
+        """Queues one insert and waits for the commit that includes it; returns the new Transaction."""
+        loop = asyncio.get_running_loop()
+        if self._full is None:
+            self._full = asyncio.Event()
+        future = loop.create_future()
+        tarikh = datetime.now(pytz.timezone(db.TIMEZONE))
+        self._pending.append(((user_id, jenis, amaun, kategori, nota, tarikh), future))
+        if len(self._pending) >= self.max_rows:
+            self._full.set()
+        # The flusher runs only while there is something to write
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return await future
+
+    async def _run(self):
+        while self._pending:
+            if len(self._pending) < self.max_rows:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            batch, self._pending = self._pending[:self.max_rows], self._pending[self.max_rows:]
+            await self._commit(batch)
+
+    async def _commit(self, batch):
+        try:
+            async with self.session_factory() as conn:
+                rows = await conn.run_sync(db.add_transaction_batch, [item for item, _ in batch])
+        except Exception as e:
+            logger.warning(f"Group commit of {len(batch)} rows failed ({e}); retrying them one by one")
+            self.fallbacks += 1
+            for item, future in batch:
+                try:
+                    async with self.session_factory() as conn:
+                        [row] = await conn.run_sync(db.add_transaction_batch, [item])
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(row)
+            return
+
+        self.batches += 1
+        self.rows += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for (_, future), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(row)
+
+    async def stop(self):
+        """Waits for queued rows to be written."""
+        if self._task is not None:
+            await self._task
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "window_ms": self.window * 1000,
+            "max_rows": self.max_rows,
+            "queued": len(self._pending),
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch": self.rows / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "fallbacks": self.fallbacks,
+        }
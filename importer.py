@@ -0,0 +1,71 @@
+# importer.py
+"""
+Parsing for /import: reads a CSV in the layout /backup writes (optionally
+gzip-compressed) into rows ready for database.import_transactions. Bad rows
+are collected with their line numbers instead of aborting the import.
+"""
+import csv
+import gzip
+import io
+import os
+from datetime import datetime
+
+import pytz
+
+import database as db
+from export import CSV_HEADER, DATE_FORMAT
+
+JENIS = ('masuk', 'keluar')
+# A compressed upload may expand to at most this many bytes; a gzip bomb stops here
+IMPORT_MAX_UNCOMPRESSED = int(os.getenv("IMPORT_MAX_UNCOMPRESSED", str(50 * 1024 * 1024)))
+
+
+def _parse_row(record: dict, tz) -> dict:
+    jenis = (record.get('Jenis') or '').strip().lower()
+    if jenis not in JENIS:
+        raise ValueError(f"jenis '{record.get('Jenis')}' mesti masuk atau keluar")
+
+    try:
+        amaun = db.parse_amaun(record.get('Amaun'))
+    except ValueError:
+        raise ValueError(f"amaun '{record.get('Amaun')}' bukan jumlah sah (cth. 12.50)")
+    if not amaun > 0:
+        raise ValueError("amaun mesti lebih daripada 0")
+
+    nota = (record.get('Nota') or '').strip() or None
+    kategori = (record.get('Kategori') or '').strip() or (nota.split()[0] if nota else None)
+
+    tarikh_text = (record.get('Tarikh') or '').strip()
+    try:
+        tarikh = tz.localize(datetime.strptime(tarikh_text, DATE_FORMAT)) if tarikh_text else datetime.now(tz)
+    except ValueError:
+        raise ValueError(f"tarikh '{tarikh_text}' tidak ikut format YYYY-MM-DD HH:MM:SS")
+
+    return dict(jenis=jenis, amaun=amaun, kategori=kategori, nota=nota, tarikh=tarikh)
+
+
+def parse_backup_csv(data: bytes):
+    """
+    Returns (rows, errors) where errors is a list of (line number, reason).
+    Raises ValueError if the file is not a CSV with the backup header, or if
+    it is gzip-compressed and expands past IMPORT_MAX_UNCOMPRESSED.
+    """
+    if data[:2] == b'\x1f\x8b':
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as compressed:
+            data = compressed.read(IMPORT_MAX_UNCOMPRESSED + 1)
+        if len(data) > IMPORT_MAX_UNCOMPRESSED:
+            raise ValueError(f"saiz selepas nyahmampat melebihi {IMPORT_MAX_UNCOMPRESSED // (1024 * 1024)} MB")
+    text = data.decode('utf-8-sig')
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [column for column in CSV_HEADER if column != 'ID' and column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Lajur tiada: {', '.join(missing)}")
+
+    tz = pytz.timezone(db.TIMEZONE)
+    rows, errors = [], []
+    for record in reader:
+        try:
+            rows.append(_parse_row(record, tz))
+        except ValueError as e:
+            errors.append((reader.line_num, str(e)))
+    return rows, errors
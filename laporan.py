@@ -1,13 +1,18 @@
-from datetime import datetime, timedelta
+import calendar
+from datetime import MINYEAR, date, datetime, timedelta
 import pytz
-from collections import defaultdict
 import database as db
+import async_db as adb
+from cache import report_cache
 
 TIMEZONE = db.TIMEZONE
+CHART_PERIODS = ('mingguan', 'bulanan')
+HARI = ["Isn", "Sel", "Rab", "Kha", "Jum", "Sab", "Ahd"]
 
-def generate_report_text(user_id: int, period: str):
+def report_title(period: str, today=None):
+    """Returns (title, period start date) for a period, or (None, None) if unknown."""
     tz = pytz.timezone(TIMEZONE)
-    today = datetime.now(tz).date()
+    today = today or datetime.now(tz).date()
 
     if period == 'harian':
         start_date = today
@@ -20,26 +25,60 @@ def generate_report_text(user_id: int, period: str):
         start_date = today.replace(day=1)
         title = f"📅 Laporan Bulanan ({start_date.strftime('%B %Y')})"
     else:
-        return "Tempoh laporan tidak sah. Sila pilih: harian, mingguan, bulanan."
+        return None, None
+    return title, start_date
+
+def parse_report_args(args, today=None) -> dict:
+    """
+    Parses the options after /laporan into dict(kind, start, end[, year]):
+    a period word (harian|mingguan|bulanan), `mingguan|bulanan carta` (adds
+    chart=True), `tahunan [YYYY]`, `yoy [YYYY]`, or a custom range
+    `[dari] YYYY-MM-DD [hingga] YYYY-MM-DD`. For the current year the end is
+    today. Raises ValueError on anything else.
+    """
+    tz = pytz.timezone(TIMEZONE)
+    today = today or datetime.now(tz).date()
+    words = [arg.lower() for arg in args or [] if arg.lower() not in ('dari', 'hingga')]
+    if not words:
+        return dict(kind='harian')
+    kind = words[0]
 
-    with next(db.get_db()) as conn:
-        transactions = db.get_transactions(conn, user_id, period)
-        balance = db.get_balance(conn, user_id)
+    if kind in ('harian', 'mingguan', 'bulanan') and len(words) == 1:
+        return dict(kind=kind)
+    if kind in CHART_PERIODS and words[1:] == ['carta']:
+        return dict(kind=kind, chart=True)
+    if kind in ('tahunan', 'yoy') and len(words) <= 2:
+        year = int(words[1]) if len(words) == 2 else today.year
+        # yoy also reads the year before, which must itself be a valid date
+        earliest = MINYEAR + 1 if kind == 'yoy' else MINYEAR
+        if not earliest <= year <= today.year:
+            raise ValueError("Year out of range")
+        end = today if year == today.year else date(year, 12, 31)
+        return dict(kind=kind, year=year, start=date(year, 1, 1), end=end)
+    if len(words) == 2:
+        start, end = (datetime.strptime(word, "%Y-%m-%d").date() for word in words)
+        if end < start:
+            raise ValueError("End date is before start date")
+        return dict(kind='julat', start=start, end=end)
+    raise ValueError("Unknown report options")
 
-    if not transactions:
-        return f"{title}\n\nTiada transaksi direkodkan dalam tempoh ini."
+def _same_day_last_year(day):
+    # 29 Feb has no counterpart; compare against 28 Feb
+    return day.replace(year=day.year - 1, day=min(day.day, 28) if day.month == 2 else day.day)
 
-    total_masuk = 0.0
-    total_keluar = 0.0
-    kategori_totals = defaultdict(float)
+def _change(current: float, previous: float) -> str:
+    if not previous:
+        return "baru" if current else "-"
+    return f"{(current - previous) / previous * 100:+.0f}%"
 
-    for t in transactions:
-        if t.jenis == 'masuk':
-            total_masuk += t.amaun
-        elif t.jenis == 'keluar':
-            total_keluar += t.amaun
-            if t.kategori:
-                kategori_totals[t.kategori] += t.amaun
+def format_report(title: str, totals: dict, balance: float) -> str:
+    """Renders report totals (as returned by db.get_report_totals) into the bot's text."""
+    if not totals['count']:
+        return f"{title}\n\nTiada transaksi direkodkan dalam tempoh ini."
+
+    total_masuk = totals['total_masuk']
+    total_keluar = totals['total_keluar']
+    kategori_totals = totals['kategori_totals']
 
     report_lines = [
         title,
@@ -50,9 +89,129 @@ def generate_report_text(user_id: int, period: str):
 
     if kategori_totals:
         report_lines.append("\n📊 Pecahan Kategori Keluar:")
-        # Sort categories by amount, descending
-        sorted_kategori = sorted(kategori_totals.items(), key=lambda item: item[1], reverse=True)
-        for kategori, amaun in sorted_kategori:
+        # Already sorted by amount, descending
+        for kategori, amaun in kategori_totals:
             report_lines.append(f"- {kategori.capitalize()}: RM{amaun:.2f}")
             
     return "\n".join(report_lines)
+
+async def generate_report_text(user_id: int, period: str):
+    title, start_date = report_title(period)
+    if title is None:
+        return "Tempoh laporan tidak sah. Sila pilih: harian, mingguan, bulanan."
+
+    cached = await report_cache.get(user_id, period, start_date.isoformat())
+    if cached is not None:
+        return cached
+
+    async with adb.AsyncSessionLocal() as conn:
+        totals = await adb.get_report_totals(conn, user_id, period)
+        balance = await adb.get_balance(conn, user_id)
+
+    report_text = format_report(title, totals, balance)
+    await report_cache.set(user_id, period, start_date.isoformat(), value=report_text)
+    return report_text
+
+def _period_end(period: str, start_date):
+    if period == 'harian':
+        return start_date
+    if period == 'mingguan':
+        return start_date + timedelta(days=6)
+    return start_date.replace(day=calendar.monthrange(start_date.year, start_date.month)[1])
+
+def report_period(period: str, today=None):
+    """(title, first day, last day) of the harian/mingguan/bulanan period containing today."""
+    title, start_date = report_title(period, today)
+    return title, start_date, _period_end(period, start_date)
+
+async def get_report_chart(user_id: int, period: str) -> dict:
+    """
+    The chart for a mingguan/bulanan report as dict(title, key, file_id, png).
+    file_id is set when the same chart (period and data version) was uploaded
+    before; otherwise png holds a fresh render, and the file_id Telegram
+    assigns it should be passed to remember_chart.
+    """
+    import charts
+    title, start_date, end_date = report_period(period)
+    async with adb.AsyncSessionLocal() as conn:
+        # Read before the data, so a concurrent write can only make the cached chart newer than its key
+        version = await adb.get_data_version(conn, user_id)
+        key = ('carta', period, start_date.isoformat(), version)
+        file_id = await report_cache.get(user_id, *key)
+        if file_id is not None:
+            return dict(title=title, key=key, file_id=file_id, png=None)
+        totals = await adb.get_report_totals(conn, user_id, period)
+        daily = await adb.get_daily_totals(conn, user_id, start_date, end_date)
+
+    # The whole period is drawn, so the chart only changes with the data
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    png = await charts.renderer.render(
+        title.replace("📅 ", ""),  # matplotlib's default font has no emoji
+        [(nama, float(amaun)) for nama, amaun in totals['kategori_totals']],
+        [
+            (f"{HARI[day.weekday()]} {day.day}" if period == 'mingguan' else str(day.day), float(daily.get(day, 0)))
+            for day in days
+        ]
+    )
+    return dict(title=title, key=key, file_id=None, png=png)
+
+async def remember_chart(user_id: int, key, file_id: str):
+    """Caches the Telegram file_id of an uploaded chart, so repeats re-send it instead of rendering."""
+    await report_cache.set(user_id, *key, value=file_id)
+
+def format_comparison(title: str, current: dict, previous: dict, previous_label: str) -> str:
+    """Renders two report totals side by side, with the change from `previous`."""
+    if not current['count'] and not previous['count']:
+        return f"{title}\n\nTiada transaksi direkodkan dalam kedua-dua tempoh."
+
+    report_lines = [
+        title,
+        f"💰 Masuk: RM{current['total_masuk']:.2f} ({previous_label}: RM{previous['total_masuk']:.2f}, "
+        f"{_change(current['total_masuk'], previous['total_masuk'])})",
+        f"💸 Keluar: RM{current['total_keluar']:.2f} ({previous_label}: RM{previous['total_keluar']:.2f}, "
+        f"{_change(current['total_keluar'], previous['total_keluar'])})",
+    ]
+
+    current_kategori = dict(current['kategori_totals'])
+    previous_kategori = dict(previous['kategori_totals'])
+    if current_kategori or previous_kategori:
+        report_lines.append("\n📊 Pecahan Kategori Keluar:")
+        # This period's categories by amount, then those only seen last period
+        names = list(current_kategori) + [kategori for kategori in previous_kategori if kategori not in current_kategori]
+        for kategori in names:
+            amaun, before = current_kategori.get(kategori, 0), previous_kategori.get(kategori, 0)
+            report_lines.append(
+                f"- {kategori.capitalize()}: RM{amaun:.2f} ({previous_label}: RM{before:.2f}, {_change(amaun, before)})"
+            )
+    return "\n".join(report_lines)
+
+async def generate_range_report_text(user_id: int, options: dict):
+    """
+    Reports for a custom range, a year (tahunan) or a year against the same
+    span of the previous one (yoy), answered from the daily rollups.
+    """
+    kind, start, end = options['kind'], options['start'], options['end']
+    cache_key = (kind, start.isoformat(), end.isoformat())
+    cached = await report_cache.get(user_id, *cache_key)
+    if cached is not None:
+        return cached
+
+    async with adb.AsyncSessionLocal() as conn:
+        totals = await adb.get_range_totals(conn, user_id, start, end)
+        if kind == 'yoy':
+            previous = await adb.get_range_totals(
+                conn, user_id, _same_day_last_year(start), _same_day_last_year(end)
+            )
+        else:
+            balance = await adb.get_balance(conn, user_id)
+
+    span = f"{start.strftime('%d %b %Y')} – {end.strftime('%d %b %Y')}"
+    if kind == 'yoy':
+        title = f"📅 Perbandingan Tahunan {start.year} vs {start.year - 1} ({start.strftime('%d %b')} – {end.strftime('%d %b')})"
+        report_text = format_comparison(title, totals, previous, str(start.year - 1))
+    elif kind == 'tahunan':
+        report_text = format_report(f"📅 Laporan Tahunan {start.year} ({span})", totals, balance)
+    else:
+        report_text = format_report(f"📅 Laporan ({span})", totals, balance)
+    await report_cache.set(user_id, *cache_key, value=report_text)
+    return report_text
@@ -1,9 +1,10 @@
+import startup_timing
 import logging
 import os
+import sys
 import pytz
-import csv
-import io
 import asyncio
+import html
 import re
 from datetime import datetime, timedelta
 from functools import wraps
@@ -12,6 +13,7 @@ from starlette.applications import Starlette
 from starlette.requests import Request
 from starlette.responses import PlainTextResponse, JSONResponse
 from starlette.routing import Route
+startup_timing.mark("import: stdlib + starlette")
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -19,43 +21,78 @@ from telegram.ext import (
     CommandHandler,
     ContextTypes,
     CallbackQueryHandler,
+    MessageHandler,
+    filters,
 )
-from dotenv import load_dotenv
+startup_timing.mark("import: python-telegram-bot")
 
+# database.py loads .env before anything below reads the environment
 import database as db
+import async_db as adb
+startup_timing.mark("import: database (SQLAlchemy)")
 import laporan
-import toyyibpay
-
-# Load environment variables
-load_dotenv()
+from cache import report_cache, user_cache, is_premium, as_utc
+from pipeline import UpdatePipeline
+from dedup import update_deduper
+import metrics
+# toyyibpay, export and scheduler are imported by the handlers that use them
+startup_timing.mark("import: bot modules")
 
 # --- Constants ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 TIMEZONE = os.getenv("TIMEZONE", "Asia/Kuala_Lumpur")
 VERCEL_URL = os.getenv("VERCEL_URL")
 PREMIUM_PRICE = 5.00
+DOWNGRADE_MESSAGE = "⚠️ Langganan Premium anda telah tamat tempoh. Akaun anda telah ditukar kepada Percuma. Taip /upgrade untuk melanggan semula."
 FREE_TRANSACTION_LIMIT = 100
+IMPORT_MAX_BYTES = 20 * 1024 * 1024  # largest file a bot may download
+IMPORT_ERRORS_SHOWN = 10
+SENARAI_PAGE_SIZE = int(os.getenv("SENARAI_PAGE_SIZE", "10"))
+QUICK_KATEGORI = 5  # top categories offered as quick-entry lines
+# /senarai cursors travel in callback_data (64 bytes max) as senarai_<o|n>_<tarikh>_<id>,
+# multi-line undo as undo_<first id>-<last id>_<tarikh>
+CURSOR_FORMAT = "%Y%m%d%H%M%S%f"
+# Lines accepted in one multi-line /belanja or /masuk; keeps the reply under Telegram's 4096 chars
+BATCH_MAX_LINES = 50
+# Fast start (default): schema creation and webhook registration are left to
+# `python manage.py setup`. FAST_START=0 restores doing both on every startup.
+FAST_START = os.getenv("FAST_START", "1") != "0"
+# Point at benchmarks/telegram_stub.py to run the bot against a local Bot API
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org").rstrip("/")
 
 # Enable logging
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- Application Initialization (Global Scope) ---
-application = Application.builder().token(BOT_TOKEN).build()
+application = (
+    Application.builder().token(BOT_TOKEN)
+    .base_url(f"{TELEGRAM_API_BASE_URL}/bot").base_file_url(f"{TELEGRAM_API_BASE_URL}/file/bot")
+    # Same pool size PTB's builder uses by default
+    .request(metrics.TimedHTTPXRequest(connection_pool_size=256))
+    .build()
+)
+update_pipeline = UpdatePipeline(application)
+metrics.instrument_engine(db.engine)
+metrics.instrument_engine(adb.async_engine.sync_engine)
+metrics.register_collector(lambda: [
+    ("pipeline_queue_depth", "Updates waiting in the pipeline", update_pipeline.depth),
+    ("pipeline_shed_total", "Updates shed because the pipeline was full", update_pipeline.shed),
+    ("webhook_duplicates_total", "Redelivered updates dropped by update_id", update_deduper.duplicates),
+    ("report_cache_hits_total", "Report cache hits", report_cache.hits),
+    ("report_cache_misses_total", "Report cache misses", report_cache.misses),
+])
+startup_timing.mark("build Application")
 
 # --- Decorators for Access Control ---
 def premium_only(func):
     @wraps(func)
     async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         user_id = update.effective_user.id
-        with next(db.get_db()) as conn:
-            user = db.get_or_create_user(conn, user_id, update.effective_user.full_name)
-
-        is_premium = False
-        if user.status == 'premium' and user.subscription_end and user.subscription_end > datetime.now(pytz.utc):
-            is_premium = True
+        async with adb.AsyncSessionLocal() as conn:
+            user = await adb.get_or_create_user(conn, user_id, update.effective_user.full_name)
 
-        if is_premium:
+        if is_premium(user):
             return await func(update, context, *args, **kwargs)
         else:
             target_message = update.callback_query.message if update.callback_query else update.message
@@ -69,8 +106,8 @@ def premium_only(func):
 # --- Command & Callback Handlers ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
-    with next(db.get_db()) as conn:
-        db.get_or_create_user(conn, user.id, user.full_name)
+    async with adb.AsyncSessionLocal() as conn:
+        await adb.get_or_create_user(conn, user.id, user.full_name)
     keyboard = [
         [InlineKeyboardButton("➕ Rekod Belanja", callback_data='rekod_belanja_menu'), InlineKeyboardButton("💰 Rekod Masuk", callback_data='rekod_masuk_menu')],
         [InlineKeyboardButton("📊 Buat Laporan", callback_data='laporan_menu'), InlineKeyboardButton("💸 Semak Baki", callback_data='baki_menu')],
@@ -91,56 +128,109 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "<b>--- Arahan Asas ---</b>\n"
         "/belanja [jumlah] [nota]\n"
         "/masuk [jumlah] [nota]\n"
-        "/laporan [harian|mingguan|bulanan]\n"
+        "<i>Satu rekod setiap baris untuk merekod beberapa sekaligus.</i>\n"
+        "/laporan [harian|mingguan|bulanan|tahunan|yoy]\n"
+        "/laporan dari [YYYY-MM-DD] hingga [YYYY-MM-DD]\n"
+        "/laporan [mingguan|bulanan] carta - (Premium) Carta kategori & belanja harian.\n"
         "/baki\n"
+        "/senarai - Lihat sejarah transaksi & ID.\n"
         "/padam [ID]\n"
         "/kategori\n"
-        "/backup - (Premium) Eksport data ke CSV."
+        "/autolaporan - Jadual laporan automatik (harian, mingguan atau bulanan).\n"
+        "/analisis - (Premium) Trend, purata bergerak & unjuran baki.\n"
+        "/backup [csv|jsonl] [gz] [dari] [hingga] - (Premium) Eksport data.\n"
+        "/import - Hantar fail CSV backup dengan kapsyen /import."
     )
     target_message = update.callback_query.message if update.callback_query else update.message
     await target_message.reply_html(help_text, disable_web_page_preview=True)
 
+def parse_entries(text: str):
+    """
+    Splits a /belanja or /masuk message into (amaun, kategori, nota) entries, one
+    per line; the first may follow the command on its own line. Returns
+    (entries, bad_line_numbers).
+    """
+    parts = (text or "").split(None, 1)
+    body = parts[1] if len(parts) > 1 else ""
+    entries, bad = [], []
+    for number, line in enumerate((l for l in body.splitlines() if l.strip()), start=1):
+        words = line.split()
+        try:
+            amaun = db.parse_amaun(words[0])
+        except ValueError:
+            bad.append(number)
+            continue
+        if len(words) < 2:
+            bad.append(number)
+            continue
+        nota = " ".join(words[1:])
+        entries.append((amaun, words[1], nota))
+    return entries, bad
+
 async def handle_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE, jenis: str) -> None:
+    chat_id = update.message.chat_id
+    command = 'belanja' if jenis == 'keluar' else 'masuk'
+    entries, bad = parse_entries(update.message.text)
+    if not entries and not bad:
+        await context.bot.send_message(
+            chat_id,
+            f"Format salah. Guna: /{command} [jumlah] [nota]\n"
+            f"Untuk beberapa rekod sekaligus, tulis satu rekod setiap baris:\n/{command} 12.50 makan\n8 kopi"
+        )
+        return
+    if bad:
+        lines = ", ".join(str(n) for n in bad)
+        await context.bot.send_message(
+            chat_id,
+            f"Format salah pada baris {lines}. Pastikan setiap baris bermula dengan jumlah diikuti nota.\n"
+            f"Cth: /{command} 12.50 makan\nTiada transaksi disimpan."
+        )
+        return
+    if len(entries) > BATCH_MAX_LINES:
+        await context.bot.send_message(chat_id, f"Maksimum {BATCH_MAX_LINES} rekod bagi setiap mesej.")
+        return
+
     user_id = update.effective_user.id
-    with next(db.get_db()) as conn:
-        user = db.get_or_create_user(conn, user_id, update.effective_user.full_name)
-        if user.status == 'free':
-            count = db.count_transactions(conn, user.id)
-            if count >= FREE_TRANSACTION_LIMIT:
-                await update.message.reply_text(
-                    f"🚫 Anda telah mencapai had {FREE_TRANSACTION_LIMIT} transaksi untuk akaun percuma.\n\n" \
-                    "Sila /upgrade ke akaun Premium untuk transaksi tanpa had."
-                )
-                return
+    count = None
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, user_id, update.effective_user.full_name)
+        if not is_premium(user):
+            count = await adb.count_transactions(conn, user.id)
+    # Replies go out after the session is closed, so no connection is held during Telegram I/O
+    if count is not None and count + len(entries) > FREE_TRANSACTION_LIMIT:
+        remaining = max(0, FREE_TRANSACTION_LIMIT - count)
+        message = f"🚫 Anda telah mencapai had {FREE_TRANSACTION_LIMIT} transaksi untuk akaun percuma.\n\n"
+        if remaining:
+            message = (f"🚫 Akaun percuma anda hanya boleh merekod {remaining} transaksi lagi "
+                       f"(had {FREE_TRANSACTION_LIMIT}). Tiada transaksi disimpan.\n\n")
+        await update.message.reply_text(message + "Sila /upgrade ke akaun Premium untuk transaksi tanpa had.")
+        return
 
-    chat_id = update.message.chat_id
     try:
-        parts = context.args
-        if len(parts) < 2:
-            await context.bot.send_message(chat_id, f"Format salah. Guna: /{jenis} [jumlah] [nota]")
-            return
-
-        amaun = float(parts[0])
-        nota = " ".join(parts[1:])
-        kategori = nota.split()[0]
+        async with adb.AsyncSessionLocal() as conn:
+            if len(entries) == 1:
+                # Single entries take add_transaction, which group-commits under WRITE_BATCHING
+                new_rows = [await adb.add_transaction(conn, user.id, jenis, *entries[0])]
+            else:
+                new_rows = await adb.add_transactions(conn, user.id, jenis, entries)
 
-        with next(db.get_db()) as conn:
-            new_trans = db.add_transaction(conn, user.id, jenis, amaun, kategori, nota)
-        
         tz = pytz.timezone(TIMEZONE)
-        timestamp = new_trans.tarikh.astimezone(tz).strftime("%d %b %Y, %I:%M %p")
+        timestamp = new_rows[0].tarikh.astimezone(tz).strftime("%d %b %Y, %I:%M %p")
         verb = "Duit Keluar" if jenis == 'keluar' else "Duit Masuk"
 
-        keyboard = [[InlineKeyboardButton("❌ Batalkan", callback_data=f'undo_{new_trans.id}')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await context.bot.send_message(
-            chat_id, 
-            f"✅ Tambah {verb}:\nRM{amaun:.2f} - {nota}\nDisimpan pada {timestamp}",
-            reply_markup=reply_markup
-        )
-    except (ValueError, IndexError):
-        await context.bot.send_message(chat_id, f"Format salah. Pastikan jumlah adalah nombor.\nCth: /{jenis} 12.50 makan")
+        if len(new_rows) == 1:
+            undo_data = f'undo_{new_rows[0].id}'
+            text = f"✅ Tambah {verb}:\nRM{entries[0][0]:.2f} - {entries[0][2]}\nDisimpan pada {timestamp}"
+        else:
+            undo_data = f'undo_{new_rows[0].id}-{new_rows[-1].id}_{new_rows[0].tarikh.strftime(CURSOR_FORMAT)}'
+            lines = [f"✅ Tambah {len(new_rows)} {verb}:"]
+            lines.extend(f"RM{amaun:.2f} - {nota}" for amaun, _, nota in entries)
+            lines.append(f"Jumlah: RM{sum(amaun for amaun, _, _ in entries):.2f}")
+            lines.append(f"Disimpan pada {timestamp}")
+            text = "\n".join(lines)
+
+        keyboard = [[InlineKeyboardButton("❌ Batalkan", callback_data=undo_data)]]
+        await context.bot.send_message(chat_id, text, reply_markup=InlineKeyboardMarkup(keyboard))
     except Exception as e:
         logger.error(f"Error in handle_transaction: {e}")
         await context.bot.send_message(chat_id, "Maaf, berlaku ralat semasa menyimpan data.")
@@ -153,11 +243,11 @@ async def masuk(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    with next(db.get_db()) as conn:
-        user = db.get_or_create_user(conn, user_id, update.effective_user.full_name)
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, user_id, update.effective_user.full_name)
 
-    if user.status == 'premium' and user.subscription_end and user.subscription_end > datetime.now(pytz.utc):
-        expiry_date = user.subscription_end.astimezone(pytz.timezone(TIMEZONE)).strftime("%d %B %Y, %I:%M %p")
+    if is_premium(user):
+        expiry_date = as_utc(user.subscription_end).astimezone(pytz.timezone(TIMEZONE)).strftime("%d %B %Y, %I:%M %p")
         message = f"🌟 Status Akaun: <b>Premium</b>\nSah sehingga: <b>{expiry_date}</b>"
     else:
         message = "Status Akaun: <b>Percuma</b>\n\nNaik taraf ke Premium untuk menikmati ciri-ciri tanpa had! Taip /upgrade"
@@ -174,7 +264,8 @@ async def upgrade_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     email = context.args[0]
     user = update.effective_user
     await update.message.reply_text("Sedang menjana pautan bayaran, sila tunggu...")
-    result = toyyibpay.create_bill(user.id, user.full_name, email, PREMIUM_PRICE)
+    import toyyibpay
+    result = await toyyibpay.create_bill(user.id, user.full_name, email, PREMIUM_PRICE)
 
     if result.get("success"):
         payment_url = result.get("payment_url")
@@ -190,12 +281,13 @@ async def upgrade_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def kategori_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    with next(db.get_db()) as conn:
-        kategori = db.get_kategori(conn, user_id)
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, user_id, update.effective_user.full_name)
+        kategori = await adb.get_kategori(conn, user.id)
     
     if kategori:
         message = "<b>📊 Senarai Kategori Anda:</b>\n"
-        message += "\n".join([f"- {k[0].capitalize()}" for k in kategori])
+        message += "\n".join([f"- {html.escape(nama.capitalize())} ({usage}x)" for _, nama, usage in kategori])
     else:
         message = "Tiada kategori direkodkan lagi."
         
@@ -205,8 +297,9 @@ async def padam_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user_id = update.effective_user.id
     try:
         transaction_id = int(context.args[0])
-        with next(db.get_db()) as conn:
-            deleted_trans = db.delete_transaction(conn, user_id, transaction_id)
+        async with adb.AsyncSessionLocal() as conn:
+            user = await adb.get_or_create_user(conn, user_id, update.effective_user.full_name)
+            deleted_trans = await adb.delete_transaction(conn, user.id, transaction_id)
         
         if deleted_trans:
             await update.message.reply_text(f"🗑️ Transaksi {transaction_id} telah dipadam.")
@@ -219,63 +312,269 @@ async def padam_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.error(f"Error in padam_command: {e}")
         await update.message.reply_text("Maaf, berlaku ralat semasa memadam transaksi.")
 
+async def senarai_page(user_id: int, data: str = None):
+    """
+    Renders one /senarai page, newest first. `data` is a Next/Prev button's
+    callback_data carrying the keyset cursor; None is the newest page.
+    Returns (text, reply_markup), or (None, None) if there is nothing to show.
+    """
+    older, cursor = True, None
+    if data:
+        direction, stamp, transaction_id = data.split('_')[1:]
+        older = direction == 'o'
+        cursor = (datetime.strptime(stamp, CURSOR_FORMAT), int(transaction_id))
+
+    async with adb.AsyncSessionLocal() as conn:
+        rows, more = await adb.get_transaction_page(conn, user_id, cursor, older, SENARAI_PAGE_SIZE)
+    if not rows:
+        return None, None
+    has_older = more if older else True
+    has_newer = cursor is not None if older else more
+
+    tz = pytz.timezone(TIMEZONE)
+    lines = ["<b>📜 Sejarah Transaksi</b>\n"]
+    for row in rows:
+        # Stored tarikh come back naive, in local time
+        tarikh = row.tarikh.astimezone(tz) if row.tarikh.tzinfo else row.tarikh
+        icon = "💸" if row.jenis == 'keluar' else "💰"
+        lines.append(
+            f"<code>{row.id}</code> · {tarikh.strftime('%d %b %Y, %I:%M %p')}\n"
+            f"{icon} RM{db.from_sen(row.amaun_sen)} - {html.escape(row.nota or row.kategori or '')}"
+        )
+    lines.append("\nGuna /padam [ID] untuk memadam transaksi.")
+
+    def cursor_data(direction, row):
+        return f"senarai_{direction}_{row.tarikh.strftime(CURSOR_FORMAT)}_{row.id}"
+
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton("⬅️ Lebih Baru", callback_data=cursor_data('n', rows[0])))
+    if has_older:
+        buttons.append(InlineKeyboardButton("Lebih Lama ➡️", callback_data=cursor_data('o', rows[-1])))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def senarai_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, update.effective_user.id, update.effective_user.full_name)
+    text, reply_markup = await senarai_page(user.id)
+    if text is None:
+        await update.message.reply_text("Tiada transaksi direkodkan lagi.")
+        return
+    await update.message.reply_html(text, reply_markup=reply_markup)
+
 async def laporan_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    period = context.args[0].lower() if context.args else 'harian'
-    
-    if period not in ['harian', 'mingguan', 'bulanan']:
-        await update.message.reply_text("Tempoh tidak sah. Sila guna: harian, mingguan, atau bulanan.")
+    try:
+        options = laporan.parse_report_args(context.args)
+    except ValueError:
+        await update.message.reply_html(
+            "Tempoh tidak sah. Sila guna: harian, mingguan, bulanan, "
+            "<code>tahunan [tahun]</code>, <code>yoy [tahun]</code>, "
+            "<code>mingguan|bulanan carta</code>, atau <code>dari YYYY-MM-DD hingga YYYY-MM-DD</code>."
+        )
         return
-        
-    report_text = laporan.generate_report_text(user_id, period)
+
+    if options.get('chart'):
+        await laporan_chart(update, context, options)
+        return
+
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, user_id, update.effective_user.full_name)
+    if 'start' in options:
+        report_text = await laporan.generate_range_report_text(user.id, options)
+    else:
+        report_text = await laporan.generate_report_text(user.id, options['kind'])
     await update.message.reply_html(report_text)
 
+@premium_only
+async def laporan_chart(update: Update, context: ContextTypes.DEFAULT_TYPE, options: dict) -> None:
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, update.effective_user.id, update.effective_user.full_name)
+    try:
+        chart = await laporan.get_report_chart(user.id, options['kind'])
+    except Exception as e:
+        logger.error(f"Chart render failed for user {user.id}: {e}")
+        await update.message.reply_text("Maaf, carta tidak dapat dijana pada masa ini. Sila cuba sebentar lagi.")
+        return
+    message = await update.message.reply_photo(photo=chart['file_id'] or chart['png'], caption=chart['title'])
+    if chart['file_id'] is None and message.photo:
+        await laporan.remember_chart(user.id, chart['key'], message.photo[-1].file_id)
+
+AUTOLAPORAN_USAGE = (
+    "Guna:\n"
+    "<code>/autolaporan harian [HH:MM]</code>\n"
+    "<code>/autolaporan mingguan [isnin..ahad] [HH:MM]</code>\n"
+    "<code>/autolaporan bulanan [1-31|akhir] [HH:MM]</code>\n"
+    "<code>/autolaporan zon Asia/Kuala_Lumpur</code>\n"
+    "<code>/autolaporan on</code> | <code>/autolaporan off</code>"
+)
+
+async def autolaporan_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    import scheduler
+    try:
+        options = scheduler.parse_schedule_args(context.args)
+    except ValueError:
+        await update.message.reply_html(f"Format salah.\n\n{AUTOLAPORAN_USAGE}")
+        return
+
+    telegram_id = update.effective_user.id
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, telegram_id, update.effective_user.full_name)
+        if options['action'] == 'status':
+            schedule = await adb.get_report_schedule(conn, user.id)
+        elif options['action'] == 'off':
+            await adb.disable_report_schedule(conn, user.id)
+            schedule = await adb.get_report_schedule(conn, user.id)
+        else:
+            # `zon` only changes the timezone; any other option also switches the reports on
+            schedule = await adb.set_report_schedule(conn, user.id, options['action'] != 'zon', **options['changes'])
+    if options['action'] == 'status':
+        await update.message.reply_html(f"{scheduler.describe_schedule(schedule)}\n\n{AUTOLAPORAN_USAGE}")
+        return
+    await user_cache.invalidate(telegram_id)
+    await update.message.reply_html(f"✅ Tetapan disimpan.\n{scheduler.describe_schedule(schedule)}")
+
+@premium_only
+async def analisis_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    import analisis
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, update.effective_user.id, update.effective_user.full_name)
+    await update.message.reply_html(await analisis.generate_analysis_text(user.id))
+
 @premium_only
 async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    import export
     user_id = update.effective_user.id
+    try:
+        options = export.parse_backup_args(context.args)
+    except ValueError:
+        await update.message.reply_html(
+            "Format salah. Guna: <code>/backup [csv|jsonl] [gz] [YYYY-MM-DD] [YYYY-MM-DD]</code>\n"
+            "Cth: <code>/backup jsonl gz 2024-01-01 2024-06-30</code>"
+        )
+        return
+
     await update.message.reply_text("Memproses data anda, sila tunggu...")
-    with next(db.get_db()) as conn:
-        transactions = db.get_all_transactions_by_user(conn, user_id)
-    if not transactions:
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, user_id, update.effective_user.full_name)
+        writer = await export.export_transactions(conn, user.id, **options)
+    parts = writer.finish()
+    if not writer.rows:
         await update.message.reply_text("Tiada data transaksi untuk dieksport.")
         return
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Jenis', 'Amaun', 'Kategori', 'Nota', 'Tarikh'])
-    for t in transactions:
-        writer.writerow([t.id, t.jenis, t.amaun, t.kategori, t.nota, t.tarikh.strftime("%Y-%m-%d %H:%M:%S")])
-    output.seek(0)
-    file_bytes = io.BytesIO(output.getvalue().encode('utf-8'))
-    file_bytes.name = f"mykewangan_backup_{datetime.now().strftime('%Y%m%d')}.csv"
-    await update.message.reply_document(document=file_bytes)
+    # Uploaded after the session is closed; parts larger than 1 MB were spooled on
+    # disk and are handed to PTB as files, not copied into bytes here
+    for filename, fileobj in parts:
+        try:
+            fileobj.seek(0)
+            await update.message.reply_document(document=fileobj, filename=filename)
+        finally:
+            fileobj.close()
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.message
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    if document is None:
+        await message.reply_html(
+            "Hantar fail CSV (format sama seperti /backup) dengan kapsyen <code>/import</code>, "
+            "atau balas kepada fail tersebut dengan <code>/import</code>.\n"
+            "Lajur: <code>ID,Jenis,Amaun,Kategori,Nota,Tarikh</code>"
+        )
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.reply_text("Fail terlalu besar. Saiz maksimum ialah 20 MB.")
+        return
+
+    import importer
+    await message.reply_text("Memproses fail anda, sila tunggu...")
+    file = await context.bot.get_file(document.file_id)
+    data = bytes(await file.download_as_bytearray())
+    try:
+        rows, errors = importer.parse_backup_csv(data)
+    except (ValueError, UnicodeDecodeError, OSError) as e:
+        await message.reply_text(f"Fail tidak sah: {e}")
+        return
+
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, update.effective_user.id, update.effective_user.full_name)
+        limit = None if is_premium(user) else FREE_TRANSACTION_LIMIT
+        inserted = await adb.import_transactions(conn, user.id, rows, limit)
+
+    lines = [f"✅ {inserted} transaksi telah diimport."]
+    if inserted < len(rows):
+        lines.append(
+            f"🚫 {len(rows) - inserted} transaksi tidak diimport kerana had {FREE_TRANSACTION_LIMIT} transaksi "
+            "akaun percuma. Sila /upgrade ke akaun Premium."
+        )
+    if errors:
+        lines.append(f"\n⚠️ {len(errors)} baris tidak sah dan diabaikan:")
+        lines.extend(f"- Baris {line}: {reason}" for line, reason in errors[:IMPORT_ERRORS_SHOWN])
+        if len(errors) > IMPORT_ERRORS_SHOWN:
+            lines.append(f"...dan {len(errors) - IMPORT_ERRORS_SHOWN} lagi.")
+    await message.reply_text("\n".join(lines))
 
 async def baki(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    with next(db.get_db()) as conn:
-        balance = db.get_balance(conn, user_id)
+    async with adb.AsyncSessionLocal() as conn:
+        user = await adb.get_or_create_user(conn, user_id, update.effective_user.full_name)
+        baki_text = await report_cache.get(user.id, 'baki')
+        if baki_text is None:
+            balance = await adb.get_balance(conn, user.id)
+            baki_text = f"<b>Baki Semasa Anda:</b> RM{balance:.2f}"
+            await report_cache.set(user.id, 'baki', value=baki_text)
     
     target_message = update.callback_query.message if update.callback_query else update.message
-    await target_message.reply_html(f"<b>Baki Semasa Anda:</b> RM{balance:.2f}")
+    await target_message.reply_html(baki_text)
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
     if query.data.startswith('undo_'):
-        transaction_id = int(query.data.split('_')[1])
+        id_range, _, stamp = query.data[len('undo_'):].partition('_')
         user_id = update.effective_user.id
-        with next(db.get_db()) as conn:
-            deleted_trans = db.delete_transaction(conn, user_id, transaction_id)
+        if '-' in id_range:
+            # A multi-line entry: ids alone may interleave with a concurrent message's rows
+            # (sequences are not contiguous per transaction), the shared tarikh singles out the batch
+            first_id, last_id = (int(i) for i in id_range.split('-'))
+            tarikh = datetime.strptime(stamp, CURSOR_FORMAT) if stamp else None
+            async with adb.AsyncSessionLocal() as conn:
+                user = await adb.get_or_create_user(conn, user_id, update.effective_user.full_name)
+                deleted = await adb.delete_transactions(conn, user.id, first_id, last_id, tarikh)
+            if deleted:
+                await query.edit_message_text(f"✅ {deleted} transaksi telah dibatalkan.")
+            else:
+                await query.edit_message_text("Gagal membatalkan transaksi. Mungkin ia telah pun dipadamkan.")
+            return
+        transaction_id = int(id_range)
+        async with adb.AsyncSessionLocal() as conn:
+            user = await adb.get_or_create_user(conn, user_id, update.effective_user.full_name)
+            deleted_trans = await adb.delete_transaction(conn, user.id, transaction_id)
         if deleted_trans:
             await query.edit_message_text(f"✅ Transaksi {transaction_id} telah dibatalkan.")
         else:
             await query.edit_message_text("Gagal membatalkan transaksi. Mungkin ia telah pun dipadamkan.")
-    elif query.data == 'rekod_belanja_menu':
-        await query.message.reply_html("Format: <code>/belanja [jumlah] [nota]</code>")
-    elif query.data == 'rekod_masuk_menu':
-        await query.message.reply_html("Format: <code>/masuk [jumlah] [nota]</code>")
+    elif query.data.startswith('senarai_'):
+        async with adb.AsyncSessionLocal() as conn:
+            user = await adb.get_or_create_user(conn, update.effective_user.id, update.effective_user.full_name)
+        text, reply_markup = await senarai_page(user.id, query.data)
+        if text is None:
+            await query.edit_message_text("Tiada lagi transaksi untuk dipaparkan.")
+        else:
+            await query.edit_message_text(text, parse_mode='HTML', reply_markup=reply_markup)
+    elif query.data in ('rekod_belanja_menu', 'rekod_masuk_menu'):
+        command = 'belanja' if query.data == 'rekod_belanja_menu' else 'masuk'
+        message = f"Format: <code>/{command} [jumlah] [nota]</code>"
+        async with adb.AsyncSessionLocal() as conn:
+            user = await adb.get_or_create_user(conn, query.from_user.id, query.from_user.full_name)
+            kategori = await adb.get_kategori(conn, user.id, limit=QUICK_KATEGORI)
+        if kategori:
+            message += "\n\n<b>Kategori kerap anda:</b>\n" + "\n".join(
+                f"<code>/{command} [jumlah] {html.escape(nama)}</code>" for _, nama, _ in kategori
+            )
+        await query.message.reply_html(message)
     elif query.data == 'laporan_menu':
-        await query.message.reply_text("Sila pilih: /laporan harian, /laporan mingguan, atau /laporan bulanan.")
+        await query.message.reply_text("Sila pilih: /laporan harian, /laporan mingguan, /laporan bulanan, /laporan tahunan, atau /laporan yoy.")
     elif query.data == 'baki_menu':
         await baki(update, context)
     elif query.data == 'help_menu':
@@ -290,40 +589,70 @@ async def toyyibpay_callback(request: Request) -> PlainTextResponse:
         payment_status = form_data.get('status')
         user_telegram_id = int(refno.split('-')[1])
         if payment_status == '1':
-            with next(db.get_db()) as conn:
-                user = conn.query(db.User).filter(db.User.telegram_id == user_telegram_id).first()
+            async with adb.AsyncSessionLocal() as conn:
+                user = await adb.get_user_by_telegram_id(conn, user_telegram_id)
                 if user:
                     user.status = 'premium'
                     user.subscription_start = datetime.now(pytz.utc)
                     user.subscription_end = datetime.now(pytz.utc) + timedelta(days=30)
-                    conn.commit()
-                    expiry_date = user.subscription_end.astimezone(pytz.timezone(TIMEZONE)).strftime("%d %B %Y")
-                    await application.bot.send_message(chat_id=user_telegram_id, text=f"🎉Akaun Premium anda telah diaktifkan!\nSah sehingga: {expiry_date}")
+                    await conn.commit()
+            if user:
+                await user_cache.invalidate(user_telegram_id)
+                expiry_date = user.subscription_end.astimezone(pytz.timezone(TIMEZONE)).strftime("%d %B %Y")
+                await application.bot.send_message(chat_id=user_telegram_id, text=f"🎉Akaun Premium anda telah diaktifkan!\nSah sehingga: {expiry_date}")
         return PlainTextResponse("OK")
     except Exception as e:
         logger.error(f"Error processing Toyyibpay callback: {e}")
         return PlainTextResponse("Error", status_code=500)
 
+async def cache_stats(request: Request) -> JSONResponse:
+    return JSONResponse({"report_cache": report_cache.stats(), "user_cache": user_cache.stats()})
+
 async def downgrade_users_cron(request: Request) -> JSONResponse:
     logger.info("Running daily downgrade cron job")
-    processed_count = 0
     try:
-        with next(db.get_db()) as conn:
-            expired_users = conn.query(db.User).filter(db.User.status == 'premium', db.User.subscription_end < datetime.now(pytz.utc)).all()
-            for user in expired_users:
-                user.status = 'free'
-                await application.bot.send_message(chat_id=user.telegram_id, text="⚠️ Langganan Premium anda telah tamat tempoh. Akaun anda telah ditukar kepada Percuma. Taip /upgrade untuk melanggan semula.")
-                processed_count += 1
-            conn.commit()
-        return JSONResponse({"status": "success", "processed_users": processed_count})
+        # Committed before any message goes out; notifications are queued in the same commit
+        async with adb.AsyncSessionLocal() as conn:
+            downgraded = await adb.downgrade_expired_users(conn, DOWNGRADE_MESSAGE)
+        for telegram_id in downgraded:
+            await user_cache.invalidate(telegram_id)
+
+        # Also retries anything a previous run failed to deliver
+        import scheduler
+        result = await scheduler.deliver_pending_notifications(application)
+        return JSONResponse({"status": "success", "updated": len(downgraded), **result})
     except Exception as e:
         logger.error(f"Error in downgrade cron job: {e}")
         return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
 
+async def auto_reports_cron(request: Request) -> JSONResponse:
+    logger.info("Running auto report cron job")
+    try:
+        import scheduler
+        result = await scheduler.send_auto_reports(application)
+        return JSONResponse({"status": "success", **result})
+    except Exception as e:
+        logger.error(f"Error in auto report cron job: {e}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+async def archive_cron(request: Request) -> JSONResponse:
+    logger.info("Running archive cron job")
+    try:
+        before = db.archive_cutoff()
+        async with adb.AsyncSessionLocal() as conn:
+            moved = await adb.archive_transactions(conn, before)
+        return JSONResponse({"status": "success", "archived": moved, "before": before.isoformat()})
+    except Exception as e:
+        logger.error(f"Error in archive cron job: {e}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
 # --- Starlette App Configuration ---
 async def startup():
-    db.init_db()
-    await application.initialize()
+    if not FAST_START:
+        with startup_timing.phase("init_db"):
+            db.init_db()
+    with startup_timing.phase("application.initialize"):
+        await application.initialize()
     # (Register all handlers)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
@@ -333,29 +662,66 @@ async def startup():
     application.add_handler(CommandHandler("masuk", masuk))
     application.add_handler(CommandHandler("backup", backup_command))
     application.add_handler(CommandHandler("laporan", laporan_command))
+    application.add_handler(CommandHandler("analisis", analisis_command))
+    application.add_handler(CommandHandler("autolaporan", autolaporan_command))
     application.add_handler(CommandHandler("padam", padam_command))
+    application.add_handler(CommandHandler("senarai", senarai_command))
     application.add_handler(CommandHandler("kategori", kategori_command))
     application.add_handler(CommandHandler("baki", baki))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/import\b"), import_command))
     
     application.add_handler(CallbackQueryHandler(button_handler))
+    metrics.instrument_application(application)
+
+    update_pipeline.start()
 
-    webhook_url = f"https://{VERCEL_URL}/telegram"
-    await application.bot.set_webhook(url=webhook_url, allowed_updates=Update.ALL_TYPES)
-    logger.info(f"Webhook set to {webhook_url}")
+    if not FAST_START:
+        with startup_timing.phase("set_webhook"):
+            webhook_url = f"https://{VERCEL_URL}/telegram"
+            await application.bot.set_webhook(url=webhook_url, allowed_updates=Update.ALL_TYPES)
+        logger.info(f"Webhook set to {webhook_url}")
+    startup_timing.log_report()
 
 async def shutdown():
+    await update_pipeline.stop()
+    if adb.transaction_writer is not None:
+        await adb.transaction_writer.stop()
     await application.shutdown()
+    if "toyyibpay" in sys.modules:
+        await sys.modules["toyyibpay"].client.close()
+    if "charts" in sys.modules:
+        sys.modules["charts"].renderer.shutdown()
+    await adb.async_engine.dispose()
 
 async def telegram_webhook(request: Request) -> PlainTextResponse:
-    await application.update_queue.put(Update.de_json(await request.json(), application.bot))
+    # Always acknowledge, even when shed: a non-200 makes Telegram redeliver and adds load
+    data = await request.json()
+    # Redeliveries of an update already accepted are acknowledged without parsing or dispatch
+    if not await update_deduper.claim(data.get("update_id")):
+        return PlainTextResponse("OK")
+    await update_pipeline.submit(Update.de_json(data, application.bot))
     return PlainTextResponse("OK")
 
+async def pipeline_stats(request: Request) -> JSONResponse:
+    writer = adb.transaction_writer.stats() if adb.transaction_writer is not None else {"enabled": False}
+    return JSONResponse({"pipeline": update_pipeline.stats(), "group_commit": writer, "dedup": update_deduper.stats()})
+
+async def startup_stats(request: Request) -> JSONResponse:
+    return JSONResponse({"startup": startup_timing.report()})
+
 app = Starlette(
-    routes=[
+    routes=metrics.instrument_routes([
         Route("/telegram", endpoint=telegram_webhook, methods=["POST"]),
         Route("/webhook/toyyibpay", endpoint=toyyibpay_callback, methods=["POST"]),
         Route("/api/cron/downgrade_users", endpoint=downgrade_users_cron, methods=["GET"]),
-    ],
+        Route("/api/cron/auto_reports", endpoint=auto_reports_cron, methods=["GET"]),
+        Route("/api/cron/archive", endpoint=archive_cron, methods=["GET"]),
+        Route("/api/stats/cache", endpoint=cache_stats, methods=["GET"]),
+        Route("/api/stats/pipeline", endpoint=pipeline_stats, methods=["GET"]),
+        Route("/api/stats/startup", endpoint=startup_stats, methods=["GET"]),
+        Route("/metrics", endpoint=metrics.metrics_endpoint, methods=["GET"]),
+    ]),
     on_startup=[startup],
     on_shutdown=[shutdown],
 )
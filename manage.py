@@ -0,0 +1,233 @@
+# manage.py
+"""
+One-off maintenance commands for MyKewanganBot.
+
+    python manage.py setup                    # create tables/indexes, register the webhook
+    python manage.py migrate                  # upgrade an existing database to the current schema
+    python manage.py rebuild-stats            # recompute per-user totals, fix drift
+    python manage.py rebuild-stats --verify   # report drift only, change nothing
+    python manage.py backfill-rollups         # rebuild the daily report rollups
+    python manage.py archive [--days N]       # move old transactions to the archive table
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+from sqlalchemy import inspect, text
+
+import database as db
+
+
+# Aggregate tables whose money columns moved to integer sen, by a column only
+# the current schema has; older copies are dropped and rebuilt from history
+REBUILT_AGGREGATES = {'user_stats': 'masuk_sen', 'archive_totals': 'total_sen', 'daily_rollups': 'total_sen'}
+# Tables no model uses any more
+OBSOLETE_TABLES = ('report_deliveries',)
+
+
+def add_missing_columns(engine) -> list:
+    """
+    ALTER TABLE ... ADD COLUMN for every non-key model column an existing table
+    lacks (create_all only creates whole tables). Columns are added nullable,
+    filled with the model's numeric default if it has one, else left for the
+    migration to backfill. Returns "table.column" names.
+    """
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in db.Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            present = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present or column.primary_key:
+                    continue
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                clause = f" DEFAULT {default}" if isinstance(default, (int, float)) else ""
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}{clause}'
+                ))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def ensure_transaction_autoincrement(engine) -> bool:
+    """
+    Rebuilds a SQLite transactions table created without AUTOINCREMENT, which
+    SQLite cannot add in place, and starts its id sequence past every id in
+    transactions and transactions_archive so an archived id is never reused.
+    Columns the model no longer has are not carried over. Returns whether the
+    table was rebuilt.
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    table = db.Transaction.__table__
+    with engine.begin() as conn:
+        sql = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transactions'"
+        )).scalar()
+        if sql is None or 'AUTOINCREMENT' in sql.upper():
+            return False
+        # Index names are global in SQLite: free them for the new table
+        for (index,) in conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'transactions' AND sql IS NOT NULL"
+        )).all():
+            conn.execute(text(f'DROP INDEX "{index}"'))
+        conn.execute(text("ALTER TABLE transactions RENAME TO transactions_old"))
+        table.create(bind=conn)
+        columns = ", ".join(column.name for column in table.columns)
+        conn.execute(text(f"INSERT INTO transactions ({columns}) SELECT {columns} FROM transactions_old"))
+        conn.execute(text("DROP TABLE transactions_old"))
+        top = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM transactions")).scalar()
+        if inspect(conn).has_table('transactions_archive'):
+            top = max(top, conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM transactions_archive")).scalar())
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'transactions'"))
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('transactions', :top)"), {'top': top})
+    return True
+
+
+def migrate_schema() -> None:
+    """
+    Brings an existing database up to the current schema: new columns, the
+    kategori dictionary and integer-sen amounts backfilled from history,
+    aggregate tables of an older layout rebuilt, unused tables dropped,
+    SQLite transaction ids made AUTOINCREMENT, and report schedules for users
+    who had auto laporan on. Safe to re-run.
+    """
+    inspector = inspect(db.engine)
+    rebuilt = []
+    for table in db.Base.metadata.sorted_tables:
+        marker = REBUILT_AGGREGATES.get(table.name)
+        if marker and inspector.has_table(table.name) and \
+                marker not in {c['name'] for c in inspector.get_columns(table.name)}:
+            table.drop(bind=db.engine)
+            rebuilt.append(table.name)
+            print(f"Dropped {table.name} for rebuilding.")
+    for name in OBSOLETE_TABLES:
+        if inspector.has_table(name):
+            with db.engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE {name}"))
+            print(f"Dropped unused table {name}.")
+
+    for name in add_missing_columns(db.engine):
+        print(f"Added column {name}.")
+    db.Kategori.__table__.create(bind=db.engine, checkfirst=True)
+    with next(db.get_db()) as conn:
+        converted, inexact = db.backfill_amaun_sen(conn)
+        if converted:
+            print(f"{converted} amount(s) converted to integer sen.")
+        if inexact:
+            print(f"Warning: {inexact} amount(s) had fractions of a sen and were rounded.")
+        backfilled = db.backfill_kategori_ids(conn)
+        if backfilled:
+            print(f"{backfilled} transaction(s) linked to the kategori dictionary.")
+    if ensure_transaction_autoincrement(db.engine):
+        print("Rebuilt transactions with AUTOINCREMENT ids.")
+
+    # init_db recreates dropped tables and rebuilds daily_rollups
+    db.init_db()
+    with next(db.get_db()) as conn:
+        if 'archive_totals' in rebuilt:
+            db.rebuild_archive_totals(conn)
+        if 'user_stats' in rebuilt:
+            db.rebuild_user_stats(conn)
+        scheduled = db.backfill_report_schedules(conn)
+        if scheduled:
+            print(f"{scheduled} auto laporan user(s) given a daily report schedule.")
+
+
+def setup(args) -> int:
+    migrate_schema()
+    print("Database schema is up to date.")
+    if args.no_webhook:
+        return 0
+
+    base_url = args.url or os.getenv("VERCEL_URL")
+    if not base_url:
+        print("No webhook URL: pass --url or set VERCEL_URL.")
+        return 1
+    webhook_url = f"https://{base_url}/telegram" if "://" not in base_url else f"{base_url.rstrip('/')}/telegram"
+
+    from telegram import Bot, Update
+
+    async def register():
+        async with Bot(os.getenv("BOT_TOKEN")) as bot:
+            await bot.set_webhook(url=webhook_url, allowed_updates=Update.ALL_TYPES)
+
+    asyncio.run(register())
+    print(f"Webhook set to {webhook_url}")
+    return 0
+
+
+def migrate(args) -> int:
+    migrate_schema()
+    print("Database schema is up to date.")
+    return 0
+
+
+def rebuild_stats(args) -> int:
+    db.init_db()
+    with next(db.get_db()) as conn:
+        drift, missing = db.rebuild_user_stats(conn, verify_only=args.verify)
+
+    for user_id, field, stored, actual in drift:
+        print(f"user {user_id}: {field} stored={stored} actual={actual}")
+    action = "found" if args.verify else "fixed"
+    print(f"{len(drift)} drifted value(s) {action}.")
+    # Not drift: get_user_stats seeds these on the user's next request
+    if missing and args.verify:
+        print(f"{len(missing)} user(s) have no user_stats row yet (seeded on first use).")
+    elif missing:
+        print(f"{len(missing)} missing user_stats row(s) seeded.")
+    return 1 if drift and args.verify else 0
+
+
+def backfill_rollups(args) -> int:
+    db.init_db()
+    with next(db.get_db()) as conn:
+        written = db.rebuild_daily_rollups(conn, user_id=args.user)
+    print(f"{written} daily rollup row(s) written.")
+    return 0
+
+
+def archive(args) -> int:
+    db.init_db()
+    before = db.archive_cutoff(args.days)
+    with next(db.get_db()) as conn:
+        moved = db.archive_transactions(conn, before, user_id=args.user)
+    print(f"{moved} transaction(s) dated before {before:%Y-%m-%d} archived.")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="MyKewanganBot maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("setup", help="Create the schema and register the Telegram webhook")
+    p.add_argument("--url", help="Public base URL of the bot (default: VERCEL_URL)")
+    p.add_argument("--no-webhook", action="store_true", help="Only create the schema")
+    p.set_defaults(func=setup)
+
+    p = commands.add_parser("migrate", help="Upgrade an existing database to the current schema")
+    p.set_defaults(func=migrate)
+
+    p = commands.add_parser("rebuild-stats", help="Recompute per-user aggregates from transactions")
+    p.add_argument("--verify", action="store_true", help="Only report drift, do not write")
+    p.set_defaults(func=rebuild_stats)
+
+    p = commands.add_parser("backfill-rollups", help="Rebuild daily_rollups from transactions")
+    p.add_argument("--user", type=int, help="Only this internal user id")
+    p.set_defaults(func=backfill_rollups)
+
+    p = commands.add_parser("archive", help="Move transactions older than the horizon to transactions_archive")
+    p.add_argument("--days", type=int, help=f"Archive horizon in days (default: ARCHIVE_AFTER_DAYS, min {db.ARCHIVE_MIN_DAYS})")
+    p.add_argument("--user", type=int, help="Only this internal user id")
+    p.set_defaults(func=archive)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+# metrics.py
+"""
+In-process metrics, served in Prometheus text format on /metrics.
+
+- Every bot handler registered in startup() is timed, with errors and the
+  number and duration of DB queries it ran (counted from SQLAlchemy cursor
+  events, attributed through a context variable).
+- Every Starlette route is timed by path and status.
+- Outbound Bot API calls (through TimedHTTPXRequest) and Toyyibpay calls
+  (through observe_outbound) are timed per method.
+- Queries slower than SLOW_QUERY_MS are logged.
+
+Recording is a few dict updates under a lock per event, cheap enough to leave
+on; METRICS_ENABLED=0 turns it off entirely.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+
+from sqlalchemy import event
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from telegram.ext import CommandHandler
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+PREFIX = "mykewangan"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, Prometheus style."""
+
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (le,))} {cumulative}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {series[-1]:.6f}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._series = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+_lock = threading.Lock()
+
+handler_seconds = Histogram(f"{PREFIX}_handler_seconds", "Bot handler latency", ("handler",), LATENCY_BUCKETS)
+handler_errors = Counter(f"{PREFIX}_handler_errors_total", "Bot handlers that raised", ("handler",))
+handler_db_queries = Histogram(f"{PREFIX}_handler_db_queries", "DB queries per handled update", ("handler",), COUNT_BUCKETS)
+handler_db_seconds = Histogram(f"{PREFIX}_handler_db_seconds", "DB time per handled update", ("handler",), LATENCY_BUCKETS)
+route_seconds = Histogram(f"{PREFIX}_http_request_seconds", "HTTP route latency", ("route",), LATENCY_BUCKETS)
+route_requests = Counter(f"{PREFIX}_http_requests_total", "HTTP requests by route and status", ("route", "status"))
+db_query_seconds = Histogram(f"{PREFIX}_db_query_seconds", "DB query latency", (), QUERY_BUCKETS)
+db_slow_queries = Counter(f"{PREFIX}_db_slow_queries_total", "DB queries slower than SLOW_QUERY_MS")
+outbound_seconds = Histogram(f"{PREFIX}_outbound_seconds", "Outbound API call latency", ("service", "method"), LATENCY_BUCKETS)
+outbound_errors = Counter(f"{PREFIX}_outbound_errors_total", "Outbound API calls that failed", ("service", "method"))
+
+METRICS = [
+    handler_seconds, handler_errors, handler_db_queries, handler_db_seconds,
+    route_seconds, route_requests, db_query_seconds, db_slow_queries, outbound_seconds, outbound_errors,
+]
+_collectors = []  # callables returning [(name, help, value)] gauges, read at scrape time
+
+# DB work done by the current handler or request: [queries, seconds]
+_db_usage = ContextVar("db_usage", default=None)
+
+
+class _Scope:
+    """Times one handler or request and collects the DB queries it runs."""
+
+    def __init__(self):
+        self.usage = [0, 0.0]
+
+    def __enter__(self):
+        self._token = _db_usage.set(self.usage)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        _db_usage.reset(self._token)
+        outer = _db_usage.get()
+        if outer is not None:
+            outer[0] += self.usage[0]
+            outer[1] += self.usage[1]
+        return False
+
+
+# --- SQLAlchemy ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    usage = _db_usage.get()
+    if usage is not None:
+        usage[0] += 1
+        usage[1] += elapsed
+    with _lock:
+        db_query_seconds.observe(elapsed)
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            db_slow_queries.inc()
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning(f"Slow query ({elapsed * 1000:.0f}ms): {' '.join(statement.split())[:500]}")
+
+
+def instrument_engine(engine):
+    """Counts and times every statement run on a (sync) Engine; pass async_engine.sync_engine for async."""
+    if not METRICS_ENABLED:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# --- Bot handlers ---
+def _handler_name(handler) -> str:
+    if isinstance(handler, CommandHandler):
+        return "/" + sorted(handler.commands)[0]
+    return getattr(handler.callback, "__name__", type(handler).__name__)
+
+
+def _timed_callback(name: str, callback):
+    @wraps(callback)
+    async def timed(update, context):
+        scope = _Scope()
+        try:
+            with scope:
+                return await callback(update, context)
+        except Exception:
+            with _lock:
+                handler_errors.inc(name)
+            raise
+        finally:
+            with _lock:
+                handler_seconds.observe(scope.elapsed, name)
+                handler_db_queries.observe(scope.usage[0], name)
+                handler_db_seconds.observe(scope.usage[1], name)
+    return timed
+
+
+def instrument_application(application):
+    """Wraps the callback of every handler added so far; call after registering them."""
+    if not METRICS_ENABLED:
+        return
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not getattr(handler.callback, "_timed", False):
+                handler.callback = _timed_callback(_handler_name(handler), handler.callback)
+                handler.callback._timed = True
+
+
+# --- Starlette routes ---
+def _timed_endpoint(path: str, endpoint):
+    @wraps(endpoint)
+    async def timed(request: Request):
+        status = 500
+        scope = _Scope()
+        try:
+            with scope:
+                response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            with _lock:
+                route_seconds.observe(scope.elapsed, path)
+                route_requests.inc(path, status)
+    return timed
+
+
+def instrument_routes(routes: list) -> list:
+    """Returns the routes with their endpoints timed by path."""
+    if not METRICS_ENABLED:
+        return routes
+    return [
+        Route(route.path, endpoint=_timed_endpoint(route.path, route.endpoint), methods=route.methods)
+        for route in routes
+    ]
+
+
+# --- Outbound calls ---
+def observe_outbound(service: str, method: str, seconds: float, failed: bool = False):
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        outbound_seconds.observe(seconds, service, method)
+        if failed:
+            outbound_errors.inc(service, method)
+
+
+class TimedHTTPXRequest(HTTPXRequest):
+    """PTB request backend that times every Bot API call by method."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        failed = True
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+            failed = status >= 400
+            return status, payload
+        finally:
+            observe_outbound("telegram", api_method, time.perf_counter() - started, failed)
+
+
+# --- Exposition ---
+def register_collector(collect):
+    """collect() -> [(name, help, value)], read on every scrape (e.g. queue depths)."""
+    _collectors.append(collect)
+
+
+def render() -> str:
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    for collect in _collectors:
+        try:
+            for name, help_text, value in collect():
+                lines += [f"# HELP {PREFIX}_{name} {help_text}", f"# TYPE {PREFIX}_{name} gauge",
+                          f"{PREFIX}_{name} {value}"]
+        except Exception as e:
+            logger.warning(f"Metrics collector failed: {e}")
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,105 @@
+# notifier.py
+"""
+Concurrent, rate-limited delivery of outbound Telegram messages.
+
+Telegram allows roughly 30 messages per second per bot and about one per
+second to the same chat. Notifier spaces sends to stay under both, runs a
+bounded number of them at once, and honours 429 retry_after replies by
+pausing every sender, not just the one that was throttled.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "20"))
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))        # messages/second
+NOTIFY_PER_CHAT_INTERVAL = float(os.getenv("NOTIFY_PER_CHAT_INTERVAL", "1.0"))  # seconds
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "3"))
+
+
+class RateLimiter:
+    """Async token bucket: `rate` acquisitions per second, bursting up to `burst`."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    delay = error.retry_after
+    return delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+
+
+class Notifier:
+    def __init__(self, bot, concurrency: int = NOTIFY_CONCURRENCY, global_rate: float = NOTIFY_GLOBAL_RATE,
+                 per_chat_interval: float = NOTIFY_PER_CHAT_INTERVAL, max_attempts: int = NOTIFY_MAX_ATTEMPTS):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.per_chat_interval = per_chat_interval
+        self.max_attempts = max_attempts
+        self.limiter = RateLimiter(global_rate)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._last_sent = {}          # chat_id -> monotonic time of the last send
+        self._paused_until = 0.0      # set from 429 retry_after, shared by all senders
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+
+    async def _wait_turn(self, chat_id):
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            gap = last + self.per_chat_interval - time.monotonic()
+            if gap > 0:
+                await asyncio.sleep(gap)
+        await self.limiter.acquire()
+        self._last_sent[chat_id] = time.monotonic()
+
+    async def send(self, chat_id, text: str, **kwargs) -> bool:
+        """Sends one message, retrying throttling and transient errors. Returns success."""
+        async with self._semaphore:
+            for attempt in range(1, self.max_attempts + 1):
+                await self._wait_turn(chat_id)
+                try:
+                    await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                    self.sent += 1
+                    return True
+                except RetryAfter as e:
+                    self.throttled += 1
+                    delay = _retry_after_seconds(e)
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    logger.warning(f"Telegram throttled send to {chat_id}; pausing {delay:.1f}s")
+                except (Forbidden, BadRequest) as e:
+                    # Blocked bot, deleted account, bad chat id: retrying will not help
+                    logger.info(f"Not delivering to {chat_id}: {e}")
+                    break
+                except (TimedOut, NetworkError) as e:
+                    logger.warning(f"Send to {chat_id} failed (attempt {attempt}): {e}")
+                    await asyncio.sleep(min(2 ** attempt * 0.5, 10))
+                except Exception as e:
+                    logger.error(f"Unexpected error sending to {chat_id}: {e}")
+                    break
+            self.failed += 1
+            return False
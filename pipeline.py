@@ -0,0 +1,131 @@
+# pipeline.py
+"""
+Bounded webhook ingestion.
+
+Updates are sharded onto a fixed pool of workers by user (or chat), each with
+its own bounded queue. Different users are processed concurrently while one
+user's updates run strictly in arrival order, so a /belanja is always stored
+before the undo_ tap that follows it. When a shard's queue is full the update
+is shed: the webhook still answers 200 so Telegram does not redeliver it and
+multiply the load.
+
+PIPELINE_WORKERS=0 processes each update inline before the webhook answers,
+for serverless hosts that freeze the process once the response is sent.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Vercel freezes the function after each response, so process inline there by default
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "0" if os.getenv("VERCEL") else "8"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "1000"))
+
+
+def shard_key(update) -> int:
+    """Updates from the same user (or chat, for channel posts) share a key."""
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return update.update_id
+
+
+class UpdatePipeline:
+    def __init__(self, application, workers: int = PIPELINE_WORKERS, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.application = application
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queues = []
+        self._tasks = []
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.shed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._lag_total = 0.0
+
+    @property
+    def inline(self) -> bool:
+        return self.workers <= 0
+
+    def start(self):
+        if self.inline or self._tasks:
+            return
+        per_worker = max(1, math.ceil(self.queue_size / self.workers))
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+        logger.info(f"Update pipeline started: {self.workers} workers, {per_worker} updates per queue")
+
+    async def stop(self, timeout: float = 10.0):
+        """Lets queued updates finish for up to `timeout` seconds, then cancels the workers."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Update pipeline stopped with {self.depth} updates still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+    async def submit(self, update) -> bool:
+        """Queues an update (or runs it, in inline mode). Returns False if it was shed."""
+        self.received += 1
+        if self.inline or not self._tasks:
+            await self._process(update, time.monotonic())
+            return True
+        queue = self._queues[shard_key(update) % len(self._queues)]
+        try:
+            queue.put_nowait((time.monotonic(), update))
+            return True
+        except asyncio.QueueFull:
+            self.shed += 1
+            logger.warning(f"Update pipeline overloaded; shed update {update.update_id}")
+            return False
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            enqueued_at, update = await queue.get()
+            try:
+                await self._process(update, enqueued_at)
+            finally:
+                queue.task_done()
+
+    async def _process(self, update, enqueued_at: float):
+        lag = time.monotonic() - enqueued_at
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self._lag_total += lag
+        try:
+            await self.application.process_update(update)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error processing update {update.update_id}: {e}")
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> dict:
+        handled = self.processed + self.failed
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "depth": self.depth,
+            "depth_per_worker": [queue.qsize() for queue in self._queues],
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "shed": self.shed,
+            "lag_last_s": self.last_lag,
+            "lag_max_s": self.max_lag,
+            "lag_avg_s": self._lag_total / handled if handled else 0.0,
+        }
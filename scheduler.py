@@ -1,33 +1,228 @@
 # scheduler.py
 
+import asyncio
 import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+import pytz
 from telegram.ext import Application
 import database as db
+import async_db as adb
 import laporan
+from cache import as_utc
+from notifier import Notifier
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
-async def send_auto_reports(application: Application):
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "1000"))
+# Stop picking up new users this many seconds into a run, so a cron
+# invocation returns before the platform kills it; the next run resumes.
+REPORT_TIME_BUDGET = float(os.getenv("REPORT_TIME_BUDGET", "50"))
+# Reports missed while the bot was down are still sent, late, if they fell due
+# within this many days; older ones are skipped
+REPORT_CATCHUP_DAYS = int(os.getenv("REPORT_CATCHUP_DAYS", "3"))
+# Sent reports are recorded in groups of this size
+REPORT_FLUSH_SIZE = 25
+# Queued notifications are dropped after this many failed runs
+NOTIFY_OUTBOX_MAX_ATTEMPTS = int(os.getenv("NOTIFY_OUTBOX_MAX_ATTEMPTS", "5"))
+
+HARI = ["isnin", "selasa", "rabu", "khamis", "jumaat", "sabtu", "ahad"]
+MASA_PATTERN = re.compile(r"([01]?\d|2[0-3])[:.]([0-5]\d)")
+
+def _next_due(entry: dict, after):
+    return db.next_report_due(entry['kekerapan'], entry['masa_minit'], entry['hari'], entry['zon_waktu'], after)
+
+async def send_auto_reports(application: Application, time_budget: float = REPORT_TIME_BUDGET, now=None) -> dict:
     """
     Fungsi ini akan dipanggil secara berkala (cth: oleh Vercel Cron Job)
-    untuk menghantar laporan kepada pengguna yang telah mengaktifkan auto-report.
+    untuk menghantar laporan kepada pengguna yang jadual auto-report mereka telah tiba.
+
+    Each tick reads only the schedules due by now, through the next_due_at
+    index, oldest first. A batch's period totals come from one grouped query
+    per zone and period, and the reports are sent concurrently through a
+    rate-limited Notifier. Each schedule then moves on to its next send; one
+    that is still due (several runs missed during downtime) is picked up again,
+    each report covering its own period, back to REPORT_CATCHUP_DAYS ago.
+    A failed send leaves its schedule as it was, so later ticks retry the same
+    report until it falls REPORT_CATCHUP_DAYS behind; a run that times out
+    leaves the rest due for the next tick.
     """
-    bot = application.bot
     logging.info("Running scheduled report job...")
-    with next(db.get_db()) as conn:
-        users_to_report = conn.query(db.User).filter(db.User.auto_laporan == 'on').all()
+    deadline = time.monotonic() + time_budget
+    notifier = Notifier(application.bot)
+    now = now or datetime.now(pytz.utc)
+    earliest = now - timedelta(days=REPORT_CATCHUP_DAYS)
+    advances = []
+    result = {"sent": 0, "failed": 0, "skipped": 0, "complete": False}
+
+    async def flush():
+        if advances:
+            batch = advances[:]
+            advances.clear()
+            async with adb.AsyncSessionLocal() as conn:
+                await adb.advance_report_schedules(conn, batch)
+
+    def advance(entry, due, sent_at, next_due=None):
+        advances.append(dict(
+            user_id=entry['user_id'], due=entry['next_due_at'], next_due=next_due or _next_due(entry, due),
+            sent_at=sent_at
+        ))
+
+    async def deliver(entry, due, report_text):
+        if await notifier.send(entry['telegram_id'], report_text):
+            advance(entry, due, datetime.now(pytz.utc))
+            result["sent"] += 1
+        else:
+            # Still due: the keyset cursor moves past it in this run, the next tick retries it
+            result["failed"] += 1
+        if len(advances) >= REPORT_FLUSH_SIZE:
+            await flush()
+
+    after = None
+    try:
+        while time.monotonic() < deadline:
+            # Recorded first, so schedules still due after their advance come round again in this run
+            await flush()
+            async with adb.AsyncSessionLocal() as conn:
+                batch = await adb.get_due_schedules(conn, now, after, REPORT_BATCH_SIZE)
+            if not batch:
+                result["complete"] = True
+                break
+            after = (batch[-1]['next_due_at'], batch[-1]['user_id'])
+
+            # Group by zone and period, so users sharing them share one totals query
+            groups = {}
+            for entry in batch:
+                due = as_utc(entry['next_due_at'])
+                if due < earliest:
+                    due = _next_due(entry, earliest)
+                    if due > now:
+                        advance(entry, due, None, next_due=due)
+                        result["skipped"] += 1
+                        continue
+                today = due.astimezone(pytz.timezone(entry['zon_waktu'])).date()
+                title, start_date, end_date = laporan.report_period(entry['kekerapan'], today)
+                groups.setdefault((entry['zon_waktu'], start_date, end_date), []).append((entry, due, title))
+
+            reports = []
+            async with adb.AsyncSessionLocal() as conn:
+                for (zon_waktu, start_date, end_date), members in groups.items():
+                    user_ids = [entry['user_id'] for entry, _, _ in members]
+                    totals = await adb.get_period_totals(conn, user_ids, zon_waktu, start_date, end_date)
+                    reports.extend(
+                        (entry, due, laporan.format_report(title, totals[entry['user_id']], entry['balance']))
+                        for entry, due, title in members
+                    )
+
+            pending = set()
+            for entry, due, report_text in reports:
+                if time.monotonic() >= deadline:
+                    break
+                pending.add(asyncio.create_task(deliver(entry, due, report_text)))
+                if len(pending) >= notifier.concurrency * 2:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if pending:
+                await asyncio.wait(pending)
+    finally:
+        await flush()
+
+    logging.info(f"Scheduled report job: {result}")
+    return result
+
+def parse_schedule_args(args) -> dict:
+    """
+    Parses the options after /autolaporan into dict(action[, changes]): none
+    (status), `off`, `on`, `zon <Area/City>`, or a kekerapan followed by any of
+    a day (a weekday for mingguan; 1-31 or `akhir` for bulanan), a time HH:MM
+    and a timezone. changes holds the fields for db.set_report_schedule.
+    Raises ValueError on anything else.
+    """
+    words = list(args or [])
+    if not words:
+        return dict(action='status')
+    first = words[0].lower()
+    if first in ('off', 'tutup') and len(words) == 1:
+        return dict(action='off')
+    if first in ('on', 'buka') and len(words) == 1:
+        return dict(action='on', changes={})
+    if first == 'zon' and len(words) == 2:
+        return dict(action='zon', changes=dict(zon_waktu=_parse_zone(words[1])))
+    if first not in db.KEKERAPAN:
+        raise ValueError(f"Unknown option {first!r}")
+
+    changes = dict(kekerapan=first)
+    for word in words[1:]:
+        lowered = word.lower()
+        masa = MASA_PATTERN.fullmatch(lowered)
+        if masa and 'masa_minit' not in changes:
+            changes['masa_minit'] = int(masa.group(1)) * 60 + int(masa.group(2))
+        elif first == 'mingguan' and lowered in HARI and 'hari' not in changes:
+            changes['hari'] = HARI.index(lowered)
+        elif first == 'bulanan' and (lowered == 'akhir' or lowered.isdigit() and 1 <= int(lowered) <= 31) \
+                and 'hari' not in changes:
+            changes['hari'] = 31 if lowered == 'akhir' else int(lowered)
+        elif '/' in word or word.upper() == 'UTC':
+            changes['zon_waktu'] = _parse_zone(word)
+        else:
+            raise ValueError(f"Unexpected {word!r} for {first}")
+    return dict(action='set', changes=changes)
+
+def _parse_zone(word: str) -> str:
+    try:
+        return pytz.timezone(word).zone
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f"Unknown timezone {word!r}")
+
+def describe_schedule(schedule) -> str:
+    """The /autolaporan status text for a ReportSchedule (or None)."""
+    if schedule is None or schedule.next_due_at is None:
+        return "🗓️ Auto laporan: <b>Tidak aktif</b>"
+    masa = f"{schedule.masa_minit // 60:02d}:{schedule.masa_minit % 60:02d}"
+    if schedule.kekerapan == 'mingguan':
+        bila = f"Mingguan, setiap {HARI[schedule.hari].capitalize()}"
+    elif schedule.kekerapan == 'bulanan':
+        bila = "Bulanan, hari terakhir setiap bulan" if schedule.hari >= 31 else f"Bulanan, setiap {schedule.hari} haribulan"
+    else:
+        bila = "Harian"
+    tz = pytz.timezone(schedule.zon_waktu)
+    seterusnya = as_utc(schedule.next_due_at).astimezone(tz).strftime("%d %b %Y, %I:%M %p")
+    return (
+        f"🗓️ Auto laporan: <b>{bila}</b> pada {masa} ({schedule.zon_waktu})\n"
+        f"Laporan seterusnya: {seterusnya}"
+    )
+
+async def deliver_pending_notifications(application: Application, batch_size: int = 1000) -> dict:
+    """
+    Drains the pending_notifications outbox concurrently through a Notifier.
+    Delivered rows are deleted; failed ones stay queued for the next run
+    until they reach NOTIFY_OUTBOX_MAX_ATTEMPTS.
+    """
+    notifier = Notifier(application.bot)
+    result = {"notified": 0, "failed": 0, "dropped": 0}
+    after_id = 0
+    while True:
+        async with adb.AsyncSessionLocal() as conn:
+            pending = await adb.get_pending_notifications(conn, after_id, batch_size)
+        if not pending:
+            break
+        after_id = pending[-1].id
 
-    for user in users_to_report:
-        try:
-            report_text = laporan.generate_report_text(user.id, 'harian')
-            await bot.send_message(chat_id=user.telegram_id, text=report_text)
-            logging.info(f"Sent daily report to user {user.telegram_id}")
-        except Exception as e:
-            logging.error(f"Failed to send report to {user.telegram_id}: {e}")
+        outcomes = await asyncio.gather(*(notifier.send(n.telegram_id, n.mesej) for n in pending))
+        sent_ids = [n.id for n, ok in zip(pending, outcomes) if ok]
+        failed_ids = [n.id for n, ok in zip(pending, outcomes) if not ok]
+        async with adb.AsyncSessionLocal() as conn:
+            result["dropped"] += await adb.complete_notifications(conn, sent_ids, failed_ids, NOTIFY_OUTBOX_MAX_ATTEMPTS)
+        result["notified"] += len(sent_ids)
+        result["failed"] += len(failed_ids)
+        if len(pending) < batch_size:
+            break
+    return result
 
 # Nota: Untuk Vercel, kita tidak akan menjalankan scheduler secara langsung.
-# Sebaliknya, kita akan setup Cron Job di vercel.json untuk trigger satu endpoint
+# Sebaliknya, Cron Job di vercel.json akan trigger endpoint /api/cron/auto_reports
 # yang akan menjalankan fungsi send_auto_reports.
@@ -0,0 +1,48 @@
+# startup_timing.py
+"""
+Cold-start timing. main.py marks each phase of module import and startup()
+as it goes; report() breaks the total down by phase. Import this module
+first so the clock starts as early as possible.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+STARTED_AT = time.perf_counter()
+phases = []  # (name, seconds), in order
+_last = STARTED_AT
+
+
+def mark(name: str):
+    """Records the time since the previous mark as phase `name`."""
+    global _last
+    now = time.perf_counter()
+    phases.append((name, now - _last))
+    _last = now
+
+
+@contextmanager
+def phase(name: str):
+    """Times a block as phase `name`; time outside blocks is not attributed."""
+    global _last
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _last = time.perf_counter()
+        phases.append((name, _last - started))
+
+
+def report() -> dict:
+    total = sum(seconds for _, seconds in phases)
+    return {
+        "total_ms": round(total * 1000, 2),
+        "phases": [{"phase": name, "ms": round(seconds * 1000, 2)} for name, seconds in phases],
+    }
+
+
+def log_report():
+    breakdown = ", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in phases)
+    logger.info(f"Cold start {report()['total_ms']:.1f}ms: {breakdown}")
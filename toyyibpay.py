@@ -1,64 +1,215 @@
 import os
-import requests
+import asyncio
+import logging
+import random
+import time
+import httpx
 from dotenv import load_dotenv
+import metrics
 from datetime import datetime
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # --- Toyyibpay Configuration ---
-TOYYIBPAY_API_URL = "https://toyyibpay.com/index.php/api/createBill"
+# Point TOYYIBPAY_BASE_URL at benchmarks/toyyibpay_stub.py to run the upgrade flow offline
+TOYYIBPAY_BASE_URL = os.getenv("TOYYIBPAY_BASE_URL", "https://toyyibpay.com").rstrip("/")
+TOYYIBPAY_API_URL = f"{TOYYIBPAY_BASE_URL}/index.php/api/createBill"
 TOYYIBPAY_SECRET_KEY = os.getenv("TOYYIBPAY_SECRET_KEY")
 TOYYIBPAY_CATEGORY_CODE = os.getenv("TOYYIBPAY_CATEGORY_CODE")
 
 # --- IMPORTANT: Update these placeholders ---
 # This should be your Vercel app's URL. Toyyibpay will send payment status updates here.
-APP_BASE_URL = os.getenv("VERCEL_URL") 
+APP_BASE_URL = os.getenv("VERCEL_URL")
+TOYYIBPAY_CALLBACK_URL = os.getenv("TOYYIBPAY_CALLBACK_URL", f"https://{APP_BASE_URL}/webhook/toyyibpay")
 # Your telegram bot username
 TELEGRAM_BOT_USERNAME = os.getenv("TELEGRAM_BOT_USERNAME")
 
-def create_bill(user_telegram_id: int, user_name: str, user_email: str, amount: float) -> dict:
+# --- Client Tuning ---
+CONNECT_TIMEOUT = float(os.getenv("TOYYIBPAY_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("TOYYIBPAY_READ_TIMEOUT", "10"))
+MAX_ATTEMPTS = int(os.getenv("TOYYIBPAY_MAX_ATTEMPTS", "3"))
+MAX_CONNECTIONS = int(os.getenv("TOYYIBPAY_MAX_CONNECTIONS", "20"))
+BREAKER_THRESHOLD = int(os.getenv("TOYYIBPAY_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET = float(os.getenv("TOYYIBPAY_BREAKER_RESET", "30"))
+
+# Gateway replies worth another attempt
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
     """
-    Creates a new bill using the Toyyibpay API and returns the payment URL.
+    Opens after `threshold` consecutive failures and rejects calls for `reset_timeout`
+    seconds; then lets a single trial call through (half-open) to decide whether
+    to close again.
     """
-    if not TOYYIBPAY_SECRET_KEY or not TOYYIBPAY_CATEGORY_CODE:
-        return {"error": "Toyyibpay credentials are not set in the .env file."}
-
-    # The amount must be in cents
-    bill_amount_cents = int(amount * 100)
-
-    # A unique reference number for this transaction
-    bill_external_reference_no = f"MYK-{user_telegram_id}-{int(datetime.now().timestamp())}"
-
-    payload = {
-        'userSecretKey': TOYYIBPAY_SECRET_KEY,
-        'categoryCode': TOYYIBPAY_CATEGORY_CODE,
-        'billName': 'MyKewanganBot Premium',
-        'billDescription': 'Langganan 1 Bulan MyKewanganBot Premium',
-        'billPriceSetting': 1, # 1 for fixed price
-        'billPayorInfo': 1, # 1 to require payor info
-        'billAmount': bill_amount_cents,
-        'billReturnUrl': f'https://t.me/{TELEGRAM_BOT_USERNAME}',
-        'billCallbackUrl': f'https://{APP_BASE_URL}/webhook/toyyibpay',
-        'billExternalReferenceNo': bill_external_reference_no,
-        'billTo': user_name,
-        'billEmail': user_email,
-        'billPhone': '0123456789' # A placeholder phone number
-    }
-
-    try:
-        response = requests.post(TOYYIBPAY_API_URL, data=payload)
-        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-        
-        # Toyyibpay returns a list with a single dictionary
-        result = response.json()
-        if result and isinstance(result, list) and 'BillCode' in result[0]:
-            bill_code = result[0]['BillCode']
-            payment_url = f"https://toyyibpay.com/{bill_code}"
-            return {"success": True, "payment_url": payment_url, "bill_code": bill_code}
-        else:
-            return {"error": f"Failed to create bill. API response: {result}"}
-
-    except requests.exceptions.RequestException as e:
-        return {"error": f"Could not connect to Toyyibpay API: {e}"}
-    except Exception as e:
-        return {"error": f"An unexpected error occurred: {e}"}
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, reset_timeout: float = BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> bool:
+        """Raises CircuitOpenError if the call may not go out; returns whether it is the trial call."""
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial_running):
+            raise CircuitOpenError("Toyyibpay circuit is open")
+        if state == "half-open":
+            self._trial_running = True
+            return True
+        return False
+
+    def end_trial(self):
+        """Lets the next call be the trial if this one ended without a verdict (e.g. it raised)."""
+        self._trial_running = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning("Toyyibpay circuit opened after repeated failures")
+            self.opened_at = time.monotonic()
+
+
+class ToyyibpayClient:
+    """Async createBill client sharing one pooled httpx connection pool."""
+
+    def __init__(self, api_url: str = TOYYIBPAY_API_URL, max_attempts: int = MAX_ATTEMPTS,
+                 breaker: CircuitBreaker = None):
+        self.api_url = api_url
+        self.max_attempts = max_attempts
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, payload: dict) -> httpx.Response:
+        """
+        POSTs with bounded retries. Only failures where the bill cannot have been
+        created are retried (connection errors, 429/5xx gateway replies); a read
+        timeout is not, since createBill is not idempotent. A PoolTimeout means
+        our own connection pool is full, not that Toyyibpay is down: it is
+        raised at once and not counted against the breaker.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            trial = self.breaker.before_call()
+            started = time.perf_counter()
+            try:
+                response = await self.client.post(self.api_url, data=payload)
+            except httpx.PoolTimeout:
+                metrics.observe_outbound("toyyibpay", "createBill", time.perf_counter() - started, failed=True)
+                raise
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                metrics.observe_outbound("toyyibpay", "createBill", time.perf_counter() - started, failed=True)
+                self.breaker.record_failure()
+                if attempt == self.max_attempts:
+                    raise
+                logger.warning(f"Toyyibpay connect failed (attempt {attempt}): {e}")
+            except httpx.HTTPError:
+                metrics.observe_outbound("toyyibpay", "createBill", time.perf_counter() - started, failed=True)
+                self.breaker.record_failure()
+                raise
+            else:
+                metrics.observe_outbound("toyyibpay", "createBill", time.perf_counter() - started,
+                                         failed=response.status_code >= 400)
+                if response.status_code in RETRY_STATUSES and attempt < self.max_attempts:
+                    self.breaker.record_failure()
+                    logger.warning(f"Toyyibpay returned {response.status_code} (attempt {attempt})")
+                elif response.status_code in RETRY_STATUSES or response.status_code >= 500:
+                    self.breaker.record_failure()
+                    return response
+                else:
+                    self.breaker.record_success()
+                    return response
+            finally:
+                if trial:
+                    self.breaker.end_trial()
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1) * (1 + random.random()))
+
+    async def create_bill(self, user_telegram_id: int, user_name: str, user_email: str, amount: float) -> dict:
+        """
+        Creates a new bill using the Toyyibpay API and returns the payment URL.
+        """
+        if not TOYYIBPAY_SECRET_KEY or not TOYYIBPAY_CATEGORY_CODE:
+            return {"error": "Toyyibpay credentials are not set in the .env file."}
+
+        # The amount must be in cents
+        bill_amount_cents = int(round(amount * 100))
+
+        # A unique reference number for this transaction
+        bill_external_reference_no = f"MYK-{user_telegram_id}-{int(datetime.now().timestamp())}"
+
+        payload = {
+            'userSecretKey': TOYYIBPAY_SECRET_KEY,
+            'categoryCode': TOYYIBPAY_CATEGORY_CODE,
+            'billName': 'MyKewanganBot Premium',
+            'billDescription': 'Langganan 1 Bulan MyKewanganBot Premium',
+            'billPriceSetting': 1, # 1 for fixed price
+            'billPayorInfo': 1, # 1 to require payor info
+            'billAmount': bill_amount_cents,
+            'billReturnUrl': f'https://t.me/{TELEGRAM_BOT_USERNAME}',
+            'billCallbackUrl': TOYYIBPAY_CALLBACK_URL,
+            'billExternalReferenceNo': bill_external_reference_no,
+            'billTo': user_name,
+            'billEmail': user_email,
+            'billPhone': '0123456789' # A placeholder phone number
+        }
+
+        try:
+            response = await self._post(payload)
+            response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
+
+            # Toyyibpay returns a list with a single dictionary
+            result = response.json()
+            if result and isinstance(result, list) and 'BillCode' in result[0]:
+                bill_code = result[0]['BillCode']
+                payment_url = f"{TOYYIBPAY_BASE_URL}/{bill_code}"
+                return {"success": True, "payment_url": payment_url, "bill_code": bill_code}
+            else:
+                return {"error": f"Failed to create bill. API response: {result}"}
+
+        except CircuitOpenError as e:
+            return {"error": f"Toyyibpay is unavailable: {e}"}
+        except httpx.HTTPError as e:
+            return {"error": f"Could not connect to Toyyibpay API: {e}"}
+        except Exception as e:
+            return {"error": f"An unexpected error occurred: {e}"}
+
+
+client = ToyyibpayClient()
+
+async def create_bill(user_telegram_id: int, user_name: str, user_email: str, amount: float) -> dict:
+    return await client.create_bill(user_telegram_id, user_name, user_email, amount)